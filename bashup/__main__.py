@@ -1,7 +1,18 @@
 """Bashup
 
-Usage: bashup (--in=FILE|-i FILE) [--out=FILE|-o FILE]
-       bashup (--run=FILE|-r FILE) [-- <arg>...]
+Usage: bashup (--in=FILE|-i FILE) [--out=FILE|-o FILE] [--watch] [--packrat-size=N] [--keep-packrat] [--packrat-stats]
+                [--profile=FORMAT] [--arg-parser=STYLE] [--fn-layout=LAYOUT] [--instrument]
+                [--drop-unused] [--keep=NAMES] [--minify] [--depfile=FILE] [--source-map=FILE]
+       bashup (--run=FILE|-r FILE) [--no-cache] [--exec] [--packrat-size=N] [--packrat-stats] [--profile=FORMAT]
+                [--arg-parser=STYLE] [--fn-layout=LAYOUT] [--instrument] [--drop-unused] [--keep=NAMES]
+                [--minify] [-- <arg>...]
+       bashup build <src_dir> <out_dir> [--jobs=N] [--watch] [--packrat-size=N] [--keep-packrat] [--packrat-stats]
+                [--profile=FORMAT] [--arg-parser=STYLE] [--fn-layout=LAYOUT] [--instrument]
+                [--drop-unused] [--keep=NAMES] [--minify]
+       bashup report <trace>...
+       bashup map <source_map> [<log>...]
+       bashup serve [--socket=FILE] [--packrat-size=N] [--keep-packrat]
+       bashup serve (--stats|--stop) [--socket=FILE]
        bashup -h | --help | --version
 
 Options:
@@ -10,56 +21,801 @@ Options:
   -i FILE --in=FILE   The bashup file to compile to bash.
   -o FILE --out=FILE  Output compiled bash to this file. [default: -]
   -r FILE --run=FILE  Run the script directly. Args are passed to the script.
+  --no-cache          Compile the script even if it is in the compile cache,
+                      and do not add it to the cache.
+  --exec              Replace the bashup process with bash instead of waiting
+                      for bash to finish.
+  -j N --jobs=N       Number of files to compile in parallel. [default: 1]
+  --watch             Keep running, and recompile whenever a source changes.
+  --packrat-size=N    Entries in the parser's memoization (packrat) cache:
+                      0 disables it and "unbounded" lifts the limit.
+                      [default: 128]
+  --keep-packrat      Keep the packrat cache between documents instead of
+                      clearing it before each one.
+  --packrat-stats     Print packrat cache hits, misses and (estimated)
+                      evictions to stderr when done.
+  --arg-parser=STYLE  How generated functions parse their arguments: "loop"
+                      tests each against an if/elif chain and shifts it off;
+                      "case" uses one case statement and never shifts, which
+                      is much faster with many arguments. [default: loop]
+  --fn-layout=LAYOUT  How generated functions reach their body: "wrapper"
+                      calls a second __-prefixed function holding the body;
+                      "inline" puts the body in the same function, saving a
+                      call per invocation. [default: wrapper]
+  --instrument        Make generated functions record each call and return
+                      to the file descriptor in $BASHUP_TRACE_FD, if set.
+                      Implies --fn-layout=wrapper.
+  --drop-unused       Leave out functions which nothing calls, so bash has
+                      less to parse. The whole file is compiled at once.
+  --keep=NAMES        Comma-separated functions which --drop-unused must
+                      keep, because they're called by names built at runtime.
+  --minify            Leave out the generated usage comments and all blank
+                      lines outside of strings and heredocs.
+  --depfile=FILE      Also write a Makefile rule to FILE making the output
+                      depend on the input and every file it @inserts.
+  --source-map=FILE   Also write a JSON source map to FILE giving the source
+                      line of each line of the output. The whole file is
+                      compiled at once.
+  --socket=FILE       The compile server's socket. Defaults to $BASHUP_SOCKET,
+                      or bashup-UID/server.sock in $XDG_RUNTIME_DIR or /tmp.
+  --stats             Print the running server's request counts and latency
+                      percentiles.
+  --stop              Stop the running server.
+  --profile=FORMAT    Print the time spent in each phase of compilation, and
+                      counts such as functions compiled and bytes read and
+                      written, to stderr when done. FORMAT is "table" (the
+                      default when just --profile is given) or "json".
+
+The build command compiles every *.bashup file under <src_dir> to a *.sh
+file under <out_dir>, skipping files which are unchanged since the last build.
+
+The report command summarizes traces recorded by instrumented functions (for
+example: BASHUP_TRACE_FD=3 ./script.sh 3>trace.log) as a table of calls and
+time spent in each function. A <trace> of "-" is read from stdin.
+
+The map command rewrites the FILE:LINE references to a compiled script in
+xtrace (for example: PS4='+${BASH_SOURCE}:${LINENO} ' bash -x script.sh) or
+profiler output into references to its bashup source, using the source map
+written with --source-map. The <log>s are read from stdin if none are given.
+
+The serve command runs a compile server, which keeps the compiler loaded
+between compiles. While it's running, -i and -r have it do their compiling,
+and fall back to compiling themselves if it can't.
 
 """
-import subprocess
+import collections
+import contextlib
+import functools
+import io
+import os
 import sys
+import time
 
 import docopt
-import temporary
 
-from .compile import bash
+from . import __version__
+
+
+# Must match parse.DEFAULT_PACKRAT_CACHE_SIZE; parse is only imported if needed.
+__DEFAULT_PACKRAT_SIZE = 128
+
+__DEFAULT_PROFILE_FORMAT = 'table'
+
+# Must match compile.options.DEFAULT_OPTIONS, which is only imported if needed.
+__DEFAULT_ARG_PARSER = 'loop'
+__DEFAULT_FN_LAYOUT = 'wrapper'
+
+
+#
+# Lazy Imports
+#
+# Modules which only some invocations need (the compiler, with pyparsing and
+# jinja2, above all) are imported on first use, which keeps startup fast for
+# short-lived scripts and for cache hits.
+#
+
+def __compile_to_bash(bashup_str, options=None):
+    compiled = __compile_remotely(bashup_str, options)
+    if compiled is not None:
+        return compiled
+
+    from .compile import bash
+    if options is None:
+        return bash.compile_to_bash(bashup_str)
+    return bash.compile_to_bash(bashup_str, compilers=bash.compilers_for(options))
 
 
-def compile_file(in_file, out_file, compile_fn=bash.compile_to_bash):
+def __compile_remotely(bashup_str, options):
+    # Once the parser is loaded here (by a profile, packrat options or an
+    # earlier compile), there's nothing left to save by asking a server.
+    if __profile() is not None or __package__ + '.parse' in sys.modules:
+        return None
+    from . import server
+    return server.compile_remotely(bashup_str, options)
+
+
+def __compile_stream(lines, compile_fn, definitions_fn):
+    from .compile import bash
+    return bash.compile_stream(lines, compile_fn=compile_fn, definitions_fn=definitions_fn)
+
+
+def __subprocess_call(args, **kwargs):
+    import subprocess
+    return subprocess.call(args, **kwargs)
+
+
+def __temp_file(content):
+    import temporary
+    return temporary.temp_file(content)
+
+
+#
+# Public Functions
+#
+
+# noinspection PyClassHasNoInit
+class Sidecars(collections.namedtuple('Sidecars', ('depfile', 'source_map'))):
+    """
+    The files compile_file() writes alongside its output, where they're not
+    None.
+    """
+    __slots__ = ()
+
+
+NO_SIDECARS = Sidecars(depfile=None, source_map=None)
+
+
+def compile_file(in_file, out_file, compile_fn=__compile_to_bash, options=None, sidecars=NO_SIDECARS):
     """
     Compile the in_file and write it to the out_file. If out_file is
-    '-', then the compiled code is written to stdout instead.
+    '-', then the compiled code is written to stdout instead. If given,
+    options (a compile.options.Options) are passed on to compile_fn.
+
+    The file is read, compiled and written a chunk at a time, so it's never
+    held in memory all at once, unless the options need the whole document
+    (to find the functions nothing calls, say).
+
+    Files named by @insert statements are inserted, and if sidecars.depfile
+    is given, a Makefile rule making out_file depend on them is written to it.
+
+    If sidecars.source_map is given, a sourcemap.SourceMap of the output is
+    written to it as JSON. The whole document is then compiled at once, by the compiler
+    itself rather than compile_fn, since the map is made from what it edits.
     """
+    profile = __profile()
+    whole_document = options is not None and options.needs_whole_document()
+    dependencies = []
+    compile_fn, definitions_fn = __with_inserts(
+        __with_options(compile_fn, options), in_file, whole_document, dependencies)
+
     with open(str(in_file)) as f:
-        in_str = f.read()
+        if profile:
+            profile.count('bytes_in', os.fstat(f.fileno()).st_size)
+
+        lines = profile.timed(f, 'read') if profile else f
+
+        if sidecars.source_map is not None:
+            document = __compile_document(''.join(lines), in_file, options, dependencies)
+            __write_source_map(sidecars.source_map, document, in_file, out_file)
+            chunks = [document.text()]
+        elif whole_document:
+            chunks = [compile_fn(''.join(lines))]
+        else:
+            chunks = __compile_stream(lines, compile_fn, definitions_fn)
+
+        if str(out_file) == '-':
+            for chunk in chunks:
+                __write_chunk(profile, sys.stdout, chunk)
+            __write_chunk(profile, sys.stdout, '\n')
+        else:
+            if __is_same_file(in_file, out_file):
+                # Compile everything before the input is truncated.
+                chunks = list(chunks)
+
+            with open(str(out_file), 'wb') as out:
+                for chunk in chunks:
+                    __write_chunk(profile, out, chunk.encode('utf-8'))
+
+    if sidecars.depfile is not None:
+        __write_depfile(sidecars.depfile, in_file, out_file, dependencies)
+
+
+# noinspection PyClassHasNoInit
+class RunMode(collections.namedtuple('RunMode', ('use_cache', 'cache_dir', 'replace_process'))):
+    """
+    How run_file() runs a script: from the compile cache (in cache_dir, or
+    the default directory if that's None) if use_cache is set, and in place
+    of the current process if replace_process is set.
+    """
+    __slots__ = ()
+
+
+# noinspection PyClassHasNoInit
+class RunHooks(collections.namedtuple('RunHooks', (
+        'compile_fn', 'run_fn', 'temp_file_ctx', 'exec_fn', 'memfd_create'))):
+    """
+    The functions run_file() compiles, writes and runs scripts with (None for
+    a memfd_create which isn't available).
+    """
+    __slots__ = ()
+
 
-    out_str = compile_fn(in_str)
+DEFAULT_RUN_MODE = RunMode(use_cache=False, cache_dir=None, replace_process=False)
 
-    if str(out_file) == '-':
-        print(out_str)  # pylint: disable=superfluous-parens
-    else:
-        with open(str(out_file), 'wb') as f:
-            f.write(out_str.encode('utf-8'))
+DEFAULT_RUN_HOOKS = RunHooks(
+    compile_fn=__compile_to_bash,
+    run_fn=__subprocess_call,
+    temp_file_ctx=__temp_file,
+    exec_fn=os.execvp,
+    memfd_create=getattr(os, 'memfd_create', None))
 
 
-def run_file(to_run, args, compile_fn=bash.compile_to_bash, run_fn=subprocess.call, temp_file_ctx=temporary.temp_file):
+def run_file(to_run, args, options=None, mode=DEFAULT_RUN_MODE, hooks=DEFAULT_RUN_HOOKS):
     """
     Compile the to_run file, write it to a temporary file, and run it
     with bash. Any additional parameters to bashup are passed along to
-    the script.
+    the script. See RunMode for the mode and RunHooks for the hooks.
+
+    If mode.use_cache is set, the compiled script is taken from (or added to)
+    the compile cache and run from there instead of from a temporary file.
+
+    Where memfd_create is available, the script never touches the disk: bash
+    reads it from an in-memory file through /dev/fd, which is also what $0 and
+    BASH_SOURCE are set to. Otherwise a temporary file is used.
+
+    If mode.replace_process is set, bash replaces the current process by way
+    of exec_fn, so no Python process stays resident while the script runs.
+    Without a cached script to point bash at, the script is handed over as an
+    in-memory or already-unlinked temporary file which bash opens through
+    /dev/fd.
+
+    If given, options (a compile.options.Options) are passed on to
+    compile_fn, and are part of the cache key. If they instrument the
+    script, the file descriptor in $BASHUP_TRACE_FD is kept open for bash.
     """
     with open(str(to_run)) as f:
         run_str = f.read()
 
-    with temp_file_ctx(compile_fn(run_str)) as script:
-        return run_fn(('bash', str(script)) + tuple(args))
+    if '@insert' in run_str:
+        # Expanded first, so the cache key covers the inserted files too.
+        from .compile import insert
+        run_str = insert.expand_inserts(run_str, to_run).text
+
+    compile_fn = __with_options(hooks.compile_fn, options)
+    trace_fds = __trace_fds(options)
+    run_kwargs = __keeping_fds(trace_fds)
+
+    if mode.use_cache:
+        from . import cache
+        script = cache.compiled_path(
+            run_str,
+            compile_fn,
+            directory=mode.cache_dir,
+            variant=options.cache_key() if options else '')
+        if script is not None:
+            if mode.replace_process:
+                return __exec_bash(hooks.exec_fn, script, args)
+            return hooks.run_fn(('bash', script) + tuple(args), **run_kwargs)
 
+    compiled = compile_fn(run_str)
+    in_memory = __in_memory_script(hooks.memfd_create, compiled)
 
-def main(argv=None, run_fn=run_file, compile_fn=compile_file):
-    args = docopt.docopt(__doc__, argv, version='Bashup 2.0.2')
+    if mode.replace_process:
+        with in_memory or __unlinked_script(compiled) as script:
+            return __exec_bash(hooks.exec_fn, __fd_path(script), args)
+
+    if in_memory is not None:
+        with in_memory as script:
+            return hooks.run_fn(
+                ('bash', __fd_path(script)) + tuple(args),
+                pass_fds=(script.fileno(),) + trace_fds)
+
+    with hooks.temp_file_ctx(compiled) as script:
+        return hooks.run_fn(('bash', str(script)) + tuple(args), **run_kwargs)
+
+
+def watch_file(in_file, out_file, compile_fn=compile_file, changes_fn=None, options=None):
+    """
+    Compile the in_file to the out_file, then recompile it every time it,
+    or a file it @inserts, changes, until interrupted.
+    """
+    if changes_fn is None:
+        from . import watch
+        changes_fn = watch.changes
+
+    compile_fn = __with_options(compile_fn, options)
+    compile_fn(in_file=in_file, out_file=out_file)
+
+    try:
+        while True:
+            inserted = __inserted_files(in_file)
+            for _ in changes_fn([str(in_file)] + inserted):
+                start_time = time.time()
+                compile_fn(in_file=in_file, out_file=out_file)
+                sys.stderr.write('Compiled {in_file} in {ms:.1f}ms\n'.format(
+                    in_file=in_file,
+                    ms=(time.time() - start_time) * 1000))
+                if __inserted_files(in_file) != inserted:
+                    # Watch whichever files are inserted now.
+                    break
+            else:
+                break
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def build_dir(src_dir, out_dir, jobs, options=None):
+    """
+    Compile the changed bashup files under src_dir into out_dir and print a
+    summary. Returns non-zero if any file failed to compile.
+    """
+    from . import build
+    return __report_build(build.build(src_dir=src_dir, out_dir=out_dir, jobs=jobs, options=options))
+
+
+def watch_dir(src_dir, out_dir, jobs, changes_fn=None, options=None):
+    """
+    Build src_dir into out_dir as build_dir() does, then keep running and
+    rebuild just the changed files (and the sources which @insert them)
+    every time sources or the files they insert change, until interrupted.
+    """
+    from . import build
 
-    if args['--in'] is None:
-        return run_fn(to_run=args['--run'], args=tuple(args['<arg>']))
-    else:
-        compile_fn(in_file=args['--in'], out_file=args['--out'])
+    status = build_dir(src_dir=src_dir, out_dir=out_dir, jobs=jobs, options=options)
+
+    if changes_fn is None:
+        from . import watch
+        changes_fn = watch.changes
+
+    try:
+        while True:
+            inserted = build.inserted_files(src_dir, out_dir)
+            changes = changes_fn(
+                [str(src_dir)] + inserted,
+                predicate=lambda path, inserted=frozenset(inserted): (
+                    path.endswith(build.SOURCE_SUFFIX) or path in inserted))
+            for changed in changes:
+                status = __report_build(build.build(
+                    src_dir=src_dir,
+                    out_dir=out_dir,
+                    only=[os.path.relpath(p, str(src_dir)) for p in changed],
+                    options=options))
+                if build.inserted_files(src_dir, out_dir) != inserted:
+                    # Watch whichever files are inserted now.
+                    break
+            else:
+                break
+    except KeyboardInterrupt:
+        pass
+
+    return status
+
+
+def report_traces(trace_files):
+    """
+    Print a table of the calls and time spent in each function, gathered
+    from the given trace files ('-' for stdin) written by instrumented
+    functions.
+    """
+    from . import trace
+
+    lines = []
+    for trace_file in trace_files:
+        if str(trace_file) == '-':
+            lines.extend(sys.stdin)
+        else:
+            with open(str(trace_file)) as f:
+                lines.extend(f)
+
+    print(trace.report(trace.summarize(lines)))  # pylint: disable=superfluous-parens
+    return 0
+
+
+def map_lines(source_map_file, log_files):
+    """
+    Print the given log files (or stdin, if there are none) with every
+    reference to the compiled script in the source map file replaced by a
+    reference to its source.
+    """
+    from . import sourcemap
+
+    with open(str(source_map_file)) as f:
+        try:
+            source_map = sourcemap.loads(f.read())
+        except (KeyError, TypeError, ValueError):
+            sys.stderr.write('{path}: not a bashup source map\n'.format(path=source_map_file))
+            return 1
+
+    for log_file in log_files or ('-',):
+        if str(log_file) == '-':
+            sys.stdout.writelines(sourcemap.translate(sys.stdin, source_map))
+        else:
+            with open(str(log_file)) as f:
+                sys.stdout.writelines(sourcemap.translate(f, source_map))
+
+    return 0
+
+
+def serve_compiler(socket_path=None, stats=False, stop=False):
+    """
+    Run a compile server on the socket until it's stopped or interrupted,
+    or, with stats or stop, ask the running server for its stats or to
+    stop. Returns non-zero if there's no server to ask, or one is already
+    running.
+    """
+    from . import server
+
+    if stats or stop:
+        try:
+            response = server.request(dict(op='stats' if stats else 'stop'), socket_path)
+        except server.ServerUnavailable as e:
+            sys.stderr.write('No compile server: {error}\n'.format(error=e))
+            return 1
+        if stats:
+            print(server.summarize(response['stats']))  # pylint: disable=superfluous-parens
         return 0
 
+    def ready():
+        sys.stderr.write('Serving on {path}\n'.format(path=socket_path or server.default_socket_path()))
+        sys.stderr.flush()
+
+    try:
+        served = server.serve(socket_path, ready_fn=ready)
+    except (server.AlreadyRunning, server.UnsafeSocket) as e:
+        sys.stderr.write('{error}\n'.format(error=e))
+        return 1
+
+    sys.stderr.write(served.summary() + '\n')
+    return 0
+
+
+# noinspection PyClassHasNoInit
+class Commands(collections.namedtuple('Commands', (
+        'run_fn', 'compile_fn', 'build_fn', 'watch_fn', 'watch_dir_fn', 'report_fn', 'map_fn', 'serve_fn'))):
+    """
+    The functions main() hands each command to.
+    """
+    __slots__ = ()
+
+
+DEFAULT_COMMANDS = Commands(
+    run_fn=run_file,
+    compile_fn=compile_file,
+    build_fn=build_dir,
+    watch_fn=watch_file,
+    watch_dir_fn=watch_dir,
+    report_fn=report_traces,
+    map_fn=map_lines,
+    serve_fn=serve_compiler)
+
+
+def main(argv=None, commands=DEFAULT_COMMANDS):
+    args = docopt.docopt(
+        __doc__,
+        __with_profile_format(sys.argv[1:] if argv is None else argv),
+        version='Bashup ' + __version__)
+
+    __configure_packrat(args)
+
+    try:
+        with __profiled(args['--profile']):
+            return __dispatch(args, commands)
+    finally:
+        if args['--packrat-stats']:
+            from . import parse
+            sys.stderr.write(parse.packrat_stats().summary() + '\n')
+
+
+#
+# Private Helpers
+#
+
+def __dispatch(args, commands):
+    if args['report']:
+        return commands.report_fn(trace_files=args['<trace>'])
+    if args['map']:
+        return commands.map_fn(source_map_file=args['<source_map>'], log_files=args['<log>'])
+    if args['serve']:
+        return commands.serve_fn(socket_path=args['--socket'], stats=args['--stats'], stop=args['--stop'])
+
+    # Options are only passed along when they differ from the defaults.
+    codegen = __codegen_kwargs(args)
+
+    if args['build']:
+        build_fn = commands.watch_dir_fn if args['--watch'] else commands.build_fn
+        return build_fn(
+            src_dir=args['<src_dir>'],
+            out_dir=args['<out_dir>'],
+            jobs=__jobs(args),
+            **codegen)
+    elif args['--in'] is None:
+        return commands.run_fn(
+            to_run=args['--run'],
+            args=tuple(args['<arg>']),
+            mode=DEFAULT_RUN_MODE._replace(use_cache=not args['--no-cache'], replace_process=args['--exec']),
+            **codegen)
+
+    return __compile_or_watch(args, commands, codegen)
+
+
+def __compile_or_watch(args, commands, codegen):
+    sidecars = Sidecars(depfile=args['--depfile'], source_map=args['--source-map'])
+    outputs = dict(sidecars=sidecars) if sidecars != NO_SIDECARS else {}
+
+    if args['--watch']:
+        if outputs:
+            codegen['compile_fn'] = functools.partial(commands.compile_fn, **outputs)
+        return commands.watch_fn(in_file=args['--in'], out_file=args['--out'], **codegen)
+
+    commands.compile_fn(in_file=args['--in'], out_file=args['--out'], **dict(codegen, **outputs))
+    return 0
+
+
+def __codegen_kwargs(args):
+    if (args['--arg-parser'], args['--fn-layout'], args['--instrument'], args['--drop-unused'],
+            args['--keep'], args['--minify']) == (__DEFAULT_ARG_PARSER, __DEFAULT_FN_LAYOUT, False, False, None, False):
+        return {}
+
+    from .compile import options
+
+    for flag, choices in (('--arg-parser', options.ARG_PARSERS), ('--fn-layout', options.FN_LAYOUTS)):
+        if args[flag] not in choices:
+            raise docopt.DocoptExit('{flag} must be one of: {choices}'.format(
+                flag=flag, choices=', '.join(choices)))
+
+    return dict(options=options.DEFAULT_OPTIONS._replace(
+        arg_parser=args['--arg-parser'],
+        fn_layout=args['--fn-layout'],
+        instrument=args['--instrument'],
+        drop_unused_fns=args['--drop-unused'],
+        keep=tuple(n.strip() for n in (args['--keep'] or '').split(',') if n.strip()),
+        minify=args['--minify']))
+
+
+def __jobs(args):
+    try:
+        jobs = int(args['--jobs'])
+    except ValueError:
+        jobs = 0
+    if jobs < 1:
+        raise docopt.DocoptExit('--jobs must be a positive number.')
+    return jobs
+
+
+def __report_build(result):
+    for path, error in result.failed:
+        sys.stderr.write('{path}: {error}\n'.format(path=path, error=error))
+    print(result.summary())  # pylint: disable=superfluous-parens
+    sys.stdout.flush()
+    return 1 if result.failed else 0
+
+
+def __keeping_fds(fds):
+    # Keyword arguments for subprocess.call() which keep the descriptors
+    # open in the child. Before Python 3.2 there's no pass_fds, so nothing is
+    # closed instead.
+    if not fds:
+        return {}
+    if sys.version_info < (3, 2):
+        return dict(close_fds=False)
+    return dict(pass_fds=fds)
+
+
+def __trace_fds(options):
+    try:
+        return (int(os.environ['BASHUP_TRACE_FD']),) if options and options.instrument else ()
+    except (KeyError, ValueError):
+        return ()
+
+
+def __inserted_files(in_file):
+    # The files in_file @inserts, as far as they can be found.
+    try:
+        with open(str(in_file)) as f:
+            bashup_str = f.read()
+    except (IOError, OSError):
+        return []
+
+    if '@insert' not in bashup_str:
+        return []
+
+    from .compile import insert
+    try:
+        return list(insert.expand_inserts(bashup_str, str(in_file)).dependencies)
+    except insert.InsertError:
+        return []
+
+
+def __with_inserts(compile_fn, path, whole_document, dependencies):
+    # Documents without an @insert never import the insert module. The paths
+    # of inserted files are added to dependencies. Returns the compile_fn and
+    # a definitions_fn for compile_stream() which also finds the alias and
+    # macro definitions in inserted files.
+    insert_cache = []
+
+    def get_insert_cache():
+        from .compile import insert
+        if not insert_cache:
+            insert_cache.append(insert.InsertCache())
+        return insert_cache[0]
+
+    def compile_with_inserts(bashup_str):
+        if '@insert' not in bashup_str:
+            return compile_fn(bashup_str)
+
+        from .compile import insert
+        expansion = insert.compile_inserts(
+            bashup_str, path, compile_fn, get_insert_cache(), whole_document=whole_document)
+        dependencies.extend(d for d in expansion.dependencies if d not in dependencies)
+        return expansion.text
+
+    def definitions_with_inserts(bashup_str):
+        if '@insert' in bashup_str:
+            from .compile import insert
+            bashup_str = insert.expand_inserts(bashup_str, path, get_insert_cache()).text
+
+        from .compile.elements import macro
+        return macro.definitions_in(bashup_str)
+
+    return compile_with_inserts, definitions_with_inserts
+
+
+def __compile_document(bashup_str, in_file, options, dependencies):
+    from .compile import bash
+
+    expanded = None
+    if '@insert' in bashup_str:
+        from .compile import insert
+        expanded, inserted = insert.expand_document(bashup_str, in_file)
+        dependencies.extend(d for d in inserted if d not in dependencies)
+        bashup_str = expanded.text()
+
+    return bash.compile_document(
+        bashup_str,
+        compilers=bash.ALL_COMPILERS if options is None else bash.compilers_for(options),
+        parent=expanded)
+
+
+def __write_source_map(source_map, document, in_file, out_file):
+    from . import sourcemap
+    with open(str(source_map), 'w') as f:
+        f.write(sourcemap.dumps(sourcemap.from_document(
+            document,
+            file_path=None if str(out_file) == '-' else str(out_file),
+            source_path=str(in_file))) + '\n')
+
+
+def __write_depfile(depfile, in_file, out_file, dependencies):
+    from .compile import insert
+    with open(str(depfile), 'w') as f:
+        f.write(insert.depfile_rule(str(out_file), str(in_file), dependencies))
+
+
+def __with_options(compile_fn, options):
+    return compile_fn if options is None else functools.partial(compile_fn, options=options)
+
+
+def __with_profile_format(argv):
+    # docopt has no options with optional values, so a bare --profile is
+    # given the default format. Arguments after -- belong to the script.
+    argv = list(argv)
+    end = argv.index('--') if '--' in argv else len(argv)
+    return [
+        '--profile=' + __DEFAULT_PROFILE_FORMAT if a == '--profile' and i < end else a
+        for i, a in enumerate(argv)]
+
+
+@contextlib.contextmanager
+def __profiled(report_format):
+    if report_format is None:
+        yield
+        return
+
+    if report_format not in ('table', 'json'):
+        raise docopt.DocoptExit('--profile must be "table" or "json".')
+
+    from . import profile
+    with profile.profiling() as collected:
+        try:
+            with profile.phase('total'):
+                yield
+        finally:
+            sys.stderr.write(collected.report(report_format) + '\n')
+
+
+def __configure_packrat(args):
+    size = args['--packrat-size']
+    keep = args['--keep-packrat']
+    defaults = size == str(__DEFAULT_PACKRAT_SIZE) and not keep
+
+    if defaults and not args['--packrat-stats']:
+        # The defaults need no configuring, and the parser stays unimported.
+        return
+
+    try:
+        size = None if size == 'unbounded' else int(size)
+    except ValueError:
+        raise docopt.DocoptExit('--packrat-size must be a number or "unbounded".')
+
+    # Once the parser is loaded, this process does its own compiling rather
+    # than a server, so any stats are of the cache which did the work.
+    from . import parse
+    if not defaults:
+        parse.configure_packrat(
+            enabled=size != 0,
+            cache_size=parse.DEFAULT_PACKRAT_CACHE_SIZE if size == 0 else size,
+            clear_between_documents=not keep)
+
+
+def __exec_bash(exec_fn, script, args):
+    # Anything buffered would otherwise be lost when the process is replaced.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return exec_fn('bash', ('bash', str(script)) + tuple(args))
+
+
+def __profile():
+    # The profile module, if a profile is being collected; otherwise None.
+    profile = sys.modules.get(__package__ + '.profile')
+    return profile if profile is not None and profile.is_active() else None
+
+
+def __write_chunk(profile, out, chunk):
+    if profile is None:
+        out.write(chunk)
+        return
+
+    with profile.phase('write'):
+        out.write(chunk)
+    profile.count('bytes_out', len(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')))
+
+
+def __is_same_file(a, b):
+    try:
+        return os.path.samefile(str(a), str(b))
+    except OSError:
+        return False
+
+
+def __fd_path(script):
+    return '/dev/fd/{fd}'.format(fd=script.fileno())
+
+
+def __in_memory_script(memfd_create, compiled):
+    if memfd_create is None or not os.path.isdir('/dev/fd'):
+        return None
+
+    try:
+        # No MFD_CLOEXEC: the descriptor must survive an exec.
+        fd = memfd_create('bashup', 0)
+    except OSError:
+        return None
+
+    script = io.open(fd, 'wb')
+    script.write(compiled.encode('utf-8'))
+    script.flush()
+
+    if hasattr(os, 'set_inheritable'):
+        os.set_inheritable(fd, True)
+
+    return script
+
+
+def __unlinked_script(compiled):
+    import tempfile
+    script = tempfile.TemporaryFile()
+    script.write(compiled.encode('utf-8'))
+    script.flush()
+    script.seek(0)
+
+    # The descriptor must survive the exec for bash to open it.
+    if hasattr(os, 'set_inheritable'):
+        os.set_inheritable(script.fileno(), True)
+
+    return script
+
 
 if __name__ == '__main__':
     sys.exit(main())  # pragma: no cover
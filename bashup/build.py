@@ -0,0 +1,287 @@
+"""
+Batch compilation of whole directory trees.
+
+Every *.bashup file under the source directory is compiled to a *.sh file at
+the same relative path under the output directory. A manifest of source hashes
+is kept in the output directory so that unchanged files are skipped on the next
+build, along with the files each source @inserts, so that a change to one of
+them can be traced back to the sources to rebuild.
+"""
+import collections
+import functools
+import json
+import os
+import time
+
+from . import cache
+
+
+MANIFEST_NAME = '.bashup-manifest.json'
+SOURCE_SUFFIX = '.bashup'
+OUTPUT_SUFFIX = '.sh'
+
+
+# noinspection PyClassHasNoInit
+class Manifest(collections.namedtuple('Manifest', ('files', 'inserts'))):
+    """
+    What a build keeps in the output directory: the key of each source it
+    compiled, and the files each source @inserts, all by their paths
+    relative to the source directory.
+    """
+    __slots__ = ()
+
+
+# noinspection PyClassHasNoInit
+class BuildResult(collections.namedtuple('BuildResult', ('compiled', 'skipped', 'failed', 'elapsed'))):
+    """
+    The relative paths of the compiled, skipped (unchanged) and failed sources,
+    and the elapsed wall time in seconds. Failures are (path, message) pairs.
+    """
+    __slots__ = ()
+
+    def summary(self):
+        return (
+            'Compiled {compiled}, skipped {skipped} unchanged, {failed} failed '
+            'in {elapsed:.2f}s'.format(
+                compiled=len(self.compiled),
+                skipped=len(self.skipped),
+                failed=len(self.failed),
+                elapsed=self.elapsed))
+
+
+def build(src_dir, out_dir, jobs=1, only=None, options=None):
+    """
+    Compiles every changed source under src_dir into out_dir, using a pool
+    of the given number of processes when there is more than one file to
+    compile.
+
+    If options (a compile.options.Options) are given, sources are compiled
+    with them, and recompiled when they change.
+
+    If only is given, just those paths (relative to src_dir) are considered:
+    the sources among them, and the sources which @insert any of them as of
+    the last build. The tree isn't walked at all. This is what keeps watch
+    mode fast.
+
+    Sources are recompiled when any file they @insert changes. A file
+    inserted by many sources is read once per build, and where it can be
+    compiled on its own, compiled once (in each process).
+    """
+    start_time = time.time()
+    src_dir = str(src_dir)
+    out_dir = str(out_dir)
+
+    to_compile, skipped, manifest, insert_cache = __plan(src_dir, out_dir, only, options)
+    compiled, failed = __compile_all(to_compile, options, jobs, insert_cache, manifest)
+
+    __write_manifest(out_dir, manifest)
+
+    return BuildResult(
+        compiled=tuple(compiled),
+        skipped=tuple(skipped),
+        failed=tuple(failed),
+        elapsed=time.time() - start_time)
+
+
+def find_sources(src_dir):
+    """
+    Returns the sorted paths, relative to src_dir, of every bashup source.
+    """
+    found = []
+    for dir_path, dir_names, file_names in os.walk(str(src_dir)):
+        dir_names.sort()
+        rel_dir = os.path.relpath(dir_path, str(src_dir))
+        found.extend(
+            os.path.normpath(os.path.join(rel_dir, f))
+            for f in file_names if f.endswith(SOURCE_SUFFIX))
+    return sorted(found)
+
+
+def inserted_files(src_dir, out_dir):
+    """
+    Returns the sorted paths of every file @inserted by the sources built
+    from src_dir into out_dir, as of the last build.
+    """
+    return sorted(set(
+        os.path.normpath(os.path.join(str(src_dir), p))
+        for inserted in __read_manifest(str(out_dir)).inserts.values() for p in inserted))
+
+
+def output_path_for(rel_path):
+    """
+    >>> output_path_for('lib/util.bashup')
+    'lib/util.sh'
+    """
+    return rel_path[:-len(SOURCE_SUFFIX)] + OUTPUT_SUFFIX
+
+
+#
+# Private Helpers
+#
+
+def __plan(src_dir, out_dir, only, options):
+    # Returns the (rel_path, key, src_path, out_path) of each source to
+    # compile, the unchanged sources, the manifest to record them in (with
+    # the unchanged ones and those left out by only already there), and the
+    # insert_cache, if one was needed.
+    previous = __read_manifest(out_dir)
+    sources, manifest = __sources(src_dir, only, previous)
+    to_compile = []
+    skipped = []
+    insert_cache = None
+
+    for rel_path in sources:
+        source, inserted, insert_cache = __expanded_source(src_dir, rel_path, insert_cache)
+        if inserted is None:
+            inserted = previous.inserts.get(rel_path)
+        if inserted:
+            manifest.inserts[rel_path] = inserted
+        else:
+            manifest.inserts.pop(rel_path, None)
+
+        key = cache.key_for(source, variant=options.cache_key() if options else '')
+
+        out_path = os.path.join(out_dir, output_path_for(rel_path))
+
+        if previous.files.get(rel_path) == key and os.path.isfile(out_path):
+            manifest.files[rel_path] = key
+            skipped.append(rel_path)
+        else:
+            to_compile.append((rel_path, key, os.path.join(src_dir, rel_path), out_path))
+
+    return to_compile, skipped, manifest, insert_cache
+
+
+def __sources(src_dir, only, previous):
+    # Returns the sources to consider, and a new manifest holding what the
+    # previous one says about everything else.
+    if only is None:
+        return find_sources(src_dir), Manifest(files={}, inserts={})
+
+    only = frozenset(os.path.normpath(p) for p in only)
+    dependents = set(p for p, inserted in previous.inserts.items() if only.intersection(inserted))
+    sources = sorted(
+        p for p in only | dependents
+        if p.endswith(SOURCE_SUFFIX) and os.path.isfile(os.path.join(src_dir, p)))
+    return sources, Manifest(
+        files=dict((p, k) for p, k in previous.files.items() if p not in only),
+        inserts=dict((p, i) for p, i in previous.inserts.items() if p not in only))
+
+
+def __compile_all(to_compile, options, jobs, insert_cache, manifest):
+    # Returns the compiled and failed sources, and records the key of each
+    # compiled one in the manifest.
+    tasks = [(src_path, out_path, options) for _, _, src_path, out_path in to_compile]
+    compiled = []
+    failed = []
+
+    for (rel_path, key, _, _), error in zip(to_compile, __map(__compile_one, tasks, jobs, insert_cache)):
+        if error is None:
+            manifest.files[rel_path] = key
+            compiled.append(rel_path)
+        else:
+            failed.append((rel_path, error))
+
+    return compiled, failed
+
+
+def __map(fn, tasks, jobs, insert_cache):
+    # Tasks run here share the insert_cache, but it isn't sent to worker
+    # processes (it would be pickled into every task), which keep their own.
+    if jobs <= 1 or len(tasks) <= 1:
+        return [fn(t, insert_cache) for t in tasks]
+
+    import multiprocessing
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        return pool.map(fn, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def __expanded_source(src_dir, rel_path, insert_cache):
+    # Returns the source with its @inserts expanded, so that its key changes
+    # with them, the paths (relative to src_dir) of the files it inserts, or
+    # None if they can't be found, and the insert_cache, once there is one.
+    with open(os.path.join(src_dir, rel_path)) as f:
+        source = f.read()
+
+    if '@insert' not in source:
+        return source, (), insert_cache
+
+    from .compile import insert
+    insert_cache = insert_cache or insert.InsertCache()
+    try:
+        expansion = insert.expand_inserts(source, os.path.join(src_dir, rel_path), insert_cache)
+    except insert.InsertError:
+        # Left for compilation to report.
+        return source, None, insert_cache
+
+    return expansion.text, [os.path.relpath(p, src_dir) for p in expansion.dependencies], insert_cache
+
+
+def __compile_fn(options):
+    from .compile import bash
+    if options is None:
+        return bash.compile_to_bash
+    return functools.partial(bash.compile_to_bash, compilers=bash.compilers_for(options))
+
+
+def __compile_one(task, insert_cache=None):
+    src_path, out_path, options = task
+    compile_fn = __compile_fn(options)
+
+    try:
+        with open(src_path) as f:
+            source = f.read()
+        if '@insert' in source:
+            from .compile import insert
+            compiled = insert.compile_inserts(
+                source,
+                src_path,
+                compile_fn,
+                insert_cache or __worker_insert_cache(),
+                whole_document=options is not None and options.needs_whole_document()).text
+        else:
+            compiled = compile_fn(source)
+        out_dir = os.path.dirname(out_path)
+        if out_dir and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        with open(out_path, 'wb') as f:
+            f.write(compiled.encode('utf-8'))
+    except Exception as e:  # pylint: disable=broad-except
+        return '{name}: {e}'.format(name=type(e).__name__, e=e)
+
+    return None
+
+
+# A worker process's own insert cache, kept for the life of its pool.
+__WORKER_INSERT_CACHE = []
+
+
+def __worker_insert_cache():
+    if not __WORKER_INSERT_CACHE:
+        from .compile import insert
+        __WORKER_INSERT_CACHE.append(insert.InsertCache())
+    return __WORKER_INSERT_CACHE[0]
+
+
+def __read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return Manifest(files={}, inserts={})
+    if not isinstance(manifest, dict):
+        return Manifest(files={}, inserts={})
+    return Manifest(files=manifest.get('files', {}), inserts=manifest.get('inserts', {}))
+
+
+def __write_manifest(out_dir, manifest):
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'files': manifest.files, 'inserts': manifest.inserts}, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
@@ -0,0 +1,164 @@
+"""
+A persistent, content-addressed cache of compiled scripts.
+
+Compiled scripts are stored under $XDG_CACHE_HOME/bashup (~/.cache/bashup by
+default), keyed by a hash of the bashup version, the compiler's own source
+files (as of their last modification) and the source. When the cache grows beyond its size limit, the least
+recently used scripts are evicted.
+"""
+import errno
+import hashlib
+import os
+
+from . import __version__
+
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+def default_dir():
+    """
+    Returns the default cache directory, honoring $XDG_CACHE_HOME.
+    """
+    base = (
+        os.environ.get('XDG_CACHE_HOME') or
+        os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'bashup')
+
+
+def compiler_fingerprint():
+    """
+    Returns a digest of the names, sizes and modification times of the
+    compiler's source files (the parser, the lexer and the compile package),
+    so that scripts compiled by one build of bashup aren't taken for those of
+    another with the same version number. The files are only looked at with
+    stat(), and only once, which keeps cache hits cheap.
+    """
+    if not __FINGERPRINT:
+        __FINGERPRINT.append(__stat_digest(__compiler_sources()))
+    return __FINGERPRINT[0]
+
+
+def key_for(source_str, variant=''):
+    """
+    Returns the cache key of the given source for this build of bashup (see
+    compiler_fingerprint()). Sources compiled differently (with other
+    options, say) must be given a different variant.
+    """
+    digest = hashlib.sha256()
+    digest.update(__version__.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(compiler_fingerprint().encode('utf-8'))
+    digest.update(b'\0')
+    if variant:
+        digest.update(variant.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(source_str.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def compiled_path(source_str, compile_fn, directory=None, max_bytes=DEFAULT_MAX_BYTES, variant=''):
+    """
+    Returns the path of a cached file containing the compiled source. On a
+    cache miss, the source is compiled with compile_fn and stored first.
+    Returns None if the cache directory cannot be used. See key_for() for the
+    variant.
+    """
+    directory = default_dir() if directory is None else directory
+    path = os.path.join(directory, key_for(source_str, variant) + '.sh')
+
+    try:
+        os.utime(path, None)  # a hit: mark as recently used
+        return path
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            return None
+
+    compiled = compile_fn(source_str)
+
+    try:
+        __store(directory, path, compiled)
+        __evict(directory, max_bytes, keep=path)
+    except (IOError, OSError):
+        return None
+
+    return path
+
+
+#
+# Private Helpers
+#
+
+__PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+__FINGERPRINT = []
+
+
+def __compiler_sources():
+    paths = [os.path.join(__PACKAGE_DIR, name) for name in ('lex.py', 'parse.py')]
+    for dir_path, dir_names, file_names in os.walk(os.path.join(__PACKAGE_DIR, 'compile')):
+        dir_names[:] = sorted(d for d in dir_names if d != '__pycache__')
+        paths.extend(os.path.join(dir_path, f) for f in sorted(file_names) if f.endswith('.py'))
+    return paths
+
+
+def __stat_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            status = os.stat(path)
+            stamp = '{0!r} {1}'.format(status.st_mtime, status.st_size)
+        except OSError:
+            stamp = ''
+        digest.update(os.path.relpath(path, __PACKAGE_DIR).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(stamp.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def __store(directory, path, compiled):
+    import tempfile
+
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compiled.encode('utf-8'))
+        # Atomic, so concurrent runs never see a partially written script.
+        os.rename(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def __evict(directory, max_bytes, keep):
+    entries = []
+    total = 0
+
+    for name in os.listdir(directory):
+        if not name.endswith('.sh'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,5 @@
+from . import dispatch
+from .elements import fn
+
+
+dispatch.register('fn', '@fn', fn.compile_fn_at)
@@ -1,15 +1,224 @@
+import collections
+import functools
+
+from . import dispatch
+from . import ir
+from . import optimize
 from .elements import fn
+from .elements import macro
+from .options import DEFAULT_OPTIONS
+from .. import lex
+from .. import profile
 
 
+# Aliases and macros are expanded ahead of the dispatcher, since their
+# expansions may hold constructs of their own.
 ALL_COMPILERS = (
-    fn.compile_fns_to_bash,)
+    macro.expand_macros,
+    dispatch.compile_constructs,)
+
+
+# Streamed input is compiled in chunks of at least this many characters.
+DEFAULT_CHUNK_SIZE = 16 * 1024
 
 
 def compile_to_bash(bashup_str, compilers=ALL_COMPILERS):
     """
     Compiles the given bashup code to bash, returning a string.
+
+    The string is lexed once and the tokens are shared by every compiler. A
+    compiler which returns the string it was given unchanged leaves the tokens
+    valid for the next one; otherwise the next compiler lexes for itself.
+
+    Lexing and each compiler are timed as profile phases.
+    """
+    return compile_document(bashup_str, compilers).text()
+
+
+def compile_document(bashup_str, compilers=ALL_COMPILERS, parent=None):
+    """
+    Like compile_to_bash(), but returns the compiled ir.Document.
+
+    A compiler registered as an ir stage has its edits applied to the spans
+    of the document, and the text is only joined when a later compiler needs
+    it (or at the end). While the only edits are deletions, stages which skip
+    deleted text work from the original string, with its tokens clipped to
+    the text which is left. Offsets in the output can be traced back to
+    bashup_str through every registered stage, but not through other
+    compilers. If bashup_str is itself the text of an ir.Document (with its
+    @inserts expanded, say), passing that as parent traces them back
+    through it too.
     """
+    with profile.phase('lex'):
+        tokens = lex.tokenize(bashup_str)
+
+    document = ir.Document(bashup_str, parent=parent)
+
     for c in compilers:
-        bashup_str = c(bashup_str)
+        stage = ir.stage_for(c)
+
+        if document.is_edited() and (stage is None or not stage.skips_deleted or document.has_insertions()):
+            document = ir.Document(document.text(), parent=document)
+            tokens = None
+
+        if stage is not None and tokens is None:
+            with profile.phase('lex'):
+                tokens = lex.tokenize(document.source)
+
+        with profile.phase(__compiler_name(c)):
+            if stage is not None:
+                document.edit(stage.edits(document.source, tokens=document.untouched(tokens)))
+                continue
+            compiled = c(document.source, tokens=tokens)
+
+        if compiled is not document.source:
+            document = ir.Document(compiled)
+            tokens = None
+
+    return document
+
+
+def compilers_for(options=DEFAULT_OPTIONS):
+    """
+    Returns every compiler, configured to generate code with the given
+    compile.options.Options, along with the optimization passes they ask for.
+    """
+    if options == DEFAULT_OPTIONS:
+        return ALL_COMPILERS
+
+    # Aliases and macros are expanded first, since they may hide @fn calls.
+    compilers = (macro.expand_macros,)
+
+    if options.drop_unused_fns:
+        compilers += (functools.partial(optimize.drop_unused_fns, keep=options.keep),)
+    compilers += (functools.partial(dispatch.compile_constructs, options=options),)
+    if options.minify:
+        compilers += (optimize.strip_blank_lines,)
+
+    return compilers
+
+
+def compile_stream(lines, compile_fn=compile_to_bash, chunk_size=DEFAULT_CHUNK_SIZE,
+                   definitions_fn=macro.definitions_in):
+    """
+    Compiles bashup code from an iterable of lines (an open file, say),
+    yielding the compiled bash a chunk at a time.
+
+    Lines are gathered until there are at least chunk_size characters and the
+    next line can begin a new chunk without changing how either chunk
+    compiles: it isn't indented and doesn't continue a string, heredoc or @fn
+    statement. Memory use is then bounded by the chunk size and the largest
+    such construct rather than by the size of the input.
+
+    The alias and macro definitions in each chunk, as found by
+    definitions_fn, are passed on to compile_fn ahead of every later chunk, so
+    they're in effect for the rest of the stream. The definitions are left out
+    of what compile_fn returns, as compile_to_bash() leaves them out. A
+    compile_fn which expands a chunk before compiling it (its @inserts, say)
+    needs a definitions_fn which finds them in the expanded chunk.
+    """
+    definitions = ''
+    buffered = []
+    size = 0
+    next_check = chunk_size
+    compiled_any = False
+
+    for line in lines:
+        if size >= next_check and starts_chunk(line):
+            chunk = ''.join(buffered)
+            if can_split_after(chunk):
+                yield compile_fn(definitions + chunk)
+                definitions += definitions_fn(chunk)
+                compiled_any = True
+                buffered = []
+                size = 0
+                next_check = chunk_size
+            else:
+                # Back off so a long construct isn't lexed again on every line.
+                next_check = size + size // 4
+        buffered.append(line)
+        size += len(line)
+
+    if buffered or not compiled_any:
+        yield compile_fn(definitions + ''.join(buffered))
+
+
+def compile_many(sources, options=DEFAULT_OPTIONS, workers=None, chunk_size=16):
+    """
+    Compiles many documents, given as (name, bashup_str) pairs from any
+    iterable, yielding a CompileResult for each, in the same order, as it's
+    compiled. A document which fails to compile gets a CompileResult with the
+    exception as its error, and the rest carry on.
+
+    The compilers for the options are put together once, and the parser and
+    the fn template are only built once (in each process), however many
+    documents there are. With workers set above 1, documents are compiled by
+    a pool of that many processes, chunk_size documents at a time, and
+    results are yielded as each chunk completes.
+
+    >>> for r in compile_many([('ok', 'echo hi'), ('bad', '@a = @a\\n@a')]):
+    ...     print('{0} {1!r} {2}'.format(r.name, r.output, type(r.error).__name__))
+    ok 'echo hi' NoneType
+    bad None MacroError
+    """
+    compile_one = functools.partial(__compile_one, compilers_for(options))
+
+    if workers is None or workers <= 1:
+        for source in sources:
+            yield compile_one(source)
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(workers)
+    try:
+        for result in pool.imap(compile_one, sources, chunksize=chunk_size):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# noinspection PyClassHasNoInit
+class CompileResult(collections.namedtuple('CompileResult', ('name', 'output', 'error'))):
+    """
+    The outcome of compiling the named document in compile_many(): the
+    compiled bash, or None and the exception it failed with.
+    """
+    __slots__ = ()
+
+
+def starts_chunk(line):
+    """
+    Returns whether a chunk may begin with the given line: it's not indented
+    (or blank), so it can't be the first line of the preceding @fn's body.
+    """
+    return line[:1] not in ('', ' ', '\t', '\n')
+
+
+def can_split_after(chunk):
+    """
+    Returns whether the chunk compiles the same on its own as it does
+    followed by a chunk which starts_chunk(). It must end a line, and not
+    part way through a string, heredoc or @fn statement.
+    """
+    tokens = lex.tokenize(chunk)
+    return (
+        chunk.endswith('\n') and
+        tokens[-1].kind == lex.CODE and
+        fn.can_split_after(chunk, tokens))
+
+
+#
+# Private Helpers
+#
+
+def __compile_one(compilers, source):
+    name, bashup_str = source
+    try:
+        return CompileResult(name=name, output=compile_to_bash(bashup_str, compilers), error=None)
+    except Exception as e:  # pylint: disable=broad-except
+        return CompileResult(name=name, output=None, error=e)
+
 
-    return bashup_str
+def __compiler_name(compiler):
+    return getattr(getattr(compiler, 'func', compiler), '__name__', 'compiler')
@@ -0,0 +1,191 @@
+"""
+The registry of constructs, and the dispatcher which compiles all of them in a
+single pass over a bashup document.
+
+Each construct is registered with the sigil which begins it (@fn, say) and a
+handler. The dispatcher walks the code of the document once, looking for every
+registered sigil at the same time, and hands each occurrence to the handler
+for that sigil, which decides what (if anything) to replace. Registering
+another construct adds no pass of its own.
+
+The built-in constructs are registered when the compile package is imported,
+so the modules which implement them can use the dispatcher themselves.
+"""
+import collections
+import re
+
+from . import ir
+from .options import DEFAULT_OPTIONS
+from .. import lex
+
+
+# noinspection PyClassHasNoInit
+class Construct(collections.namedtuple('Construct', ('name', 'sigil', 'handler'))):
+    """
+    A construct which begins with the sigil. For each occurrence of the sigil
+    in code which isn't part of an earlier replacement, the handler is called
+    as handler(bashup_str, offset, context), and returns a Replacement, or None
+    to leave that occurrence alone.
+    """
+    __slots__ = ()
+
+
+# What a handler returns. It must begin no earlier than where the previous
+# replacement ended.
+Replacement = ir.Replacement
+
+
+# noinspection PyClassHasNoInit
+class Dispatch(collections.namedtuple('Dispatch', ('output', 'replacements'))):
+    """
+    The compiled string, and every replacement made in it, in order.
+    """
+    __slots__ = ()
+
+
+class Context(object):
+    """
+    What a handler is told about the document besides its text: its tokens,
+    the compile.options.Options in effect, where the previous replacement
+    ended (last), and a dict (state) in which handlers can keep whatever they
+    need for the rest of the document, under keys prefixed with their name.
+    """
+    __slots__ = ('tokens', 'options', 'last', 'state')
+
+    def __init__(self, tokens, options, state=None):
+        self.tokens = tokens
+        self.options = options
+        self.last = 0
+        self.state = {} if state is None else state
+
+
+def register(name, sigil, handler):
+    """
+    Registers a construct, to be compiled by every later dispatch. A
+    construct registered under the name of an existing one replaces it.
+    Sigils must be unique.
+    """
+    for construct in __REGISTRY.values():
+        if construct.sigil == sigil and construct.name != name:
+            raise ValueError('{sigil} is already registered to {name}'.format(
+                sigil=sigil, name=construct.name))
+    __REGISTRY[name] = Construct(name=name, sigil=sigil, handler=handler)
+
+
+def unregister(name):
+    """
+    Removes the named construct from the registry.
+    """
+    del __REGISTRY[name]
+
+
+def registered():
+    """
+    Returns every registered construct, in the order they were registered.
+
+    >>> [c.sigil for c in registered()]
+    ['@fn']
+    """
+    return tuple(__REGISTRY.values())
+
+
+def dispatch(bashup_str, tokens=None, options=DEFAULT_OPTIONS, constructs=None, state=None):
+    """
+    Compiles every occurrence of the given constructs (by default, every
+    registered one) in the bashup string, in a single pass, returning a
+    Dispatch. Only occurrences in code are considered. The tokens from
+    lex.tokenize() may be passed in to avoid lexing the string again, and
+    state may be passed in to prime the Context given to each handler.
+    """
+    replacements = __replacements(bashup_str, tokens, options, constructs, state)
+    return Dispatch(
+        output=__splice(bashup_str, replacements),
+        replacements=replacements)
+
+
+def compile_constructs(bashup_str, tokens=None, options=DEFAULT_OPTIONS):
+    """
+    Compiles every registered construct in the bashup string, in a single
+    pass. If there's nothing to compile, the original string is returned
+    as-is.
+    """
+    return dispatch(bashup_str, tokens=tokens, options=options).output
+
+
+def construct_edits(bashup_str, tokens=None, options=DEFAULT_OPTIONS):
+    """
+    Like compile_constructs(), but returns the replacements as edits.
+    """
+    return __replacements(bashup_str, tokens, options, constructs=None, state=None)
+
+
+#
+# Private Helpers
+#
+
+__REGISTRY = collections.OrderedDict()
+
+# Compiled sigil patterns, by the sigils they match.
+__PATTERN_CACHE = {}
+
+
+def __replacements(bashup_str, tokens, options, constructs, state):
+    constructs = registered() if constructs is None else tuple(constructs)
+    if not constructs:
+        return ()
+
+    if tokens is None:
+        tokens = lex.tokenize(bashup_str)
+
+    sigils = __sigil_pattern(tuple(c.sigil for c in constructs))
+    handlers = dict((c.sigil, c.handler) for c in constructs)
+    context = Context(tokens=tokens, options=options, state=state)
+    replacements = []
+
+    for token in tokens:
+        if token.kind != lex.CODE or token.end <= context.last:
+            continue
+        for sigil in sigils.finditer(bashup_str, max(token.start, context.last), token.end):
+            offset = sigil.start()
+            if offset < context.last:
+                continue
+            replacement = handlers[sigil.group()](bashup_str, offset, context)
+            if replacement is None:
+                continue
+            if not context.last <= replacement.start <= offset < replacement.end:
+                raise ValueError('{sigil} handler replaced {start}:{end}, which is out of order'.format(
+                    sigil=sigil.group(), start=replacement.start, end=replacement.end))
+            replacements.append(replacement)
+            context.last = replacement.end
+
+    return tuple(replacements)
+
+
+def __sigil_pattern(sigils):
+    try:
+        return __PATTERN_CACHE[sigils]
+    except KeyError:
+        # Longer sigils are tried first, so @fn doesn't hide @fnx.
+        pattern = __PATTERN_CACHE[sigils] = re.compile('|'.join(
+            re.escape(s) for s in sorted(sigils, key=len, reverse=True)))
+        return pattern
+
+
+def __splice(bashup_str, replacements):
+    if not replacements:
+        return bashup_str
+
+    def generate_slices():
+        last = 0
+        for r in replacements:
+            yield bashup_str[last:r.start]
+            yield r.replacement
+            last = r.end
+        yield bashup_str[last:]
+
+    return ''.join(generate_slices())
+
+
+# Constructs are found in the same places whether or not the @fns which
+# drop_unused_fns() removes are still there.
+ir.register_stage(compile_constructs, construct_edits, skips_deleted=True)
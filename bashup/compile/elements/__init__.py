@@ -1,5 +1,9 @@
 from . import fn
+from . import macro
 
 
 compile_fns_to_bash = fn.compile_fns_to_bash
+compile_fns = fn.compile_fns
 compile_fn_spec_to_bash = fn.compile_fn_spec_to_bash
+expand_macros = macro.expand_macros
+MacroError = macro.MacroError
@@ -1,52 +1,136 @@
 from __future__ import division
 
+import collections
 import re
 import textwrap
 
-import jinja2
+from .. import dispatch
+from ..options import DEFAULT_OPTIONS
+from ... import lex
+from ... import profile
 
-from ... import parse
 
-
-def compile_fns_to_bash(bashup_str):
+def compile_fns_to_bash(bashup_str, tokens=None, options=DEFAULT_OPTIONS):
     """
     Compiles all @fn statements in the provided bashup string. Returns a new
     string containing the original source but with every @fn statement
-    replaced with the equivalent bash code.
+    replaced with the equivalent bash code. If there are no @fn statements,
+    the original string is returned as-is.
+
+    Only @fn statements in code are compiled; those in comments, quoted strings
+    and heredocs are left alone. The tokens from lex.tokenize() may be passed
+    in to avoid lexing the string again. The generated code is controlled by
+    the given compile.options.Options.
+    """
+    return compile_fns(bashup_str, tokens=tokens, options=options).output
+
+
+def compile_fns(bashup_str, tokens=None, previous=None, options=DEFAULT_OPTIONS):
+    """
+    Like compile_fns_to_bash(), but returns an FnCompilation describing each
+    compiled region. Passing the FnCompilation of an earlier version of the
+    same document as previous means that only the @fn statements whose
+    surrounding text changed are parsed and rendered again; the rest are
+    copied from the previous compilation, provided it was compiled with the
+    same options.
+    """
+    reusable = (
+        __reusable_regions(previous, bashup_str)
+        if previous and previous.options == options else {})
+    compiled = dispatch.dispatch(
+        bashup_str,
+        tokens=tokens,
+        options=options,
+        constructs=(dispatch.Construct(name='fn', sigil=__FN_SIGIL, handler=compile_fn_at),),
+        state={'fn.reusable': reusable})
+
+    return FnCompilation(
+        source=bashup_str,
+        output=compiled.output,
+        regions=compiled.replacements,
+        options=options)
+
+
+def compile_fn_at(bashup_str, offset, context):
+    """
+    The dispatch handler for @fn: compiles the @fn statement at offset,
+    returning its FnRegion, or None if there isn't a valid one there. A region
+    in context.state['fn.reusable'] for the offset is reused as-is.
+    """
+    region = context.state.get('fn.reusable', {}).get(offset)
+    if region is not None:
+        profile.count('fns_reused')
+        return region
+
+    from ... import parse
+
+    parser = context.state.get('fn.parser')
+    if parser is None:
+        # Building the grammar is expensive, so it's deferred until it's
+        # needed, and then shared by the rest of the document.
+        with profile.phase('fn.setup'):
+            parser = context.state['fn.parser'] = parse.prepare_scan(parse.FN.parseWithTabs())
+
+    with profile.phase('fn.scan'):
+        match = parse.parse_at(parser, bashup_str, offset)
+    if match is None:
+        return None
+    with profile.phase('fn.spec'):
+        fn_spec = parse.FnSpec.from_parse_result(match[0])
+    profile.count('fns_compiled')
+    return __compile_region(bashup_str, fn_spec, context, offset, match[1])
+
+
+def can_split_after(bashup_str, tokens):
+    """
+    Returns whether compiling bashup_str and the text which follows it
+    separately gives the same result as compiling them together, given that
+    the following text begins with a line which isn't indented. That holds
+    unless bashup_str ends part way through an @fn statement.
     """
-    def generate_slices():
-        last = 0
-        scanner = parse.FN.parseWithTabs().scanString(bashup_str)
+    offsets = list(lex.find_in_code(__FN_SIGIL, bashup_str, tokens))
 
-        for parse_result, start, end in scanner:
-            fn_spec = parse.FnSpec.from_parse_result(parse_result)
-            compiled = compile_fn_spec_to_bash(fn_spec)
-            initial_indent, body_indent = __guess_indentation(
-                before_fn=bashup_str[last:start],
-                fn_body=bashup_str[end:])
-            yield bashup_str[last:start - len(initial_indent)]
-            yield __indent(compiled, initial_indent, body_indent)
-            last = end
+    if not offsets:
+        return True
 
-        yield bashup_str[last:]
+    after_last_fn = (
+        lex.Token(kind=t.kind, start=max(t.start, offsets[-1]), end=t.end)
+        for t in tokens if t.end > offsets[-1])
 
-    return ''.join(generate_slices())
+    return any(True for _ in lex.find_in_code('{', bashup_str, after_last_fn))
 
 
-def compile_fn_spec_to_bash(fn_spec):
+# noinspection PyClassHasNoInit
+class FnCompilation(collections.namedtuple('FnCompilation', ('source', 'output', 'regions', 'options'))):
+    __slots__ = ()
+
+
+# noinspection PyClassHasNoInit
+class FnRegion(collections.namedtuple('FnRegion', (
+        'offset', 'start', 'end', 'context_start', 'context_end', 'fn_spec', 'replacement'))):
+    """
+    A single compiled @fn statement found at offset. The source text from start
+    to end was replaced, and the replacement depends only on the source text
+    from context_start to context_end.
+    """
+    __slots__ = ()
+
+    def shifted(self, delta):
+        return self._replace(
+            offset=self.offset + delta,
+            start=self.start + delta,
+            end=self.end + delta,
+            context_start=self.context_start + delta,
+            context_end=self.context_end + delta)
+
+
+def compile_fn_spec_to_bash(fn_spec, options=DEFAULT_OPTIONS):
     """
     Populates the fn template with the given spec.
     """
-    template = jinja2.Environment(
-        trim_blocks=True,
-        lstrip_blocks=True,
-        auto_reload=False,
-        autoescape=False,
-        newline_sequence='\n'
-    ).from_string(__FN_TEMPLATE)
-
-    return template.render(
+    return __template().render(
         fn=fn_spec,
+        options=options,
         param_usage=''.join(__usage_for(arg) for arg in fn_spec.args),
         arg_list=' '.join(__quoted_arg(arg) for arg in fn_spec.args))
 
@@ -56,9 +140,17 @@ def compile_fn_spec_to_bash(fn_spec):
 #
 
 __FN_TEMPLATE = textwrap.dedent("""
+    {% macro trace(event) -%}
+    if [[ -n ${BASHUP_TRACE_FD-} ]]; then
+        printf '{{ event }} {{ fn.name }} %s %s\\n' \\
+            "${EPOCHREALTIME:-$(date +%s)}" "${BASHPID:-$$}" >&"${BASHUP_TRACE_FD}"
+    fi
+    {%- endmacro %}
+    {% if not options.minify %}
     #
     # usage: {{ fn.name }} {{ param_usage }}[ARGS]
     #
+    {% endif %}
     {% if fn.args|length %}
     {{ fn.name }}() {
         {% for arg in fn.args %}
@@ -70,6 +162,26 @@ __FN_TEMPLATE = textwrap.dedent("""
         {% endif %}
         {% endfor %}
         local args=()
+        {% if options.arg_parser == 'case' %}
+        local __arg
+
+        for __arg in "$@"; do
+            case ${__arg} in
+                {% for arg in fn.args %}
+                {% set param = "--" ~ arg.name.replace('_', '-') %}
+                {{ param }}=*)
+                    {{ arg.name }}=${__arg#{{ param }}=}
+                    {% if arg.value is none %}
+                    {{ arg.name }}__set=1
+                    {% endif %}
+                    ;;
+                {% endfor %}
+                *)
+                    args+=("${__arg}")
+                    ;;
+            esac
+        done
+        {% else %}
 
         while (( $# )); do
             {% for arg in fn.args %}
@@ -89,6 +201,7 @@ __FN_TEMPLATE = textwrap.dedent("""
             fi
             shift
         done
+        {% endif %}
 
         {% for arg in fn.args %}
         {% if arg.value is none %}
@@ -100,7 +213,18 @@ __FN_TEMPLATE = textwrap.dedent("""
         {% endif %}
         {% endfor %}
 
+        {% if options.fn_layout == 'inline' and not options.instrument %}
+        set -- "${args[@]}"
+        {% else %}
+        {% if options.instrument %}
+        {{ trace('call')|indent(4) }}
+        {% endif %}
         __{{ fn.name }} {{ arg_list }} "${args[@]}"
+        {% if options.instrument %}
+        local __status=$?
+        {{ trace('return')|indent(4) }}
+        return ${__status}
+        {% endif %}
     }
 
     __{{ fn.name }}() {
@@ -108,30 +232,62 @@ __FN_TEMPLATE = textwrap.dedent("""
         local {{ arg.name }}={{ "${" ~ loop.index ~ "}" }}
         {% endfor %}
         shift {{ fn.args|length }}
-    {% else %}
+        {% endif %}
+    {% elif options.instrument %}
+    {{ fn.name }}() {
+        {{ trace('call')|indent(4) }}
+        __{{ fn.name }} "$@"
+        local __status=$?
+        {{ trace('return')|indent(4) }}
+        return ${__status}
+    }
+
+    __{{ fn.name }}() {
+    {%- else %}
     {{ fn.name }}() {
     {%- endif %}
 
 """).strip()
 
+__FN_SIGIL = '@fn'
+
+# The template is compiled on first use and then shared by every render.
+__TEMPLATE_CACHE = {}
+
 __DEFAULT_INDENT = ' ' * 4
 
+# Unchanged text is found by comparing blocks of this many characters.
+__COMPARE_BLOCK = 4096
+
 __BLANK_LINE = re.compile(
     r'^\s*$')
 
 __LEADING_WHITESPACE = re.compile(
     r'^[\t ]*')
 
-__INITIAL_INDENT = re.compile(
-    r'(^|\n)(?P<initial_indent>[ \t]*)$')
-
+# Used with match() at the end of the @fn statement, so it's anchored there.
 __BODY_INDENT = re.compile(
-    r'^[^\n}]*'                    # don't match a one-line fn
+    r'[^\n}]*'                     # don't match a one-line fn
     r'(?:#[^\n]*)?'                # skip comment on the @fn line
-    r'(?:[\n\t ]+)*'               # optional blank lines
+    r'[\n\t ]*'                    # optional blank lines
     r'\n(?P<body_indent>[ \t]*)')  # first non-blank line
 
 
+def __template():
+    try:
+        return __TEMPLATE_CACHE['fn']
+    except KeyError:
+        import jinja2
+        template = __TEMPLATE_CACHE['fn'] = jinja2.Environment(
+            trim_blocks=True,
+            lstrip_blocks=True,
+            auto_reload=False,
+            autoescape=False,
+            newline_sequence='\n'
+        ).from_string(__FN_TEMPLATE)
+        return template
+
+
 def __usage_for(arg):
     param = arg.name.replace('_', '-')
     is_optional = arg.value is not None
@@ -166,15 +322,88 @@ def __indent(target_str, initial, body):
     return ''.join(__retab_line(s) for s in target_str.splitlines(True))
 
 
-def __guess_indentation(before_fn, fn_body):
-    match_result = __BODY_INDENT.match(fn_body)
-    initial_indent = (
-        __INITIAL_INDENT
-        .search(before_fn)
-        .group('initial_indent'))
+def __compile_region(bashup_str, fn_spec, context, offset, end):
+    last = context.last
+    initial_indent, body_indent, body_indent_end = __guess_indentation(
+        bashup_str, last=last, offset=offset, end=end)
+
+    newline = bashup_str.rfind('\n', last, offset)
+
+    if newline == -1 and last > 0:
+        # The indentation depends on where the previous @fn on this line
+        # ended, so this region can only be reused if nothing changes.
+        context_start, context_end = 0, len(bashup_str)
+    else:
+        context_start = max(newline, 0)
+        # The body indentation regex looks one character past its match.
+        context_end = len(bashup_str) if body_indent_end is None else min(
+            body_indent_end + 1, len(bashup_str))
+
+    with profile.phase('fn.render'):
+        compiled = compile_fn_spec_to_bash(fn_spec, context.options)
+
+    with profile.phase('fn.indent'):
+        replacement = __indent(compiled, initial_indent, body_indent)
+
+    return FnRegion(
+        offset=offset,
+        start=offset - len(initial_indent),
+        end=end,
+        context_start=context_start,
+        context_end=context_end,
+        fn_spec=fn_spec,
+        replacement=replacement)
+
+
+def __reusable_regions(previous, bashup_str):
+    old_str = previous.source
+    prefix = __common_length(old_str, bashup_str, min(len(old_str), len(bashup_str)))
+    suffix = __common_length(
+        old_str, bashup_str, min(len(old_str), len(bashup_str)) - prefix, from_end=True)
+    suffix_start = len(old_str) - suffix
+    delta = len(bashup_str) - len(old_str)
+
+    reusable = {}
+    for region in previous.regions:
+        if region.context_end <= prefix:
+            reusable[region.offset] = region
+        elif region.context_start >= suffix_start:
+            reusable[region.offset + delta] = region.shifted(delta)
+    return reusable
+
+
+def __common_length(a, b, limit, from_end=False):
+    def chunk(s, lo, hi):
+        return s[len(s) - hi:len(s) - lo] if from_end else s[lo:hi]
+
+    pos = 0
+    step = __COMPARE_BLOCK
+    while pos < limit:
+        end = min(pos + step, limit)
+        if chunk(a, pos, end) == chunk(b, pos, end):
+            pos = end
+        elif step == 1:
+            return pos
+        else:
+            step //= 2
+    return limit
+
+
+def __guess_indentation(bashup_str, last, offset, end):
+    # Everything is matched in place rather than against copies of the text
+    # before and after the @fn, which keeps compilation linear in the size of
+    # the input. Also returns where the body indentation match ended.
+    line_start = max(bashup_str.rfind('\n', last, offset) + 1, last)
+    initial_indent = bashup_str[line_start:offset]
+
+    if initial_indent.strip(' \t'):
+        # Something other than indentation precedes the @fn on its line.
+        initial_indent = ''
+
+    match_result = __BODY_INDENT.match(bashup_str, end)
     body_indent = (
         __strip_prefix(
             match_result.group('body_indent'),
             initial_indent) if match_result else
         __DEFAULT_INDENT)
-    return initial_indent, body_indent
+    return initial_indent, body_indent, match_result.end() if match_result else None
@@ -0,0 +1,289 @@
+"""
+Aliases and macros, which are expanded before any other construct:
+
+    @mytmp = @with(mktemp tmp.XXXXXXXXXX)
+    @mytmp(extra) = @with(mktemp @extra tmp.XXXXXXXXXX)
+
+A definition takes up its own line, which is left out of the compiled code.
+Each later use of @mytmp (or @mytmp(-d), for the macro) in code is replaced by
+its definition, with the macro's parameters replaced by the given arguments,
+and any aliases or macros in the result expanded in turn.
+"""
+import collections
+import re
+
+from .. import ir
+from ... import lex
+from ... import profile
+
+
+class MacroError(Exception):
+    """
+    Raised for a macro used with the wrong number of arguments (or none), a
+    definition which uses itself (directly or not), or a definition which
+    would hide a built-in construct such as @fn.
+    """
+
+
+def expand_macros(bashup_str, tokens=None):
+    """
+    Records the alias and macro definitions in the bashup string and expands
+    each later use of them, in a single pass over the string. The body of each
+    definition is expanded once, the first time it's used, leaving only the
+    arguments to be filled in for each use after that. If nothing is defined,
+    the original string is returned as-is.
+
+    Only definitions and uses in code count; those in comments, quoted
+    strings and heredocs are left alone. The arguments of a macro are
+    expanded where they're used, before they're put in its body. The tokens
+    from lex.tokenize() may be passed in to avoid lexing the string again.
+
+    >>> print(expand_macros('@greet(who) = echo "hi" @who\\n@greet(you)'))
+    echo "hi" you
+    """
+    edits = macro_edits(bashup_str, tokens)
+    return __splice(bashup_str, edits) if edits else bashup_str
+
+
+def macro_edits(bashup_str, tokens=None):
+    """
+    Like expand_macros(), but returns the edits which expand the string as
+    a list of ir.Replacement.
+    """
+    if '@' not in bashup_str:
+        return []
+
+    if tokens is None:
+        tokens = lex.tokenize(bashup_str)
+
+    state = _State(definitions={}, templates={})
+    return list(__edits(bashup_str, tokens, state, stack=(), top_level=True))
+
+
+def definitions_in(bashup_str):
+    """
+    Returns the definition lines in the bashup string, in order. Expanding
+    these followed by more code gives the same result as expanding them where
+    they were, which is how compile_stream() carries definitions from one
+    chunk to the next.
+
+    >>> definitions_in('@a = 1\\necho @a\\n  @b(x) = @x\\n')
+    '@a = 1\\n  @b(x) = @x\\n'
+    """
+    if '@' not in bashup_str:
+        return ''
+
+    return ''.join(
+        d.group() for d in __find_definitions(bashup_str, lex.tokenize(bashup_str)))
+
+
+#
+# Private Helpers
+#
+
+__BUILT_IN = frozenset(('fn', 'insert'))
+
+__SIGIL = re.compile(
+    r'(?<![\w@])@(?P<name>[A-Za-z_][A-Za-z0-9_]*)')
+
+__DEFINITION = re.compile(
+    r'[ \t]*@(?P<name>[A-Za-z_][A-Za-z0-9_]*)'
+    r'(?:\((?P<params>[^()\n]*)\))?'
+    r'[ \t]*=[ \t]*(?P<body>[^\n]*)(?:\n|$)')
+
+__PARAM = re.compile(
+    r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Unlike other uses, a parameter may follow a word, as in tmp.@suffix.
+__PARAM_USE = re.compile(
+    r'@(?P<name>[A-Za-z_][A-Za-z0-9_]*)')
+
+# Stands in for the parameter with the given index in an expanded body. The
+# NUL character can't otherwise appear in a bash script.
+__SLOT = '\0{0}\0'
+
+__SLOTS = re.compile(
+    r'\0(\d+)\0')
+
+# What matters when finding the arguments of a macro: parentheses and commas
+# outside of quotes.
+__ARG_SYNTAX = re.compile(
+    r'\\.|\'[^\']*\'|"(?:\\.|[^"\\])*"|[(),]', re.DOTALL)
+
+# The parameters of an alias are None, and of a macro a (possibly empty)
+# tuple of names.
+_Definition = collections.namedtuple('_Definition', ('params', 'body'))
+
+# The definitions seen so far by name, and the expanded body of each of them
+# which has been used, split on its slots: literal text alternates with
+# parameter indexes.
+_State = collections.namedtuple('_State', ('definitions', 'templates'))
+
+
+def __expand(bashup_str, tokens, state, stack):
+    # Returns the expanded string, or None if there was nothing to expand.
+    edits = list(__edits(bashup_str, tokens, state, stack))
+    return __splice(bashup_str, edits) if edits else None
+
+
+def __splice(bashup_str, edits):
+    def generate_slices():
+        last = 0
+        for e in edits:
+            yield bashup_str[last:e.start]
+            yield e.replacement
+            last = e.end
+        yield bashup_str[last:]
+
+    return ''.join(generate_slices())
+
+
+def __edits(bashup_str, tokens, state, stack, top_level=False):
+    # Definitions are only recorded at the top level, not within a body.
+    last = 0
+
+    for token in tokens:
+        if token.kind != lex.CODE or token.end <= last:
+            continue
+        for sigil in __SIGIL.finditer(bashup_str, max(token.start, last), token.end):
+            if sigil.start() < last:
+                # Part of a macro's arguments, which have been expanded.
+                continue
+
+            definition = __match_definition(bashup_str, sigil.start()) if top_level else None
+            if definition is not None:
+                __define(bashup_str, sigil.start(), definition, state)
+                last = definition.end()
+                yield ir.Replacement(start=definition.start(), end=last, replacement='')
+            elif sigil.group('name') in state.definitions:
+                expansion, last = __use(bashup_str, sigil, state, stack)
+                yield ir.Replacement(start=sigil.start(), end=last, replacement=expansion)
+
+
+def __find_definitions(bashup_str, tokens):
+    pos = 0
+    for token in tokens:
+        if token.kind != lex.CODE or token.end <= pos:
+            continue
+        for sigil in __SIGIL.finditer(bashup_str, max(token.start, pos), token.end):
+            definition = __match_definition(bashup_str, sigil.start()) if sigil.start() >= pos else None
+            if definition is not None:
+                pos = definition.end()
+                yield definition
+
+
+def __match_definition(bashup_str, offset):
+    # Only a sigil which begins its line can start a definition.
+    line_start = bashup_str.rfind('\n', 0, offset) + 1
+    if bashup_str[line_start:offset].strip(' \t'):
+        return None
+    return __DEFINITION.match(bashup_str, line_start)
+
+
+def __define(bashup_str, offset, definition, state):
+    name = definition.group('name')
+    if name in __BUILT_IN:
+        raise MacroError('{where}: @{name} is built in and cannot be defined'.format(
+            where=__where(bashup_str, offset, ()), name=name))
+
+    params = definition.group('params')
+    if params is not None:
+        params = tuple(p.strip() for p in params.split(',')) if params.strip() else ()
+        if not all(__PARAM.match(p) for p in params):
+            raise MacroError('{where}: bad parameters for @{name}: ({params})'.format(
+                where=__where(bashup_str, offset, ()), name=name, params=definition.group('params')))
+
+    state.definitions[name] = _Definition(params=params, body=definition.group('body').rstrip())
+    # Bodies expanded so far may depend on an earlier definition.
+    state.templates.clear()
+
+
+def __use(bashup_str, sigil, state, stack):
+    # Returns the expansion of the alias or macro used at the sigil, and the
+    # end of the use.
+    name = sigil.group('name')
+    start, end = sigil.span()
+    definition = state.definitions[name]
+    args = ()
+
+    if definition.params is not None:
+        parsed = __parse_args(bashup_str, end)
+        if parsed is None:
+            raise MacroError('{where}: @{name} needs arguments'.format(
+                where=__where(bashup_str, start, stack), name=name))
+        args, end = parsed
+        if len(args) != len(definition.params):
+            raise MacroError('{where}: @{name} takes {expected} argument(s), not {actual}'.format(
+                where=__where(bashup_str, start, stack),
+                name=name,
+                expected=len(definition.params),
+                actual=len(args)))
+
+    template = __template(name, definition, state, stack)
+    if len(template) == 1:
+        return template[0], end
+
+    args = tuple(__expand_arg(a, state, stack) for a in args)
+    return ''.join(args[int(p)] if i % 2 else p for i, p in enumerate(template)), end
+
+
+def __template(name, definition, state, stack):
+    template = state.templates.get(name)
+    if template is not None:
+        profile.count('macros_reused')
+        return template
+
+    if name in stack:
+        raise MacroError('recursive definition: ' + ' -> '.join('@' + n for n in stack + (name,)))
+
+    body = definition.body
+    if definition.params:
+        slots = dict((p, __SLOT.format(i)) for i, p in enumerate(definition.params))
+        body = __PARAM_USE.sub(lambda m: slots.get(m.group('name'), m.group()), body)
+
+    expanded = __expand(body, lex.tokenize(body), state, stack + (name,))
+    template = state.templates[name] = __SLOTS.split(body if expanded is None else expanded)
+    profile.count('macros_expanded')
+    return template
+
+
+def __expand_arg(arg, state, stack):
+    if '@' not in arg:
+        return arg
+    expanded = __expand(arg, lex.tokenize(arg), state, stack)
+    return arg if expanded is None else expanded
+
+
+def __parse_args(bashup_str, pos):
+    # Returns the comma-separated arguments in the parentheses at pos and the
+    # position just after them, or None if there are no parentheses there.
+    if bashup_str[pos:pos + 1] != '(':
+        return None
+
+    args = []
+    depth = 0
+    arg_start = pos + 1
+
+    for syntax in __ARG_SYNTAX.finditer(bashup_str, pos):
+        char = syntax.group()
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                args.append(bashup_str[arg_start:syntax.start()].strip())
+                return (() if args == [''] else tuple(args)), syntax.end()
+        elif char == ',' and depth == 1:
+            args.append(bashup_str[arg_start:syntax.start()].strip())
+            arg_start = syntax.end()
+
+    return None
+
+
+def __where(bashup_str, offset, stack):
+    if stack:
+        return 'in @' + stack[-1]
+    return 'line {0}'.format(bashup_str.count('\n', 0, offset) + 1)
+
+
+ir.register_stage(expand_macros, macro_edits)
@@ -0,0 +1,309 @@
+"""
+Expands @insert statements, which insert the text of a local file in place of
+the line they're on, before any other construct is compiled:
+
+    @insert lib/logging.bashup
+    @insert 'LICENSE.txt' --comment
+
+Paths are relative to the directory of the file being compiled, and inserted
+files may themselves insert others. An indented @insert indents every inserted
+line to match, and --comment comments out every inserted line (in which case
+the file is inserted as-is, without expanding its own @inserts).
+"""
+import collections
+import os
+import re
+
+from . import bash
+from . import ir
+from .elements import macro
+from .. import cache
+from .. import lex
+from .. import profile
+
+
+class InsertError(Exception):
+    """
+    Raised for an @insert which can't be expanded: a malformed statement, a
+    file which can't be read, a path which isn't local or a cycle of inserts.
+    """
+
+
+# noinspection PyClassHasNoInit
+class Expansion(collections.namedtuple('Expansion', ('text', 'dependencies'))):
+    """
+    Text with every @insert expanded (or compiled), and the paths of every
+    file inserted into it, directly or not, in the order first inserted.
+    """
+    __slots__ = ()
+
+
+class InsertCache(object):
+    """
+    The inserted files seen so far, so that a file inserted by many documents
+    (in a build, say) is read and expanded once, and compiled once for each
+    distinct content. A cache must only be used with a single compile_fn.
+    """
+
+    def __init__(self):
+        self.expanded = {}
+        self.compiled = {}
+
+
+def expand_inserts(bashup_str, path, insert_cache=None):
+    """
+    Returns an Expansion of the bashup string read from the given path, with
+    each @insert replaced by the (expanded) text of the file it names.
+    """
+    return __expand(
+        bashup_str, path, InsertCache() if insert_cache is None else insert_cache, stack=())
+
+
+def expand_document(bashup_str, path, insert_cache=None):
+    """
+    Like expand_inserts(), but returns an ir.Document of the bashup string in
+    which each @insert is replaced by the text it inserts, so that offsets in
+    the expanded text can be traced back to the @insert lines. The paths of
+    every inserted file are returned along with it.
+    """
+    insert_cache = InsertCache() if insert_cache is None else insert_cache
+    edits, dependencies = __insert_edits(bashup_str, path, insert_cache, stack=())
+
+    document = ir.Document(bashup_str)
+    document.edit(edits)
+    return document, dependencies
+
+
+def compile_inserts(bashup_str, path, compile_fn, insert_cache=None, whole_document=False):
+    """
+    Returns an Expansion of the compiled bashup string read from the given
+    path, with its @inserts expanded.
+
+    The result is always the same as compiling the expanded text with
+    compile_fn, but where an inserted file would compile the same on its own
+    (it's inserted at the top level, between complete statements), it is
+    compiled on its own, and the result is shared through the insert_cache by
+    every @insert of the same content. Set whole_document if compile_fn
+    needs the whole document at once, which rules that out.
+    """
+    insert_cache = InsertCache() if insert_cache is None else insert_cache
+
+    if whole_document:
+        expansion = __expand(bashup_str, path, insert_cache, stack=())
+        return Expansion(compile_fn(expansion.text), expansion.dependencies)
+
+    return __compile(bashup_str, path, compile_fn, insert_cache, stack=())
+
+
+def depfile_rule(target, source, dependencies):
+    """
+    Returns Makefile rules making the target depend on its source and the
+    files inserted into it, plus an empty rule for each inserted file so that
+    make doesn't fail once one is deleted.
+
+    >>> print(depfile_rule('out.sh', 'in.bashup', ['lib/a b.bashup']))
+    out.sh: in.bashup lib/a\\ b.bashup
+    <BLANKLINE>
+    lib/a\\ b.bashup:
+    <BLANKLINE>
+    """
+    rules = ['{target}: {prerequisites}\n'.format(
+        target=__make_escape(target),
+        prerequisites=' '.join(__make_escape(p) for p in (source,) + tuple(dependencies)))]
+    rules.extend('\n{path}:\n'.format(path=__make_escape(p)) for p in dependencies)
+    return ''.join(rules)
+
+
+#
+# Private Helpers
+#
+
+__SIGIL = '@insert'
+
+__STATEMENT = re.compile(
+    r'@insert'
+    r'[ \t]+(?P<path>\'[^\'\n]*\'|"[^"\n]*"|[^\s\'"#;&|]+)'
+    r'(?P<comment>[ \t]+--comment)?'
+    r'[ \t]*(?:#[^\n]*)?(?:\n|$)')
+
+__REMOTE = re.compile(
+    r'^(?:[A-Za-z][A-Za-z0-9+.-]*://|gist:|github:)')
+
+_Insert = collections.namedtuple('_Insert', ('start', 'end', 'indent', 'path', 'comment'))
+
+
+def __find_inserts(bashup_str, path):
+    if __SIGIL not in bashup_str:
+        return
+
+    base_dir = os.path.dirname(str(path))
+
+    for offset in lex.find_in_code(__SIGIL, bashup_str, lex.tokenize(bashup_str)):
+        line_start = bashup_str.rfind('\n', 0, offset) + 1
+        indent = bashup_str[line_start:offset]
+        if indent.strip(' \t'):
+            # Only an @insert which begins its line is a statement.
+            continue
+
+        statement = __STATEMENT.match(bashup_str, offset)
+        if statement is None:
+            raise InsertError('{path}: malformed @insert: {line}'.format(
+                path=path,
+                line=bashup_str[offset:].split('\n', 1)[0]))
+
+        inserted = statement.group('path')
+        if inserted[:1] in ('"', "'"):
+            inserted = inserted[1:-1]
+        if __REMOTE.match(inserted):
+            raise InsertError('{path}: only local files can be inserted: {inserted}'.format(
+                path=path, inserted=inserted))
+
+        yield _Insert(
+            start=line_start,
+            end=statement.end(),
+            indent=indent,
+            path=os.path.normpath(os.path.join(base_dir, inserted)),
+            comment=bool(statement.group('comment')))
+
+
+def __read(insert, including_path, stack):
+    real_path = os.path.realpath(insert.path)
+
+    if real_path in stack:
+        cycle = stack[stack.index(real_path):] + (real_path,)
+        raise InsertError('@insert cycle: ' + ' -> '.join(cycle))
+
+    try:
+        with open(insert.path) as f:
+            return real_path, f.read()
+    except (IOError, OSError) as e:
+        raise InsertError('{path}: cannot insert {inserted}: {error}'.format(
+            path=including_path, inserted=insert.path, error=e.strerror or e))
+
+
+def __expand(bashup_str, path, insert_cache, stack):
+    edits, dependencies = __insert_edits(bashup_str, path, insert_cache, stack)
+
+    if not edits:
+        return Expansion(bashup_str, ())
+
+    def generate_slices():
+        last = 0
+        for e in edits:
+            yield bashup_str[last:e.start]
+            yield e.replacement
+            last = e.end
+        yield bashup_str[last:]
+
+    return Expansion(''.join(generate_slices()), dependencies)
+
+
+def __insert_edits(bashup_str, path, insert_cache, stack):
+    stack += (os.path.realpath(str(path)),)
+    edits = []
+    dependencies = []
+
+    for insert in __find_inserts(bashup_str, path):
+        included = __expanded_insert(insert, path, insert_cache, stack)
+        edits.append(ir.Replacement(
+            start=insert.start, end=insert.end, replacement=__as_inserted(included.text, insert)))
+        __add_dependencies(dependencies, (insert.path,) + included.dependencies)
+
+    return edits, tuple(dependencies)
+
+
+def __expanded_insert(insert, including_path, insert_cache, stack):
+    real_path, text = __read(insert, including_path, stack)
+
+    if insert.comment:
+        return Expansion(text, ())
+
+    key = (real_path, cache.key_for(text))
+    expansion = insert_cache.expanded.get(key)
+    if expansion is None:
+        expansion = insert_cache.expanded[key] = __expand(text, insert.path, insert_cache, stack)
+    return expansion
+
+
+def __compile(bashup_str, path, compile_fn, insert_cache, stack):
+    inserts = list(__find_inserts(bashup_str, path))
+    if not inserts:
+        return Expansion(compile_fn(bashup_str), ())
+
+    stack += (os.path.realpath(str(path)),)
+    compiled = []
+    pending = []
+    dependencies = []
+    # Alias and macro definitions are passed on to every later segment, as
+    # in bash.compile_stream().
+    definitions = ''
+    last = 0
+
+    for insert in inserts:
+        pending.append(bashup_str[last:insert.start])
+        included = __expanded_insert(insert, path, insert_cache, stack)
+        __add_dependencies(dependencies, (insert.path,) + included.dependencies)
+        last = insert.end
+
+        if __can_share(insert, included.text, ''.join(pending), bashup_str, last):
+            if any(pending):
+                compiled.append(compile_fn(definitions + ''.join(pending)))
+                definitions += macro.definitions_in(''.join(pending))
+            pending = []
+            compiled.append(__compiled_insert(included, definitions, compile_fn, insert_cache))
+            definitions += macro.definitions_in(included.text)
+        else:
+            pending.append(__as_inserted(included.text, insert))
+
+    pending.append(bashup_str[last:])
+    if any(pending) or not compiled:
+        compiled.append(compile_fn(definitions + ''.join(pending)))
+
+    return Expansion(''.join(compiled), tuple(dependencies))
+
+
+def __compiled_insert(included, definitions, compile_fn, insert_cache):
+    # Keyed by the expanded text, since the same file may insert different
+    # files depending on where it is, and by the definitions in effect.
+    text = definitions + __terminated(included.text)
+    key = cache.key_for(text)
+
+    compiled = insert_cache.compiled.get(key)
+    if compiled is None:
+        compiled = insert_cache.compiled[key] = compile_fn(text)
+        profile.count('inserts_compiled')
+    else:
+        profile.count('inserts_reused')
+    return compiled
+
+
+def __can_share(insert, included_text, before, bashup_str, after):
+    # The same conditions under which bash.compile_stream() splits a stream
+    # into chunks, applied on both sides of the inserted file.
+    if insert.indent or insert.comment or not included_text:
+        return False
+    return (
+        (not before or bash.can_split_after(before)) and
+        bash.can_split_after(__terminated(included_text)) and
+        (after == len(bashup_str) or bash.starts_chunk(bashup_str[after:after + 1])))
+
+
+def __as_inserted(text, insert):
+    lines = __terminated(text).splitlines(True)
+    if insert.comment:
+        lines = [('# ' + line) if line.strip() else '#\n' for line in lines]
+    if insert.indent:
+        lines = [(insert.indent + line) if line.strip() else line for line in lines]
+    return ''.join(lines)
+
+
+def __terminated(text):
+    return text if not text or text.endswith('\n') else text + '\n'
+
+
+def __add_dependencies(dependencies, paths):
+    dependencies.extend(p for p in paths if p not in dependencies)
+
+
+def __make_escape(path):
+    return path.replace('\\', '\\\\').replace(' ', '\\ ').replace('#', '\\#').replace('$', '$$')
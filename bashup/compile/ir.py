@@ -0,0 +1,222 @@
+"""
+The document representation shared by the compile stages: a sequence of spans
+over the source, each of which is either an untouched slice of it or text
+generated in its place.
+
+Stages which can describe what they do as edits to their input (registered
+with register_stage()) have them applied to the spans, rather than each
+building a new copy of the whole script, and the output is only joined once
+it's needed. Since every span remembers where it came from, an offset in the
+output can be traced back to the source.
+"""
+import bisect
+import collections
+import functools
+
+
+# noinspection PyClassHasNoInit
+class Span(collections.namedtuple('Span', ('start', 'end', 'text'))):
+    """
+    The source text from start to end, as-is if text is None, or else
+    replaced by text.
+    """
+    __slots__ = ()
+
+
+# noinspection PyClassHasNoInit
+class Replacement(collections.namedtuple('Replacement', ('start', 'end', 'replacement'))):
+    """
+    An edit: the source text from start to end is replaced with the
+    replacement text. Anything with these three attributes can be used as an
+    edit (an elements.fn.FnRegion, for instance).
+    """
+    __slots__ = ()
+
+
+# noinspection PyClassHasNoInit
+class Stage(collections.namedtuple('Stage', ('edits', 'skips_deleted'))):
+    """
+    How a compile stage describes its work as edits: edits(bashup_str,
+    tokens=None) returns them for the given text, in order and without
+    overlapping. If skips_deleted is set, the edits it finds in a text are
+    the same as those it would find once earlier deletions were made, apart
+    from those within the deleted text, so it can be run before they're made.
+    """
+    __slots__ = ()
+
+
+class Document(object):
+    """
+    A source string and the spans it has been edited into. A document made
+    from the output of another (its parent) traces offsets back through it.
+
+    >>> d = Document('say hi')
+    >>> d.edit([Replacement(start=0, end=3, replacement='echo')])
+    >>> d.text()
+    'echo hi'
+    >>> d.source_offset(5)
+    4
+    """
+
+    def __init__(self, source, parent=None):
+        self.source = source
+        self.parent = parent
+        self.__spans = [Span(start=0, end=len(source), text=None)] if source else []
+        self.__text = source
+        self.__inserted = False
+        self.__output_starts = None
+
+    @property
+    def spans(self):
+        return tuple(self.__spans)
+
+    def is_edited(self):
+        return self.__text is not self.source
+
+    def has_insertions(self):
+        """
+        Returns whether any edit put text in place of the source, rather than
+        only deleting it.
+        """
+        return self.__inserted
+
+    def edit(self, replacements):
+        """
+        Applies the given edits, which are in terms of the source and must be
+        in order and not overlap. An edit touching text which an earlier edit
+        already replaced is skipped, since what it would replace is gone.
+        """
+        spans = self.__spans
+        edited = []
+        index = 0
+        last_end = 0
+        applied = False
+
+        for r in replacements:
+            if r.start < last_end or r.end < r.start:
+                raise ValueError('edits must be in order and not overlap: {start}:{end}'.format(
+                    start=r.start, end=r.end))
+            last_end = r.end
+
+            while index < len(spans) and spans[index].end <= r.start:
+                edited.append(spans[index])
+                index += 1
+
+            covered_end = index
+            while covered_end < len(spans) and spans[covered_end].start < r.end:
+                covered_end += 1
+            covered = spans[index:covered_end]
+
+            if any(s.text is not None for s in covered):
+                continue
+
+            if covered and covered[0].start < r.start:
+                edited.append(Span(start=covered[0].start, end=r.start, text=None))
+            edited.append(Span(start=r.start, end=r.end, text=r.replacement))
+            self.__inserted = self.__inserted or bool(r.replacement)
+            applied = True
+
+            if covered and covered[-1].end > r.end:
+                # What's left of the last span may be edited next.
+                index = covered_end - 1
+                spans[index] = Span(start=r.end, end=covered[-1].end, text=None)
+            else:
+                index = covered_end
+
+        if not applied:
+            return
+
+        edited.extend(spans[index:])
+        self.__spans = edited
+        self.__text = None
+        self.__output_starts = None
+
+    def untouched(self, tokens):
+        """
+        Returns the tokens of the source (from lex.tokenize()), clipped to the
+        text which no edit has replaced, so that a stage given them doesn't
+        look for work in text which is gone.
+        """
+        if not self.is_edited():
+            return tokens
+
+        clipped = []
+        index = 0
+        for s in self.__spans:
+            if s.text is not None:
+                continue
+            while index < len(tokens) and tokens[index].end <= s.start:
+                index += 1
+            i = index
+            while i < len(tokens) and tokens[i].start < s.end:
+                t = tokens[i]
+                clipped.append(t._replace(start=max(t.start, s.start), end=min(t.end, s.end)))
+                i += 1
+        return clipped
+
+    def text(self):
+        """
+        Returns the edited text, which is only joined once per edit.
+        """
+        if self.__text is None:
+            source = self.source
+            self.__text = ''.join(
+                source[s.start:s.end] if s.text is None else s.text for s in self.__spans)
+        return self.__text
+
+    def source_offset(self, offset):
+        """
+        Returns the offset in the original source (that of the first
+        document, if this one has a parent) of the given offset in the text.
+        Generated text maps to the start of what it replaced.
+        """
+        if self.__output_starts is None:
+            starts = []
+            position = 0
+            for s in self.__spans:
+                starts.append(position)
+                position += (s.end - s.start) if s.text is None else len(s.text)
+            self.__output_starts = starts
+
+        index = bisect.bisect_right(self.__output_starts, offset) - 1
+        if index < 0:
+            source_offset = 0
+        else:
+            span = self.__spans[index]
+            source_offset = (
+                min(span.start + offset - self.__output_starts[index], span.end)
+                if span.text is None else span.start)
+
+        return source_offset if self.parent is None else self.parent.source_offset(source_offset)
+
+
+def register_stage(compile_fn, edits_fn, skips_deleted=False):
+    """
+    Registers edits_fn as the way to get the edits which compile_fn makes, so
+    that compile_document() can apply them to a Document instead of calling
+    compile_fn. See Stage for skips_deleted.
+    """
+    __STAGES[compile_fn] = Stage(edits=edits_fn, skips_deleted=skips_deleted)
+
+
+def stage_for(compile_fn):
+    """
+    Returns the Stage registered for the compile function, or None. A
+    functools.partial of a registered function gets a Stage whose edits are
+    given the same arguments.
+    """
+    func = getattr(compile_fn, 'func', compile_fn)
+    try:
+        stage = __STAGES.get(func)
+    except TypeError:
+        return None
+    if stage is None or func is compile_fn:
+        return stage
+    return stage._replace(edits=functools.partial(stage.edits, *compile_fn.args, **compile_fn.keywords))
+
+
+#
+# Private Helpers
+#
+
+__STAGES = {}
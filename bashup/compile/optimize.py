@@ -0,0 +1,219 @@
+"""
+Optional whole-document passes which make the compiled script cheaper for
+bash to parse: dropping @fns which nothing can call, and stripping blank
+lines.
+"""
+import collections
+import re
+
+from . import ir
+from .. import lex
+
+
+def drop_unused_fns(bashup_str, tokens=None, keep=()):
+    """
+    Removes the top-level @fn statements (and their bodies) which can't be
+    called. A call graph is built from every word which names an @fn: words
+    outside any @fn are the roots, and words in an @fn's parameters or body
+    are calls made by that @fn. Comments are ignored, but quoted strings and
+    heredocs are not, since they may hold commands (for a trap, say).
+
+    Functions which are only called dynamically, with a name built at
+    runtime, must be listed in keep. If an @fn body can't be delimited, or if
+    nothing can be dropped, the original string is returned as-is.
+
+    >>> print(drop_unused_fns('@fn a { b; }\\n@fn b { :; }\\n@fn c { a; }\\nb'))
+    @fn b { :; }
+    b
+    """
+    edits = unused_fn_edits(bashup_str, tokens=tokens, keep=keep)
+    return __remove_spans(bashup_str, edits) if edits else bashup_str
+
+
+def unused_fn_edits(bashup_str, tokens=None, keep=()):
+    """
+    Like drop_unused_fns(), but returns the deletions it makes as a list of
+    ir.Replacement.
+    """
+    if tokens is None:
+        tokens = lex.tokenize(bashup_str)
+
+    fns = __find_fns(bashup_str, tokens)
+    if not fns:
+        return []
+
+    names = set(f.name for f in fns)
+    calls = dict((f, set()) for f in fns)
+    roots = set(name for name in keep if name in names)
+
+    for fn, word_start, word in __words_naming(names, bashup_str, tokens, fns):
+        if fn is None:
+            roots.add(word)
+        elif word_start != fn.name_start:
+            calls[fn].add(word)
+
+    reachable = __reachable(roots, fns, calls)
+    unused = [f for f in fns if f.name not in reachable]
+
+    return [
+        ir.Replacement(start=start, end=end, replacement='')
+        for start, end in (__removal_span(bashup_str, f) for f in unused)]
+
+
+def strip_blank_lines(bash_str, tokens=None):
+    """
+    Removes the blank lines of the given code, leaving those in strings and
+    heredocs (and after a line continuation) alone.
+
+    >>> print(strip_blank_lines('a\\n\\n  \\nb "\\n\\n"'))
+    a
+    b "
+    <BLANKLINE>
+    "
+    """
+    edits = blank_line_edits(bash_str, tokens=tokens)
+    return __remove_spans(bash_str, edits) if edits else bash_str
+
+
+def blank_line_edits(bash_str, tokens=None):
+    """
+    Like strip_blank_lines(), but returns the deletions it makes as a list of
+    ir.Replacement.
+    """
+    if tokens is None:
+        tokens = lex.tokenize(bash_str)
+
+    return [
+        ir.Replacement(start=m.start(), end=m.end(), replacement='')
+        for t in tokens if t.kind == lex.CODE
+        for m in __BLANK_LINE.finditer(bash_str, t.start, t.end)]
+
+
+#
+# Private Helpers
+#
+
+__FN_HEADER = re.compile(
+    r'@fn[ \t]+(?P<name>[A-Za-z_][A-Za-z0-9_]*)')
+
+__WORD = re.compile(
+    r'[A-Za-z_][A-Za-z0-9_]*')
+
+# A line holding nothing but whitespace, unless it ends a line continuation.
+__BLANK_LINE = re.compile(
+    r'(?:^|(?<=\n))(?<!\\\n)[ \t]*\n')
+
+# Escaped characters are matched too, so that escaped braces can be skipped.
+__BRACE = re.compile(
+    r'\\.|[{}]', re.DOTALL)
+
+# A top-level @fn, whose name begins at name_start, spanning from the @fn
+# sigil at start to just past its closing brace at end.
+_Fn = collections.namedtuple('_Fn', ('name', 'name_start', 'start', 'end'))
+
+
+def __find_fns(bashup_str, tokens):
+    fns = []
+    last_end = 0
+    token_index = 0
+
+    for offset in lex.find_in_code('@fn', bashup_str, tokens):
+        if offset < last_end:
+            # Nested @fns are part of their parent's body.
+            continue
+        header = __FN_HEADER.match(bashup_str, offset)
+        if header is None:
+            continue
+        end, token_index = __body_end(bashup_str, tokens, token_index, header.end())
+        if end is None:
+            return []
+        fns.append(_Fn(
+            name=header.group('name'),
+            name_start=header.start('name'),
+            start=offset,
+            end=end))
+        last_end = end
+
+    return fns
+
+
+def __body_end(bashup_str, tokens, token_index, pos):
+    # Braces in code are counted from the end of the name, so any parameter
+    # expansions in default values balance out before the body's own brace.
+    # Returns the end of the body and the index of the token it's in.
+    depth = 0
+    for index in range(token_index, len(tokens)):
+        token = tokens[index]
+        if token.kind != lex.CODE or token.end <= pos:
+            continue
+        for match in __BRACE.finditer(bashup_str, max(token.start, pos), token.end):
+            brace = match.group()
+            if brace not in '{}':
+                continue
+            depth += 1 if brace == '{' else -1
+            if depth == 0:
+                return match.end(), index
+            if depth < 0:
+                return None, index
+    return None, len(tokens)
+
+
+def __words_naming(names, bashup_str, tokens, fns):
+    # Yields (enclosing fn or None, start, word) for each word naming an @fn.
+    fn_index = 0
+    for token in tokens:
+        if token.kind == lex.COMMENT:
+            continue
+        for match in __WORD.finditer(bashup_str, token.start, token.end):
+            word = match.group()
+            if word not in names:
+                continue
+            start = match.start()
+            while fn_index < len(fns) and fns[fn_index].end <= start:
+                fn_index += 1
+            enclosing = fns[fn_index] if fn_index < len(fns) and fns[fn_index].start <= start else None
+            yield enclosing, start, word
+
+
+def __reachable(roots, fns, calls):
+    called_by_name = {}
+    for fn in fns:
+        called_by_name.setdefault(fn.name, set()).update(calls[fn])
+
+    reachable = set()
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        if name not in reachable:
+            reachable.add(name)
+            pending.extend(called_by_name.get(name, ()))
+    return reachable
+
+
+def __removal_span(bashup_str, fn):
+    # Whole lines are removed when the @fn has them to itself, along with a
+    # blank line which separated it from whatever follows.
+    line_start = bashup_str.rfind('\n', 0, fn.start) + 1
+    line_end = bashup_str.find('\n', fn.end)
+    line_end = len(bashup_str) if line_end == -1 else line_end + 1
+
+    if bashup_str[line_start:fn.start].strip() or bashup_str[fn.end:line_end].strip():
+        return fn.start, fn.end
+
+    blank_line = __BLANK_LINE.match(bashup_str, line_end)
+    return line_start, blank_line.end() if blank_line else line_end
+
+
+def __remove_spans(target_str, edits):
+    def generate_slices():
+        last = 0
+        for e in edits:
+            yield target_str[last:e.start]
+            last = e.end
+        yield target_str[last:]
+
+    return ''.join(generate_slices())
+
+
+ir.register_stage(drop_unused_fns, unused_fn_edits)
+ir.register_stage(strip_blank_lines, blank_line_edits)
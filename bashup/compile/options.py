@@ -0,0 +1,68 @@
+"""
+Options which control the bash code generated by the compilers.
+"""
+import collections
+
+
+# How generated functions parse their arguments:
+#   loop - test each argument against an if/elif chain, then shift it off
+#   case - dispatch each argument with a single case statement, iterating
+#          over "$@" without shifting
+ARG_PARSERS = ('loop', 'case')
+
+# How generated functions hand their parameters to the function body:
+#   wrapper - the parsing function calls a second, __-prefixed function which
+#             holds the body, passing the parameters positionally
+#   inline  - the body follows the parsing in the same function, with the
+#             remaining arguments restored to "$@"
+FN_LAYOUTS = ('wrapper', 'inline')
+
+# If instrument is set, every generated function writes a line to the file
+# descriptor named by $BASHUP_TRACE_FD (if it's set) when it's called and when
+# it returns; see bashup.trace. Instrumented functions always use the wrapper
+# layout, since the return is recorded once the wrapped body has finished.
+#
+# If drop_unused_fns is set, @fns which can't be called from the top level of
+# the document are left out, except for those named in keep (a tuple), which
+# may be called dynamically. This needs the whole document at once, so it
+# rules out compiling a stream a chunk at a time. If minify is set, the
+# generated usage comments and all blank lines outside strings are left out.
+
+
+# noinspection PyClassHasNoInit
+class Options(collections.namedtuple('Options', (
+        'arg_parser', 'fn_layout', 'instrument', 'drop_unused_fns', 'keep', 'minify'))):
+    __slots__ = ()
+
+    def cache_key(self):
+        """
+        Returns a string which differs for each combination of options. It's
+        empty for the defaults, so caches keyed by it stay valid.
+
+        >>> DEFAULT_OPTIONS.cache_key()
+        ''
+        >>> DEFAULT_OPTIONS._replace(arg_parser='case').cache_key()
+        'arg_parser=case'
+        >>> DEFAULT_OPTIONS._replace(arg_parser='case', fn_layout='inline').cache_key()
+        'arg_parser=case,fn_layout=inline'
+        >>> DEFAULT_OPTIONS._replace(drop_unused_fns=True, keep=('a', 'b')).cache_key()
+        'drop_unused_fns=True,keep=a b'
+        """
+        return ','.join(
+            '{name}={value}'.format(
+                name=name,
+                value=' '.join(value) if isinstance(value, tuple) else value)
+            for name, value in self._asdict().items()
+            if value != getattr(DEFAULT_OPTIONS, name))
+
+    def needs_whole_document(self):
+        return self.drop_unused_fns
+
+
+DEFAULT_OPTIONS = Options(
+    arg_parser='loop',
+    fn_layout='wrapper',
+    instrument=False,
+    drop_unused_fns=False,
+    keep=(),
+    minify=False)
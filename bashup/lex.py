@@ -0,0 +1,265 @@
+"""
+A single-pass lexer which splits a bashup document into opaque regions
+(quoted strings, comments and heredoc bodies) and the code between them.
+
+Constructs can only appear in code, so compilers use the token stream to avoid
+looking inside regions that bash would never interpret as commands.
+"""
+import collections
+import re
+
+
+#
+# Public Constants
+#
+
+CODE = 'code'
+COMMENT = 'comment'
+SINGLE_QUOTED = 'single_quoted'
+DOUBLE_QUOTED = 'double_quoted'
+HEREDOC = 'heredoc'
+
+
+#
+# Public Functions
+#
+
+# noinspection PyClassHasNoInit
+class Token(collections.namedtuple('Token', ('kind', 'start', 'end'))):
+    __slots__ = ()
+
+
+def tokenize(bashup_str):
+    """
+    Splits the string into a tuple of contiguous tokens covering all of it.
+    Unterminated regions extend to the end of the string.
+
+    >>> for t in tokenize("echo 'a' # b"):
+    ...     print(t)
+    Token(kind='code', start=0, end=5)
+    Token(kind='single_quoted', start=5, end=8)
+    Token(kind='code', start=8, end=9)
+    Token(kind='comment', start=9, end=12)
+    """
+    return tuple(__merge_code(__generate_tokens(bashup_str)))
+
+
+def find_in_code(sigil, bashup_str, tokens):
+    """
+    Yields the offset of every occurrence of the sigil which lies entirely
+    within a code token, in ascending order.
+
+    >>> s = '@fn a { echo "@fn"; }  # @fn'
+    >>> list(find_in_code('@fn', s, tokenize(s)))
+    [0]
+    """
+    for token in tokens:
+        if token.kind != CODE:
+            continue
+        offset = bashup_str.find(sigil, token.start, token.end)
+        while offset != -1:
+            yield offset
+            offset = bashup_str.find(sigil, offset + 1, token.end)
+
+
+#
+# Private Helpers
+#
+
+__CODE_EVENT = (
+    r"(?P<escape>\\.)"
+    r"|(?P<ansi_c_quoted>\$')"
+    r"|(?P<single_quoted>')"
+    r"|(?P<double_quoted>\")"
+    r"|(?P<comment>(?<![^\s;|&()<>])#)"
+    r"|(?P<arithmetic>\(\()"
+    r"|(?P<heredoc>(?<!<)<<(?!<)(?P<strip_tabs>-?))")
+
+__CODE = re.compile(__CODE_EVENT, re.DOTALL)
+
+__CODE_OR_NEWLINE = re.compile(__CODE_EVENT + r"|(?P<newline>\n)", re.DOTALL)
+
+__HEREDOC_WORD = re.compile(
+    r"[ \t]*(?P<word>(?:'[^']*'|\"[^\"]*\"|\\.|[^\s;|&()<>'\"\\])+)")
+
+__HEREDOC_QUOTING = re.compile(
+    r"""['"\\]""")
+
+__ANSI_C_QUOTED_END = re.compile(
+    r"\\.|'", re.DOTALL)
+
+__PARENS = re.compile(
+    r"[()]")
+
+__DOUBLE_QUOTED_EVENT = re.compile(
+    r'\\.|"|`|\$\(|\$\{', re.DOTALL)
+
+__COMMAND_SUBSTITUTION_EVENT = re.compile(
+    r"\\.|'|\"|`|\$\{|[()]", re.DOTALL)
+
+__PARAMETER_EXPANSION_EVENT = re.compile(
+    r"\\.|'|\"|`|\$\(|\$\{|\}", re.DOTALL)
+
+__BACKTICK_END = re.compile(
+    r"\\.|`", re.DOTALL)
+
+
+def __merge_code(tokens):
+    pending = None
+
+    for token in tokens:
+        if token.start == token.end and token.kind == CODE:
+            continue
+        if pending is not None and pending.kind == CODE == token.kind:
+            pending = Token(kind=CODE, start=pending.start, end=token.end)
+            continue
+        if pending is not None:
+            yield pending
+        pending = token
+
+    if pending is not None:
+        yield pending
+
+
+def __generate_tokens(s):
+    length = len(s)
+    pos = 0
+    code_start = 0
+    heredocs = []
+
+    while pos < length:
+        match = (__CODE_OR_NEWLINE if heredocs else __CODE).search(s, pos)
+
+        if not match:
+            break
+
+        kind = match.lastgroup if match.lastgroup != 'strip_tabs' else 'heredoc'
+        start = match.start()
+
+        if kind == 'escape':
+            pos = match.end()
+        elif kind == 'arithmetic':
+            pos = __skip_parens(s, match.end(), depth=2)
+        elif kind == 'heredoc':
+            pos = match.end()
+            word = __HEREDOC_WORD.match(s, pos)
+            if word:
+                heredocs.append((
+                    __HEREDOC_QUOTING.sub('', word.group('word')),
+                    bool(match.group('strip_tabs'))))
+                pos = word.end()
+        elif kind == 'newline':
+            yield Token(kind=CODE, start=code_start, end=match.end())
+            pos = match.end()
+            for delimiter, strip_tabs in heredocs:
+                end = __find_heredoc_end(s, pos, delimiter, strip_tabs)
+                yield Token(kind=HEREDOC, start=pos, end=end)
+                pos = end
+            heredocs = []
+            code_start = pos
+        else:
+            if kind == 'comment':
+                end = s.find('\n', start)
+                end = length if end == -1 else end
+                token_kind = COMMENT
+            elif kind == 'double_quoted':
+                end = __skip_double_quoted(s, match.end())
+                token_kind = DOUBLE_QUOTED
+            else:
+                end = __skip_single_quoted(s, match.end(), kind == 'ansi_c_quoted')
+                token_kind = SINGLE_QUOTED
+            yield Token(kind=CODE, start=code_start, end=start)
+            yield Token(kind=token_kind, start=start, end=end)
+            pos = code_start = end
+
+    yield Token(kind=CODE, start=code_start, end=length)
+
+
+def __find_heredoc_end(s, pos, delimiter, strip_tabs):
+    terminator = re.compile(
+        r'^' + (r'\t*' if strip_tabs else '') + re.escape(delimiter) + r'$',
+        re.MULTILINE)
+    match = terminator.search(s, pos)
+    return min(match.end() + 1, len(s)) if match else len(s)
+
+
+def __skip_single_quoted(s, pos, ansi_c):
+    if not ansi_c:
+        end = s.find("'", pos)
+        return len(s) if end == -1 else end + 1
+
+    for match in __ANSI_C_QUOTED_END.finditer(s, pos):
+        if match.group() == "'":
+            return match.end()
+    return len(s)
+
+
+def __skip_parens(s, pos, depth):
+    for match in __PARENS.finditer(s, pos):
+        depth += 1 if match.group() == '(' else -1
+        if depth == 0:
+            return match.end()
+    return len(s)
+
+
+def __skip_backticks(s, pos):
+    for match in __BACKTICK_END.finditer(s, pos):
+        if match.group() == '`':
+            return match.end()
+    return len(s)
+
+
+def __skip_double_quoted(s, pos):
+    match = __DOUBLE_QUOTED_EVENT.search(s, pos)
+    while match:
+        event = match.group()
+        if event == '"':
+            return match.end()
+        pos = __skip_nested(s, event, match.end())
+        match = __DOUBLE_QUOTED_EVENT.search(s, pos)
+    return len(s)
+
+
+def __skip_command_substitution(s, pos):
+    depth = 1
+    match = __COMMAND_SUBSTITUTION_EVENT.search(s, pos)
+    while match:
+        event = match.group()
+        if event == ')':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+            pos = match.end()
+        elif event == '(':
+            depth += 1
+            pos = match.end()
+        else:
+            pos = __skip_nested(s, event, match.end())
+        match = __COMMAND_SUBSTITUTION_EVENT.search(s, pos)
+    return len(s)
+
+
+def __skip_parameter_expansion(s, pos):
+    match = __PARAMETER_EXPANSION_EVENT.search(s, pos)
+    while match:
+        event = match.group()
+        if event == '}':
+            return match.end()
+        pos = __skip_nested(s, event, match.end())
+        match = __PARAMETER_EXPANSION_EVENT.search(s, pos)
+    return len(s)
+
+
+def __skip_nested(s, event, pos):
+    if event.startswith('\\'):
+        return pos
+    elif event == "'":
+        return __skip_single_quoted(s, pos, ansi_c=False)
+    elif event == '"':
+        return __skip_double_quoted(s, pos)
+    elif event == '`':
+        return __skip_backticks(s, pos)
+    elif event == '$(':
+        return __skip_command_substitution(s, pos)
+    else:
+        return __skip_parameter_expansion(s, pos)
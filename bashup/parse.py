@@ -5,10 +5,6 @@ import collections
 import pyparsing as pp
 
 
-# Enable memoization to speed up the parser.
-pp.ParserElement.enablePackrat()
-
-
 #
 # Public Constants
 #
@@ -128,6 +124,177 @@ FN = pp.Group(
 )('fn')
 
 
+#
+# Scanning
+#
+
+def scan_at(parser, to_scan, offsets):
+    """
+    Equivalent to ``parser.scanString(to_scan)`` for a parser whose matches
+    always begin with a known sigil, except that a match is only attempted at
+    the given candidate offsets (which must be in ascending order) rather
+    than at every character. Tabs are never expanded.
+    """
+    prepare_scan(parser)
+    last_end = 0
+
+    for offset in offsets:
+        if offset < last_end:
+            continue
+        match = parse_at(parser, to_scan, offset)
+        if match is not None:
+            tokens, last_end = match
+            yield tokens, offset, last_end
+
+
+def prepare_scan(parser):
+    """
+    Readies the parser for a series of parse_at() calls over a new document
+    and returns it. The packrat cache is cleared first, unless configured not
+    to be.
+
+    The parser is only streamlined the first time, since pyparsing walks the
+    whole grammar again on every call, which costs more than compiling a
+    small document.
+    """
+    if not parser.streamlined:
+        parser.streamline()
+    if __PACKRAT['clear_between_documents']:
+        __clear_packrat_cache()
+    return parser
+
+
+def parse_at(parser, to_scan, offset):
+    """
+    Attempts a single match at the given offset. Returns (tokens, end) on
+    success, or None if the parser doesn't match there or matches nothing.
+    See prepare_scan().
+    """
+    try:
+        # pylint: disable=protected-access
+        end, tokens = parser._parse(to_scan, offset)
+    except pp.ParseException:
+        return None
+    return (tokens, end) if end > offset else None
+
+
+def find_all(sigil, to_scan):
+    """
+    Yields the offset of every occurrence of the sigil in the given string.
+
+    >>> list(find_all('@fn', '@fn a { @fn b { :; }; }'))
+    [0, 8]
+    """
+    offset = to_scan.find(sigil)
+    while offset != -1:
+        yield offset
+        offset = to_scan.find(sigil, offset + 1)
+
+
+#
+# Packrat Caching
+#
+
+DEFAULT_PACKRAT_CACHE_SIZE = 128
+
+
+def configure_packrat(enabled=True, cache_size=DEFAULT_PACKRAT_CACHE_SIZE, clear_between_documents=True):
+    """
+    Configures the parser's packrat (memoization) cache. A cache_size of None
+    lets the cache grow without bound. Unless clear_between_documents is
+    unset, the cache is emptied before each document is scanned, so it never
+    holds results for more than one document.
+
+    Reconfiguring empties the cache, but the statistics carry on.
+    """
+    __clear_packrat_cache()
+
+    # pyparsing only lets packrat parsing be enabled once, so it's reset here,
+    # through internals which the pinned versions of pyparsing (2.1.6 up to 3)
+    # all have.
+    # pylint: disable=protected-access
+    pp.ParserElement._packratEnabled = False
+    pp.ParserElement._parse = pp.ParserElement._parseNoCache
+    if enabled:
+        pp.ParserElement.enablePackrat(cache_size)
+
+    __PACKRAT.update(
+        enabled=enabled,
+        cache_size=cache_size,
+        clear_between_documents=clear_between_documents)
+
+
+def packrat_stats():
+    """
+    Returns a PackratStats with the current configuration and the cache hits,
+    misses and evictions since the parse module was imported or since
+    reset_packrat_stats() was last called. pyparsing doesn't count evictions,
+    so they're estimated from the misses and the cache size.
+    """
+    hits, misses = pp.ParserElement.packrat_cache_stats[:2]
+    return PackratStats(
+        enabled=__PACKRAT['enabled'],
+        cache_size=__PACKRAT['cache_size'],
+        hits=__PACKRAT_TOTALS['hits'] + hits,
+        misses=__PACKRAT_TOTALS['misses'] + misses,
+        evictions=__PACKRAT_TOTALS['evictions'] + __evictions(misses))
+
+
+def reset_packrat_stats():
+    """
+    Sets the packrat cache statistics back to zero.
+    """
+    pp.ParserElement.packrat_cache_stats[:] = [0] * len(pp.ParserElement.packrat_cache_stats)
+    __PACKRAT_TOTALS.update(hits=0, misses=0, evictions=0)
+
+
+# noinspection PyClassHasNoInit
+class PackratStats(collections.namedtuple('PackratStats', (
+        'enabled', 'cache_size', 'hits', 'misses', 'evictions'))):
+    __slots__ = ()
+
+    def summary(self):
+        """
+        >>> PackratStats(True, 128, hits=3, misses=1, evictions=0).summary()
+        'Packrat cache (size 128): 3 hits, 1 misses, 0 evictions (estimated)'
+        >>> PackratStats(False, 128, hits=0, misses=0, evictions=0).summary()
+        'Packrat cache disabled'
+        """
+        if not self.enabled:
+            return 'Packrat cache disabled'
+        return (
+            'Packrat cache (size {size}): {s.hits} hits, {s.misses} misses, '
+            '{s.evictions} evictions (estimated)'.format(
+                size='unbounded' if self.cache_size is None else self.cache_size,
+                s=self))
+
+
+__PACKRAT = {}
+
+__PACKRAT_TOTALS = dict(hits=0, misses=0, evictions=0)
+
+
+def __evictions(misses):
+    # Every miss adds an entry, and a full cache evicts the oldest entry.
+    size = __PACKRAT['cache_size']
+    return 0 if size is None or not __PACKRAT['enabled'] else max(0, misses - size)
+
+
+def __clear_packrat_cache():
+    # pyparsing zeroes its statistics when the cache is cleared, so they're
+    # added to the running totals first.
+    hits, misses = pp.ParserElement.packrat_cache_stats[:2]
+    if __PACKRAT:
+        __PACKRAT_TOTALS['hits'] += hits
+        __PACKRAT_TOTALS['misses'] += misses
+        __PACKRAT_TOTALS['evictions'] += __evictions(misses)
+    pp.ParserElement.resetCache()
+
+
+# Enable memoization to speed up the parser.
+configure_packrat()
+
+
 #
 # Specifications
 #
@@ -0,0 +1,157 @@
+"""
+Opt-in timing of the compiler's phases. The compiler marks its phases with
+phase() and count(), which do nothing unless a profile is being collected by
+way of profiling().
+"""
+import collections
+import contextlib
+import time
+
+
+def phase(name):
+    """
+    Returns a context manager which adds the time spent inside it, and one
+    call, to the named phase of the active profile (if there is one).
+    """
+    return _Phase(__ACTIVE[-1], name) if __ACTIVE else _NULL_PHASE
+
+
+def count(name, n=1):
+    """
+    Adds n to the named counter of the active profile (if there is one).
+    """
+    if __ACTIVE:
+        __ACTIVE[-1].add_count(name, n)
+
+
+def timed(iterable, name):
+    """
+    Returns the iterable, with the time taken to produce each item added to
+    the named phase of the active profile (if there is one).
+    """
+    if not __ACTIVE:
+        return iterable
+    return __timed(__ACTIVE[-1], iterable, name)
+
+
+def is_active():
+    return bool(__ACTIVE)
+
+
+@contextlib.contextmanager
+def profiling():
+    """
+    Collects a Profile of everything done within the context.
+    """
+    profile = Profile()
+    __ACTIVE.append(profile)
+    try:
+        yield profile
+    finally:
+        __ACTIVE.pop()
+
+
+# noinspection PyClassHasNoInit
+class PhaseTiming(collections.namedtuple('PhaseTiming', ('calls', 'seconds'))):
+    __slots__ = ()
+
+
+class Profile(object):
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.counts = collections.OrderedDict()
+
+    def add_time(self, name, seconds):
+        timing = self.phases.get(name, PhaseTiming(calls=0, seconds=0.0))
+        self.phases[name] = PhaseTiming(calls=timing.calls + 1, seconds=timing.seconds + seconds)
+
+    def add_count(self, name, n):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self):
+        return collections.OrderedDict((
+            ('phases', collections.OrderedDict(
+                (name, timing._asdict()) for name, timing in self.phases.items())),
+            ('counts', self.counts)))
+
+    def report(self, report_format='table'):
+        """
+        Returns the profile as a table, or as JSON if report_format is 'json'.
+        Phases are listed in the order in which they were first entered.
+
+        >>> p = Profile()
+        >>> p.add_time('read', 0.0015)
+        >>> p.add_count('bytes_in', 120)
+        >>> print(p.report())
+        phase                     calls    total (ms)
+        read                          1         1.500
+        <BLANKLINE>
+        count                                   value
+        bytes_in                                  120
+        >>> print(p.report('json'))
+        {"phases": {"read": {"calls": 1, "seconds": 0.0015}}, "counts": {"bytes_in": 120}}
+        """
+        if report_format == 'json':
+            import json
+            return json.dumps(self.as_dict())
+
+        lines = ['{0:<20} {1:>10} {2:>13}'.format('phase', 'calls', 'total (ms)')]
+        lines.extend(
+            '{0:<20} {1:>10} {2:>13.3f}'.format(name, timing.calls, timing.seconds * 1000)
+            for name, timing in self.phases.items())
+        lines.append('')
+        lines.append('{0:<20} {1:>24}'.format('count', 'value'))
+        lines.extend(
+            '{0:<20} {1:>24}'.format(name, value)
+            for name, value in self.counts.items())
+        return '\n'.join(lines)
+
+
+#
+# Private Helpers
+#
+
+__ACTIVE = []
+
+
+class _Phase(object):
+    __slots__ = ('profile', 'name', 'start')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add_time(self.name, time.time() - self.start)
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+__END = object()
+
+
+def __timed(profile, iterable, name):
+    iterator = iter(iterable)
+    while True:
+        start = time.time()
+        item = next(iterator, __END)
+        profile.add_time(name, time.time() - start)
+        if item is __END:
+            return
+        yield item
@@ -0,0 +1,370 @@
+"""
+A compile server, which keeps a warm compiler (the parser, with its packrat
+cache, and the function template) behind a Unix domain socket, so that each
+compile doesn't pay for starting Python and building them first.
+
+Each connection carries a single request and its response, both as JSON. The
+client writes its request and shuts down its side of the connection:
+
+    {"version": "2.0.2", "compiler": "...", "op": "compile", "source": "...", "options": {...}}
+    {"version": "2.0.2", "compiler": "...", "op": "stats"}
+    {"version": "2.0.2", "compiler": "...", "op": "stop"}
+
+and the server replies with {"ok": true, ...} or {"ok": false, "error": "..."}.
+A server only answers clients of its own version, with the same compiler
+(cache.compiler_fingerprint()), so one left running across an upgrade or an
+edit to the compiler isn't used.
+
+The socket is only for the user who started the server: by default it's kept
+in a directory only they can use, the client won't talk to a socket which
+belongs to anyone else, and where the platform says who's at the other end of
+a connection (SO_PEERCRED), both sides check that too.
+
+This module is imported by the client on every compile, so it doesn't import
+the compiler itself until a server is started.
+"""
+import collections
+import contextlib
+import errno
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+import time
+
+from . import __version__
+from . import cache
+
+
+# Latency percentiles are worked out over this many of the latest requests.
+LATENCY_WINDOW = 1024
+
+PERCENTILES = (50, 90, 99)
+
+# A request which takes longer than this many seconds is given up on (and the
+# client compiles for itself), so a stuck server can't hang every compile.
+REQUEST_TIMEOUT = 10.0
+
+
+class ServerUnavailable(Exception):
+    """
+    Raised by request() when there's no server listening on the socket, it's
+    of another version (or compiler), or it isn't run by the same user.
+    """
+
+
+class AlreadyRunning(Exception):
+    """
+    Raised by serve() when another server is listening on the socket.
+    """
+
+
+class UnsafeSocket(Exception):
+    """
+    Raised by serve() when the socket's directory belongs to another user, or
+    other users could replace the socket in it.
+    """
+
+
+def default_socket_path():
+    """
+    Returns the path of the server's socket: $BASHUP_SOCKET if it's set, or
+    server.sock in a per-user directory in $XDG_RUNTIME_DIR (or the temporary
+    directory).
+    """
+    path = os.environ.get('BASHUP_SOCKET')
+    if path:
+        return path
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, 'bashup-{uid}'.format(uid=os.getuid()), 'server.sock')
+
+
+class Stats(object):
+    """
+    Counts of the requests a server has handled, and the latency of the
+    latest ones.
+
+    >>> stats = Stats()
+    >>> for ms in (1, 2, 3, 4):
+    ...     stats.record('compile', ms / 1000.0, ok=ms != 4)
+    >>> print(stats.summary())
+    requests: 4 (compile: 4), errors: 1, latency ms: p50=2.000 p90=4.000 p99=4.000
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.requests = collections.Counter()
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=window)
+
+    def record(self, op, seconds, ok=True):
+        self.requests[op] += 1
+        if not ok:
+            self.errors += 1
+        self.latencies.append(seconds)
+
+    def percentile(self, p):
+        """
+        Returns the given percentile of the recorded latencies, in seconds
+        (nearest rank), or None if there are none.
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(0, min(len(ordered), -(-len(ordered) * p // 100)) - 1)]
+
+    def as_dict(self):
+        percentiles = ((p, self.percentile(p)) for p in PERCENTILES)
+        return collections.OrderedDict((
+            ('requests', sum(self.requests.values())),
+            ('by_op', dict(self.requests)),
+            ('errors', self.errors),
+            ('latency_ms', collections.OrderedDict(
+                ('p{0}'.format(p), None if seconds is None else seconds * 1000)
+                for p, seconds in percentiles))))
+
+    def summary(self):
+        return summarize(self.as_dict())
+
+
+def summarize(stats):
+    """
+    Returns the dict of stats (Stats.as_dict(), as a server reports it) as a
+    single line.
+    """
+    return 'requests: {total} ({by_op}), errors: {errors}, latency ms: {latency}'.format(
+        total=stats['requests'],
+        by_op=', '.join('{0}: {1}'.format(op, n) for op, n in sorted(stats['by_op'].items())) or 'none',
+        errors=stats['errors'],
+        latency=' '.join(
+            '{0}={1}'.format(name, '-' if ms is None else '{0:.3f}'.format(ms))
+            for name, ms in sorted(stats['latency_ms'].items(), key=lambda i: int(i[0][1:]))))
+
+
+def serve(socket_path=None, compile_fn=None, ready_fn=None):
+    """
+    Serves compile requests on the Unix domain socket (default_socket_path(),
+    if not given) until a stop request or until interrupted, then removes the
+    socket. Requests are handled one at a time, in this process, by
+    compile_fn(bashup_str, options) (a compile.options.Options, or None for
+    the defaults). A stale socket left by a server which is no longer running
+    is replaced, but AlreadyRunning is raised if anything is listening on it.
+    ready_fn, if given, is called once the socket is listening.
+
+    The socket's directory is created (only usable by this user) if it's
+    missing, and UnsafeSocket is raised if other users could replace the
+    socket in it. Only the user running the server may connect to it.
+    """
+    socket_path = default_socket_path() if socket_path is None else socket_path
+    stats = Stats()
+
+    if compile_fn is None:
+        # Load the compiler along with the fingerprint of the files it's
+        # loaded from, rather than whenever the first request comes. Only an
+        # @fn builds the grammar and the template.
+        compile_fn = __compile_in_process
+        cache.compiler_fingerprint()
+        compile_fn(__WARM_UP_SOURCE, None)
+
+    listener = __listen(socket_path)
+    try:
+        if ready_fn is not None:
+            ready_fn()
+        while True:
+            connection, _ = listener.accept()
+            with contextlib.closing(connection):
+                if not __is_own_peer(connection):
+                    continue
+                connection.settimeout(REQUEST_TIMEOUT)
+                if not __handle(connection, compile_fn, stats):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        __unlink(socket_path)
+
+    return stats
+
+
+def request(message, socket_path=None):
+    """
+    Sends the request (a dict, without the version) to the server and returns
+    its response. Raises ServerUnavailable if there's no server, if it's of
+    another version (or compiler) or run by another user, or if it doesn't
+    respond within REQUEST_TIMEOUT seconds.
+    """
+    socket_path = default_socket_path() if socket_path is None else socket_path
+    message = dict(message, version=__version__, compiler=cache.compiler_fingerprint())
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(client):
+        try:
+            client.settimeout(REQUEST_TIMEOUT)
+            client.connect(socket_path)
+            if not __is_own_socket(socket_path) or not __is_own_peer(client):
+                raise ServerUnavailable('{path}: server is run by another user'.format(path=socket_path))
+            client.sendall(json.dumps(message).encode('utf-8'))
+            client.shutdown(socket.SHUT_WR)
+            response = json.loads(__read_all(client).decode('utf-8'))
+        except (IOError, OSError, ValueError) as e:
+            raise ServerUnavailable('{path}: {error}'.format(path=socket_path, error=e))
+
+    if response.get('version') != __version__ or response.get('compiler') != cache.compiler_fingerprint():
+        raise ServerUnavailable('{path}: server is bashup {version} with compiler {compiler}'.format(
+            path=socket_path, version=response.get('version'), compiler=response.get('compiler')))
+    return response
+
+
+def compile_remotely(bashup_str, options=None, socket_path=None):
+    """
+    Returns bashup_str compiled by the server, or None if there's no server
+    to compile it or it failed to (in which case compiling in-process gives
+    the error in full).
+    """
+    socket_path = default_socket_path() if socket_path is None else socket_path
+    if not os.path.exists(socket_path):
+        return None
+
+    try:
+        response = request(
+            dict(op='compile', source=bashup_str, options=None if options is None else __encode_options(options)),
+            socket_path)
+    except ServerUnavailable:
+        return None
+
+    return response['output'] if response.get('ok') else None
+
+
+#
+# Private Helpers
+#
+
+__BUFFER_SIZE = 64 * 1024
+
+__WARM_UP_SOURCE = '@fn warm_up { :; }\n'
+
+
+def __compile_in_process(bashup_str, options):
+    from .compile import bash
+    if options is None:
+        return bash.compile_to_bash(bashup_str)
+    return bash.compile_to_bash(bashup_str, compilers=bash.compilers_for(options))
+
+
+def __encode_options(options):
+    return dict((name, list(value) if isinstance(value, tuple) else value)
+                for name, value in options._asdict().items())
+
+
+def __decode_options(encoded):
+    if encoded is None:
+        return None
+    from .compile import options
+    return options.Options(**dict(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in encoded.items()))
+
+
+def __handle(connection, compile_fn, stats):
+    # Returns False once the server should stop.
+    start = time.time()
+    op = None
+
+    try:
+        message = json.loads(__read_all(connection).decode('utf-8'))
+        op = message.get('op')
+        if message.get('version') != __version__ or message.get('compiler') != cache.compiler_fingerprint():
+            response = dict(ok=False, error='version mismatch')
+        elif op == 'compile':
+            response = dict(ok=True, output=compile_fn(message['source'], __decode_options(message.get('options'))))
+        elif op == 'stats':
+            response = dict(ok=True, stats=stats.as_dict())
+        elif op == 'stop':
+            response = dict(ok=True)
+        else:
+            response = dict(ok=False, error='unknown request: {0}'.format(op))
+    except Exception as e:  # pylint: disable=broad-except
+        # Any error belongs to this request; the server carries on.
+        response = dict(ok=False, error='{0}: {1}'.format(type(e).__name__, e))
+
+    response.update(version=__version__, compiler=cache.compiler_fingerprint())
+    try:
+        connection.sendall(json.dumps(response).encode('utf-8'))
+    except (IOError, OSError):
+        pass
+
+    stats.record(op or 'invalid', time.time() - start, ok=response['ok'])
+    return op != 'stop'
+
+
+def __listen(socket_path):
+    __make_private_dir(os.path.dirname(socket_path) or '.')
+
+    # Whatever is listening (a server of another version, say) is left alone.
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with contextlib.closing(probe):
+        try:
+            probe.connect(socket_path)
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+                raise AlreadyRunning('{path}: {error}'.format(path=socket_path, error=e))
+        else:
+            raise AlreadyRunning('{path}: a server is already running'.format(path=socket_path))
+    __unlink(socket_path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(16)
+    return listener
+
+
+def __make_private_dir(directory):
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    # Others may share a sticky directory (like /tmp), but can't replace what's in it.
+    status = os.stat(directory)
+    if status.st_uid not in (os.getuid(), 0) or (
+            status.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not status.st_mode & stat.S_ISVTX):
+        raise UnsafeSocket('{path}: the directory may be written by other users'.format(path=directory))
+
+
+def __is_own_socket(socket_path):
+    status = os.lstat(socket_path)
+    return stat.S_ISSOCK(status.st_mode) and status.st_uid == os.getuid()
+
+
+def __is_own_peer(connection):
+    # Only some platforms say who's connected; elsewhere the socket's owner
+    # and permissions have to do.
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return True
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    return uid == os.getuid()
+
+
+def __read_all(connection):
+    chunks = []
+    while True:
+        chunk = connection.recv(__BUFFER_SIZE)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+def __unlink(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
@@ -0,0 +1,134 @@
+"""
+Maps the lines of a compiled script back to the lines of its bashup source.
+
+A source map is written as a JSON sidecar file:
+
+    {"version": 1, "file": "out.sh", "source": "in.bashup", "lines": [1, 1, 2]}
+
+where lines holds, for each line of the generated file, the source line it
+came from. Every line generated for a construct (an @fn, an expanded macro or
+an inserted file) maps to the line of the construct itself.
+
+translate() uses a map to rewrite the FILE:LINE references which xtrace (with
+PS4='+${BASH_SOURCE}:${LINENO} ') and profiling tools print for the generated
+file into references to the source.
+"""
+import bisect
+import collections
+import json
+import os
+import re
+
+
+VERSION = 1
+
+
+# noinspection PyClassHasNoInit
+class SourceMap(collections.namedtuple('SourceMap', ('file', 'source', 'lines'))):
+    """
+    The source line (counting from 1) of each line of the generated file, as
+    a tuple. The file is None if the script was written to stdout.
+    """
+    __slots__ = ()
+
+    def source_line(self, line):
+        """
+        Returns the source line of the given line of the generated file, or
+        None if there's no such line.
+
+        >>> SourceMap(file='out.sh', source='in.bashup', lines=(1, 1, 2)).source_line(3)
+        2
+        """
+        return self.lines[line - 1] if 0 < line <= len(self.lines) else None
+
+
+def from_document(document, file_path=None, source_path=None):
+    """
+    Returns the SourceMap of a compiled ir.Document, written to file_path
+    from source_path.
+
+    >>> from bashup.compile import ir
+    >>> d = ir.Document('one\\ntwo\\n')
+    >>> d.edit([ir.Replacement(start=0, end=4, replacement='a\\nb\\n')])
+    >>> from_document(d).lines
+    (1, 1, 2)
+    """
+    text = document.text()
+    origin = __root(document).source
+    newlines = [i for i, c in enumerate(origin) if c == '\n']
+
+    line_starts = [0]
+    line_starts.extend(i + 1 for i, c in enumerate(text) if c == '\n' and i + 1 < len(text))
+
+    return SourceMap(
+        file=file_path,
+        source=source_path,
+        lines=tuple(
+            bisect.bisect_left(newlines, document.source_offset(start)) + 1
+            for start in line_starts))
+
+
+def dumps(source_map):
+    """
+    Returns the source map as JSON.
+
+    >>> print(dumps(SourceMap(file='out.sh', source='in.bashup', lines=(1, 1, 2))))
+    {"version": 1, "file": "out.sh", "source": "in.bashup", "lines": [1, 1, 2]}
+    """
+    return json.dumps(collections.OrderedDict((
+        ('version', VERSION),
+        ('file', source_map.file),
+        ('source', source_map.source),
+        ('lines', list(source_map.lines)))))
+
+
+def loads(json_str):
+    """
+    Returns the SourceMap held in the JSON string. Raises ValueError if it
+    isn't one.
+    """
+    data = json.loads(json_str)
+    if not isinstance(data, dict) or data.get('version') != VERSION:
+        raise ValueError('not a version {0} source map'.format(VERSION))
+    return SourceMap(file=data.get('file'), source=data.get('source'), lines=tuple(data['lines']))
+
+
+def translate(lines, source_map):
+    """
+    Yields the given lines (of xtrace or profiler output, say) with every
+    FILE:LINE reference to the generated file replaced by a reference to the
+    source. References match by file name, or to any file if the map's file
+    is unknown. Other references are left alone.
+
+    >>> m = SourceMap(file='out.sh', source='in.bashup', lines=(1, 1, 2))
+    >>> print(''.join(translate(['++./out.sh:3 echo hi\\n', '+lib.sh:3 x\\n'], m)))
+    ++in.bashup:2 echo hi
+    +lib.sh:3 x
+    """
+    name = None if source_map.file is None else os.path.basename(source_map.file)
+    source = source_map.source or '<source>'
+
+    def replace(match):
+        if name is not None and os.path.basename(match.group('path')) != name:
+            return match.group()
+        source_line = source_map.source_line(int(match.group('line')))
+        if source_line is None:
+            return match.group()
+        return '{source}:{line}'.format(source=source, line=source_line)
+
+    for line in lines:
+        yield __REFERENCE.sub(replace, line)
+
+
+#
+# Private Helpers
+#
+
+# PS4 prefixes are repeated '+'s, so a path can't begin with one.
+__REFERENCE = re.compile(r'(?P<path>[^\s:+\'"][^\s:\'"]*):(?P<line>\d+)')
+
+
+def __root(document):
+    while document.parent is not None:
+        document = document.parent
+    return document
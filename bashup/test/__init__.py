@@ -49,3 +49,10 @@ def captured_stdout():
     stdout = StringIO()
     with contextlib.redirect_stdout(stdout):
         yield stdout
+
+
+@contextlib.contextmanager
+def captured_stderr():
+    stderr = StringIO()
+    with contextlib.redirect_stderr(stderr):
+        yield stderr
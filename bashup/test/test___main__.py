@@ -1,6 +1,11 @@
 import contextlib
 import itertools
+import json
+import os
 import re
+import subprocess
+import sys
+import textwrap
 
 import mock
 import pathlib2 as pathlib
@@ -8,10 +13,14 @@ import pytest
 import temporary
 
 from .. import __main__
+from ..compile import bash
+from ..compile import options
 from .. import test
+from .. import trace
 
 
 DATA_DIR = pathlib.Path(__file__).parent / 'data'
+PACKAGE_PARENT_DIR = pathlib.Path(__file__).parent.parent.parent
 
 
 @pytest.mark.parametrize('argv', (['-h'], ['--help']))
@@ -76,6 +85,78 @@ def test_compilation_writing_to_stdout():
         assert stdout.getvalue().strip() == 'Compiled(to_compile)'
 
 
+def test_compilation_in_place():
+    with temporary.temp_file('to_compile') as in_file:
+        __main__.compile_file(
+            in_file=in_file,
+            out_file=in_file,
+            compile_fn=lambda x: 'Compiled(' + x + ')')
+        with open(str(in_file)) as f:
+            assert f.read() == 'Compiled(to_compile)'
+
+
+def test_compilation_memory_is_bounded():
+    tracemalloc = pytest.importorskip('tracemalloc')
+    line = 'printf "%s\\n" "${value}"  # filler\n'
+
+    with temporary.temp_dir() as temp_dir:
+        in_file = temp_dir / 'large.bashup'
+        with open(str(in_file), 'w') as f:
+            for _ in range(20000):
+                f.write(line)
+        in_size = in_file.stat().st_size
+
+        tracemalloc.start()
+        try:
+            __main__.compile_file(
+                in_file=in_file,
+                out_file=temp_dir / 'large.sh',
+                compile_fn=lambda x: x.upper())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert (temp_dir / 'large.sh').stat().st_size == in_size
+
+    # Reading the whole file at once would need more than this on its own.
+    assert in_size > 512 * 1024 > peak
+
+
+def test_compile_file_with_whole_document_options():
+    filler = 'printf "%s\\n" "${value}"  # filler\n' * 2000
+    bashup_str = '@fn late { :; }\n@fn unused { :; }\n' + filler + 'late\n'
+
+    with temporary.temp_dir() as temp_dir:
+        in_file = temp_dir / 'in.bashup'
+        with open(str(in_file), 'w') as f:
+            f.write(bashup_str)
+
+        __main__.compile_file(
+            in_file=in_file,
+            out_file=temp_dir / 'out.sh',
+            options=options.DEFAULT_OPTIONS._replace(drop_unused_fns=True, keep=('kept',)))
+
+        with open(str(temp_dir / 'out.sh')) as f:
+            compiled = f.read()
+
+    assert compiled.startswith('#\n# usage: late [ARGS]\n#\nlate() { :; }\n' + filler[:100])
+    assert 'unused' not in compiled
+
+
+def test_main_passes_optimization_options():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['-i', 'in-file', '--drop-unused', '--keep=a, b', '--minify'],
+        commands=__main__.DEFAULT_COMMANDS._replace(compile_fn=master_mock.compile_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.compile_fn(
+            in_file='in-file',
+            out_file='-',
+            options=options.DEFAULT_OPTIONS._replace(drop_unused_fns=True, keep=('a', 'b'), minify=True)),)
+
+
 def test_run_file():
     @contextlib.contextmanager
     def temp_file_ctx(run_str):
@@ -85,13 +166,276 @@ def test_run_file():
         actual = __main__.run_file(
             to_run=to_run,
             args=['one', 'two'],
-            compile_fn=lambda x: 'Compiled(' + x + ')',
-            run_fn=lambda x: 'Ran(' + str(x) + ')',
-            temp_file_ctx=temp_file_ctx)
+            hooks=__main__.DEFAULT_RUN_HOOKS._replace(
+                compile_fn=lambda x: 'Compiled(' + x + ')',
+                run_fn=lambda x: 'Ran(' + str(x) + ')',
+                temp_file_ctx=temp_file_ctx,
+                memfd_create=None))
 
     assert actual == "Ran(('bash', 'Temp(Compiled(to_compile))', 'one', 'two'))"
 
 
+@pytest.mark.parametrize('version_info,kwargs', (
+    ((2, 7, 18), dict(close_fds=False)),
+    ((3, 6, 0), dict(pass_fds=(7,)))))
+def test_run_file_keeps_trace_fd_open(version_info, kwargs):
+    calls = []
+
+    @contextlib.contextmanager
+    def temp_file_ctx(_):
+        yield 'script'
+
+    with temporary.temp_file('to_compile') as to_run:
+        with mock.patch.dict(os.environ, BASHUP_TRACE_FD='7'):
+            with mock.patch.object(sys, 'version_info', version_info):
+                __main__.run_file(
+                    to_run=to_run,
+                    args=[],
+                    options=options.DEFAULT_OPTIONS._replace(instrument=True),
+                    hooks=__main__.DEFAULT_RUN_HOOKS._replace(
+                        compile_fn=lambda x, options: x,
+                        run_fn=lambda args, **kw: calls.append(kw),
+                        temp_file_ctx=temp_file_ctx,
+                        memfd_create=None))
+
+    assert calls == [kwargs]
+
+
+def test_run_file_with_cache():
+    compiled = []
+
+    def compile_fn(run_str):
+        compiled.append(run_str)
+        return 'Compiled(' + run_str + ')'
+
+    def run_fn(args):
+        with open(args[1]) as f:
+            return args[:1] + (f.read(),) + args[2:]
+
+    with temporary.temp_dir() as cache_dir:
+        with temporary.temp_file('to_compile') as to_run:
+            actual = [
+                __main__.run_file(
+                    to_run=to_run,
+                    args=['one'],
+                    mode=__main__.RunMode(use_cache=True, cache_dir=str(cache_dir), replace_process=False),
+                    hooks=__main__.DEFAULT_RUN_HOOKS._replace(compile_fn=compile_fn, run_fn=run_fn))
+                for _ in range(2)]
+
+    assert actual == [('bash', 'Compiled(to_compile)', 'one')] * 2
+    assert compiled == ['to_compile']
+
+
+def test_run_file_with_cache_and_inserts():
+    compiled = []
+
+    def compile_fn(run_str):
+        compiled.append(run_str)
+        return 'Compiled(' + run_str + ')'
+
+    with temporary.temp_dir() as cache_dir:
+        with temporary.temp_dir() as src_dir:
+            with open(str(src_dir / 'lib.bashup'), 'w') as f:
+                f.write('one')
+            with open(str(src_dir / 'main.bashup'), 'w') as f:
+                f.write('@insert lib.bashup\n')
+
+            for lib_str in ('one', 'one', 'two'):
+                with open(str(src_dir / 'lib.bashup'), 'w') as f:
+                    f.write(lib_str)
+                __main__.run_file(
+                    to_run=src_dir / 'main.bashup',
+                    args=[],
+                    mode=__main__.RunMode(use_cache=True, cache_dir=str(cache_dir), replace_process=False),
+                    hooks=__main__.DEFAULT_RUN_HOOKS._replace(compile_fn=compile_fn, run_fn=lambda args: None))
+
+    assert compiled == ['one\n', 'two\n']
+
+
+def test_compile_file_with_inserts_and_depfile():
+    with temporary.temp_dir() as temp_dir:
+        with open(str(temp_dir / 'lib.bashup'), 'w') as f:
+            f.write('@fn lib { :; }\n')
+        with open(str(temp_dir / 'in.bashup'), 'w') as f:
+            f.write('@insert lib.bashup\nlib\n')
+
+        __main__.main(argv=[
+            '-i', str(temp_dir / 'in.bashup'),
+            '-o', str(temp_dir / 'out.sh'),
+            '--depfile', str(temp_dir / 'out.d')])
+
+        with open(str(temp_dir / 'out.sh')) as f:
+            compiled = f.read()
+        with open(str(temp_dir / 'out.d')) as f:
+            depfile = f.read()
+
+    assert compiled == bash.compile_to_bash('@fn lib { :; }\nlib\n')
+    test.assert_eq(depfile, '{out}: {src} {lib}\n\n{lib}:\n'.format(
+        out=temp_dir / 'out.sh',
+        src=temp_dir / 'in.bashup',
+        lib=temp_dir / 'lib.bashup'))
+
+
+def test_compile_file_carries_definitions_from_inserts():
+    # Enough filler that the stream is compiled in more than one chunk.
+    filler = 'echo filler\n' * 3000
+
+    with temporary.temp_dir() as temp_dir:
+        with open(str(temp_dir / 'lib.bashup'), 'w') as f:
+            f.write('@greet = echo hi\n')
+        with open(str(temp_dir / 'in.bashup'), 'w') as f:
+            f.write('@insert lib.bashup\n' + filler + '@greet\n')
+
+        __main__.compile_file(
+            in_file=str(temp_dir / 'in.bashup'),
+            out_file=str(temp_dir / 'out.sh'))
+
+        with open(str(temp_dir / 'out.sh')) as f:
+            compiled = f.read()
+
+    test.assert_eq(compiled, bash.compile_to_bash('@greet = echo hi\n' + filler + '@greet\n'))
+
+
+def test_compile_file_with_source_map():
+    with temporary.temp_dir() as temp_dir:
+        with open(str(temp_dir / 'lib.bashup'), 'w') as f:
+            f.write('@fn lib {\n    echo lib\n}\n')
+        with open(str(temp_dir / 'in.bashup'), 'w') as f:
+            f.write('#!/bin/bash\n@insert lib.bashup\nlib\n')
+
+        __main__.main(argv=[
+            '-i', str(temp_dir / 'in.bashup'),
+            '-o', str(temp_dir / 'out.sh'),
+            '--source-map', str(temp_dir / 'out.map'),
+            '--minify'])
+
+        with open(str(temp_dir / 'out.sh')) as f:
+            compiled = f.read()
+        with open(str(temp_dir / 'out.map')) as f:
+            source_map = json.load(f)
+
+        with open(str(temp_dir / 'trace.log'), 'w') as f:
+            f.write('+out.sh:1 x\n+out.sh:{0} lib\n'.format(len(compiled.splitlines())))
+        with test.captured_stdout() as stdout:
+            status = __main__.map_lines(str(temp_dir / 'out.map'), [str(temp_dir / 'trace.log')])
+
+    assert compiled == bash.compile_to_bash(
+        '#!/bin/bash\n@fn lib {\n    echo lib\n}\nlib\n',
+        compilers=bash.compilers_for(options.DEFAULT_OPTIONS._replace(minify=True)))
+    assert source_map['file'] == str(temp_dir / 'out.sh')
+    assert source_map['lines'][0] == 1
+    assert set(source_map['lines'][1:-1]) == {2}
+    assert status == 0
+    test.assert_eq(stdout.getvalue(), '+{src}:1 x\n+{src}:3 lib\n'.format(src=temp_dir / 'in.bashup'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'memfd_create'), reason='requires memfd_create')
+def test_run_file_in_memory():
+    def run_fn(args, pass_fds):
+        assert args[1] == '/dev/fd/{0}'.format(pass_fds[0])
+        with open(args[1]) as f:
+            return args[:1] + (f.read(),) + args[2:]
+
+    def temp_file_ctx(_):
+        raise AssertionError('nothing should be written to disk')  # pragma: no cover
+
+    with temporary.temp_file('to_compile') as to_run:
+        actual = __main__.run_file(
+            to_run=to_run,
+            args=['one'],
+            hooks=__main__.DEFAULT_RUN_HOOKS._replace(
+                compile_fn=lambda x: 'Compiled(' + x + ')',
+                run_fn=run_fn,
+                temp_file_ctx=temp_file_ctx))
+
+    assert actual == ('bash', 'Compiled(to_compile)', 'one')
+
+
+@pytest.mark.parametrize('use_cache,memfd_create', itertools.product(
+    (False, True),
+    (None, getattr(os, 'memfd_create', None))))
+def test_run_file_replacing_process(use_cache, memfd_create):
+    def exec_fn(file, args):
+        with open(args[1]) as f:
+            return file, args[:1] + (f.read(),) + args[2:]
+
+    with temporary.temp_dir() as cache_dir:
+        with temporary.temp_file('to_compile') as to_run:
+            actual = __main__.run_file(
+                to_run=to_run,
+                args=['one'],
+                mode=__main__.RunMode(use_cache=use_cache, cache_dir=str(cache_dir), replace_process=True),
+                hooks=__main__.RunHooks(
+                    compile_fn=lambda x: 'Compiled(' + x + ')',
+                    run_fn=None,
+                    temp_file_ctx=None,
+                    exec_fn=exec_fn,
+                    memfd_create=memfd_create))
+
+    assert actual == ('bash', ('bash', 'Compiled(to_compile)', 'one'))
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self'), reason='requires /proc')
+@pytest.mark.parametrize('cache_flag', ('--no-cache', None))
+def test_run_with_exec_leaves_no_python_process(cache_flag):
+    script = textwrap.dedent("""
+        echo "${$} ${PPID}"
+        tr '\\0' ' ' < /proc/${$}/cmdline
+        exit 7
+    """)
+
+    with temporary.temp_dir() as cache_dir:
+        with temporary.temp_file(script) as to_run:
+            env = dict(os.environ, XDG_CACHE_HOME=str(cache_dir))
+            p = subprocess.Popen(
+                args=[sys.executable, '-m', 'bashup', '--exec', '-r', str(to_run)] + (
+                    [cache_flag] if cache_flag else []),
+                cwd=str(PACKAGE_PARENT_DIR),
+                env=env,
+                stdout=subprocess.PIPE)
+            stdout, _ = p.communicate()
+
+    pids, cmdline = stdout.decode('utf-8').splitlines()
+
+    # The script runs as the very process that was started, whose parent is
+    # this test, so no Python process was left waiting in between.
+    assert pids == '{0} {1}'.format(p.pid, os.getpid())
+    assert cmdline.split()[0] == 'bash'
+    assert p.returncode == 7
+
+
+def test_startup_defers_heavy_imports():
+    script = textwrap.dedent("""
+        import sys
+        import bashup.__main__
+        print(' '.join(sorted(m for m in sys.modules if m in (
+            'bashup.parse', 'jinja2', 'pyparsing', 'temporary'))))
+    """)
+
+    stdout = subprocess.check_output(
+        args=[sys.executable, '-c', script],
+        cwd=str(PACKAGE_PARENT_DIR))
+
+    assert stdout.decode('utf-8').strip() == ''
+
+
+def test_run_without_disk_sets_script_name():
+    script = 'echo "${0} ${BASH_SOURCE[0]} ${*}"'
+
+    with temporary.temp_file(script) as to_run:
+        p = subprocess.Popen(
+            args=[sys.executable, '-m', 'bashup', '--no-cache', '-r', str(to_run), '--', 'a', 'b'],
+            cwd=str(PACKAGE_PARENT_DIR),
+            stdout=subprocess.PIPE)
+        stdout, _ = p.communicate()
+
+    name, source, args = stdout.decode('utf-8').strip().split(' ', 2)
+
+    assert name == source
+    assert args == 'a b'
+    assert p.returncode == 0
+
+
 @pytest.mark.parametrize('run_flag', ('-r', '--run'))
 def test_main_routes_to_run(run_flag):
     master_mock = mock.Mock()
@@ -99,14 +443,42 @@ def test_main_routes_to_run(run_flag):
 
     retval = __main__.main(
         argv=[run_flag, 'my-script', '--', 'one', '--two', '-3', '--', 'five'],
-        run_fn=master_mock.run_fn,
-        compile_fn=master_mock.compile_fn)
+        commands=__main__.DEFAULT_COMMANDS._replace(run_fn=master_mock.run_fn, compile_fn=master_mock.compile_fn))
 
     assert retval == 'run-return'
     assert tuple(master_mock.mock_calls) == (
         mock.call.run_fn(
             to_run='my-script',
-            args=('one', '--two', '-3', '--', 'five')),)
+            args=('one', '--two', '-3', '--', 'five'),
+            mode=__main__.RunMode(use_cache=True, cache_dir=None, replace_process=False)),)
+
+
+def test_main_routes_to_run_without_cache():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['-r', 'my-script', '--no-cache'],
+        commands=__main__.DEFAULT_COMMANDS._replace(run_fn=master_mock.run_fn, compile_fn=master_mock.compile_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.run_fn(
+            to_run='my-script',
+            args=(),
+            mode=__main__.RunMode(use_cache=False, cache_dir=None, replace_process=False)),)
+
+
+def test_main_routes_to_run_with_exec():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['-r', 'my-script', '--exec'],
+        commands=__main__.DEFAULT_COMMANDS._replace(run_fn=master_mock.run_fn, compile_fn=master_mock.compile_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.run_fn(
+            to_run='my-script',
+            args=(),
+            mode=__main__.RunMode(use_cache=True, cache_dir=None, replace_process=True)),)
 
 
 @pytest.mark.parametrize('in_flag,out_flag', itertools.product(('-i', '--in'), ('-o', '--out')))
@@ -115,8 +487,7 @@ def test_main_routes_to_compile(in_flag, out_flag):
 
     retval = __main__.main(
         argv=[in_flag, 'in-file', out_flag, 'out-file'],
-        run_fn=master_mock.run_fn,
-        compile_fn=master_mock.compile_fn)
+        commands=__main__.DEFAULT_COMMANDS._replace(run_fn=master_mock.run_fn, compile_fn=master_mock.compile_fn))
 
     assert retval == 0
     assert tuple(master_mock.mock_calls) == (
@@ -125,6 +496,454 @@ def test_main_routes_to_compile(in_flag, out_flag):
             out_file='out-file'),)
 
 
+@pytest.mark.parametrize('jobs_args,jobs', (([], 1), (['-j', '4'], 4), (['--jobs=8'], 8)))
+def test_main_routes_to_build(jobs_args, jobs):
+    master_mock = mock.Mock()
+    master_mock.build_fn.return_value = 'build-return'
+
+    retval = __main__.main(
+        argv=['build', 'src', 'out'] + jobs_args,
+        commands=__main__.DEFAULT_COMMANDS._replace(
+            run_fn=master_mock.run_fn,
+            compile_fn=master_mock.compile_fn,
+            build_fn=master_mock.build_fn))
+
+    assert retval == 'build-return'
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.build_fn(
+            src_dir='src',
+            out_dir='out',
+            jobs=jobs),)
+
+
+@pytest.mark.parametrize('jobs', ('abc', '0', '-2'))
+def test_main_rejects_bad_jobs(jobs):
+    master_mock = mock.Mock()
+
+    with pytest.raises(SystemExit):
+        __main__.main(
+            argv=['build', 'src', 'out', '--jobs=' + jobs],
+            commands=__main__.DEFAULT_COMMANDS._replace(build_fn=master_mock.build_fn))
+
+    assert master_mock.mock_calls == []
+
+
+def test_main_routes_to_build_watch():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['build', 'src', 'out', '--watch'],
+        commands=__main__.DEFAULT_COMMANDS._replace(
+            run_fn=master_mock.run_fn,
+            compile_fn=master_mock.compile_fn,
+            build_fn=master_mock.build_fn,
+            watch_dir_fn=master_mock.watch_dir_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.watch_dir_fn(
+            src_dir='src',
+            out_dir='out',
+            jobs=1),)
+
+
+def test_main_routes_to_watch():
+    master_mock = mock.Mock()
+    master_mock.watch_fn.return_value = 'watch-return'
+
+    retval = __main__.main(
+        argv=['-i', 'in-file', '-o', 'out-file', '--watch'],
+        commands=__main__.DEFAULT_COMMANDS._replace(
+            run_fn=master_mock.run_fn,
+            compile_fn=master_mock.compile_fn,
+            watch_fn=master_mock.watch_fn))
+
+    assert retval == 'watch-return'
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.watch_fn(
+            in_file='in-file',
+            out_file='out-file'),)
+
+
+def test_main_routes_to_watch_with_depfile_and_source_map():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['-i', 'in-file', '-o', 'out-file', '--watch', '--depfile=out.d', '--source-map=out.map'],
+        commands=__main__.DEFAULT_COMMANDS._replace(compile_fn=master_mock.compile_fn, watch_fn=master_mock.watch_fn))
+
+    (_, _, kwargs), = master_mock.watch_fn.mock_calls
+    kwargs.pop('compile_fn')(in_file='in-file', out_file='out-file')
+
+    assert kwargs == dict(in_file='in-file', out_file='out-file')
+    assert tuple(master_mock.compile_fn.mock_calls) == (
+        mock.call(
+            in_file='in-file',
+            out_file='out-file',
+            sidecars=__main__.Sidecars(depfile='out.d', source_map='out.map')),)
+
+
+@pytest.mark.parametrize('packrat_args,expected', (
+    (['--packrat-size=0'], mock.call(enabled=False, cache_size=128, clear_between_documents=True)),
+    (['--packrat-size=unbounded'], mock.call(enabled=True, cache_size=None, clear_between_documents=True)),
+    (['--packrat-size=16', '--keep-packrat'], mock.call(enabled=True, cache_size=16, clear_between_documents=False)),
+))
+def test_main_configures_packrat(packrat_args, expected):
+    master_mock = mock.Mock()
+
+    with mock.patch('bashup.parse.configure_packrat') as configure_packrat:
+        __main__.main(
+            argv=['-i', 'in-file'] + packrat_args,
+            commands=__main__.DEFAULT_COMMANDS._replace(compile_fn=master_mock.compile_fn))
+
+    assert configure_packrat.mock_calls == [expected]
+
+
+def test_main_rejects_bad_packrat_size():
+    with pytest.raises(SystemExit):
+        __main__.main(argv=['-i', 'in-file', '--packrat-size=lots'])
+
+
+def test_main_prints_packrat_stats():
+    master_mock = mock.Mock()
+
+    with test.captured_stderr() as stderr:
+        __main__.main(
+            argv=['-i', 'in-file', '--packrat-stats'],
+            commands=__main__.DEFAULT_COMMANDS._replace(compile_fn=master_mock.compile_fn))
+
+    __assert_in('Packrat cache (size 128): ', stderr.getvalue())
+
+
+@pytest.mark.parametrize('profile_arg', ('--profile', '--profile=table'))
+def test_main_profiles_compilation(profile_arg):
+    with temporary.temp_dir() as temp_dir:
+        with test.captured_stderr() as stderr:
+            retval = __main__.main(argv=[
+                '-i', str(DATA_DIR / 'fn.bashup'),
+                '-o', str(temp_dir / 'fn.sh'),
+                profile_arg])
+        out_size = (temp_dir / 'fn.sh').stat().st_size
+
+    report = stderr.getvalue()
+    assert retval == 0
+    for phase in ('read', 'lex', 'fn.scan', 'fn.spec', 'fn.render', 'fn.indent', 'compile_constructs', 'write'):
+        assert re.search(r'^' + re.escape(phase) + r' +\d+ +\d+\.\d{3}$', report, re.MULTILINE)
+    assert re.search(r'^fns_compiled +2$', report, re.MULTILINE)
+    assert re.search(r'^bytes_out +' + str(out_size) + '$', report, re.MULTILINE)
+
+
+def test_main_profiles_compilation_as_json():
+    with temporary.temp_dir() as temp_dir:
+        with test.captured_stderr() as stderr:
+            __main__.main(argv=[
+                '-i', str(DATA_DIR / 'fn.bashup'),
+                '-o', str(temp_dir / 'fn.sh'),
+                '--profile=json'])
+
+    report = json.loads(stderr.getvalue())
+    assert report['counts']['fns_compiled'] == 2
+    assert report['counts']['bytes_in'] == (DATA_DIR / 'fn.bashup').stat().st_size
+    assert report['phases']['fn.render']['calls'] == 2
+
+
+def test_main_rejects_bad_profile_format():
+    with pytest.raises(SystemExit):
+        __main__.main(argv=['-i', 'in-file', '--profile=xml'])
+
+
+def test_main_leaves_profile_flag_after_double_dash_to_script():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['-r', 'file', '--', '--profile'],
+        commands=__main__.DEFAULT_COMMANDS._replace(run_fn=master_mock.run_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.run_fn(
+            to_run='file',
+            args=('--profile',),
+            mode=__main__.RunMode(use_cache=True, cache_dir=None, replace_process=False)),)
+
+
+def test_main_passes_codegen_options():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['-i', 'in-file', '-o', 'out-file', '--arg-parser=case'],
+        commands=__main__.DEFAULT_COMMANDS._replace(compile_fn=master_mock.compile_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.compile_fn(
+            in_file='in-file',
+            out_file='out-file',
+            options=options.DEFAULT_OPTIONS._replace(arg_parser='case')),)
+
+
+def test_main_passes_fn_layout():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['build', 'src', 'out', '--fn-layout=inline'],
+        commands=__main__.DEFAULT_COMMANDS._replace(build_fn=master_mock.build_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.build_fn(
+            src_dir='src',
+            out_dir='out',
+            jobs=1,
+            options=options.DEFAULT_OPTIONS._replace(fn_layout='inline')),)
+
+
+@pytest.mark.parametrize('argv', (
+    ['-i', 'in-file', '--arg-parser=getopt'],
+    ['-i', 'in-file', '--fn-layout=nested'],
+))
+def test_main_rejects_bad_codegen_options(argv):
+    with pytest.raises(SystemExit):
+        __main__.main(argv=argv)
+
+
+@pytest.mark.parametrize('arg_parser,fn_layout', tuple(itertools.product(options.ARG_PARSERS, options.FN_LAYOUTS)))
+def test_codegen_options_behave_alike(arg_parser, fn_layout):
+    script = textwrap.dedent("""
+        @fn greet name, greeting_word='hi' {
+            printf '%s|' "${greeting_word}" "${name}" "$@"
+            echo
+        }
+        greet --name=bob x --greeting-word=yo 'a b' --other=1 '' --name=al
+        greet x || echo "status: $?"
+    """)
+
+    with temporary.temp_file(script) as to_run:
+        output = subprocess.check_output((
+            sys.executable, '-m', 'bashup', '-r', str(to_run), '--no-cache',
+            '--arg-parser=' + arg_parser, '--fn-layout=' + fn_layout), cwd=str(PACKAGE_PARENT_DIR))
+
+    test.assert_eq(output.decode('utf-8').splitlines(), [
+        'yo|al|x|a b|--other=1||',
+        '[ERROR] The --name parameter must be given.',
+        'status: 1'])
+
+
+def test_main_report():
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['report', 'a.log', 'b.log'],
+        commands=__main__.DEFAULT_COMMANDS._replace(report_fn=master_mock.report_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.report_fn(trace_files=['a.log', 'b.log']),)
+
+
+@pytest.mark.parametrize('map_args,log_files', (
+    ([], []),
+    (['a.log', 'b.log'], ['a.log', 'b.log'])))
+def test_main_map(map_args, log_files):
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['map', 'out.map'] + map_args,
+        commands=__main__.DEFAULT_COMMANDS._replace(map_fn=master_mock.map_fn))
+
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.map_fn(source_map_file='out.map', log_files=log_files),)
+
+
+@pytest.mark.parametrize('serve_args,expected', (
+    ([], dict(socket_path=None, stats=False, stop=False)),
+    (['--socket=s.sock'], dict(socket_path='s.sock', stats=False, stop=False)),
+    (['--stats'], dict(socket_path=None, stats=True, stop=False)),
+    (['--stop', '--socket', 's.sock'], dict(socket_path='s.sock', stats=False, stop=True))))
+def test_main_serve(serve_args, expected):
+    master_mock = mock.Mock()
+
+    __main__.main(
+        argv=['serve'] + serve_args,
+        commands=__main__.DEFAULT_COMMANDS._replace(serve_fn=master_mock.serve_fn))
+
+    assert tuple(master_mock.mock_calls) == (mock.call.serve_fn(**expected),)
+
+
+def test_instrumented_run_and_report():
+    script = textwrap.dedent("""
+        @fn outer times {
+            for ((i = 0; i < times; i++)); do inner; done
+        }
+        @fn inner {
+            echo inner
+        }
+        outer --times=3
+        ( inner )
+    """)
+
+    with temporary.temp_file(script) as to_run:
+        with temporary.temp_file() as trace_file:
+            with open(str(trace_file), 'w') as trace_out:
+                output = subprocess.check_output(
+                    (sys.executable, '-m', 'bashup', '-r', str(to_run), '--no-cache', '--instrument'),
+                    cwd=str(PACKAGE_PARENT_DIR),
+                    env=dict(os.environ, BASHUP_TRACE_FD=str(trace_out.fileno())),
+                    pass_fds=(trace_out.fileno(),))
+
+            report = subprocess.check_output(
+                (sys.executable, '-m', 'bashup', 'report', str(trace_file)),
+                cwd=str(PACKAGE_PARENT_DIR))
+
+    assert output.decode('utf-8').split() == ['inner'] * 4
+    test.assert_eq(
+        sorted(line.split()[:2] for line in report.decode('utf-8').splitlines()[1:]),
+        [['inner', '4'], ['outer', '1']])
+
+
+def test_instrumented_run_before_bash_5():
+    # Older bash has neither $EPOCHREALTIME nor (before 4) $BASHPID.
+    script = textwrap.dedent("""
+        unset EPOCHREALTIME BASHPID
+        @fn inner {
+            echo inner
+        }
+        inner
+    """)
+
+    with temporary.temp_file(script) as to_run:
+        with temporary.temp_file() as trace_file:
+            with open(str(trace_file), 'w') as trace_out:
+                subprocess.check_output(
+                    (sys.executable, '-m', 'bashup', '-r', str(to_run), '--no-cache', '--instrument'),
+                    cwd=str(PACKAGE_PARENT_DIR),
+                    env=dict(os.environ, BASHUP_TRACE_FD=str(trace_out.fileno())),
+                    pass_fds=(trace_out.fileno(),))
+
+            with open(str(trace_file)) as f:
+                timings = trace.summarize(f)
+
+    test.assert_eq([(t.name, t.calls) for t in timings], [('inner', 1)])
+
+
+def test_watch_file():
+    master_mock = mock.Mock()
+
+    def changes_fn(paths):
+        assert paths == ['in-file']
+        yield set(['in-file'])
+        yield set(['in-file'])
+        raise KeyboardInterrupt
+
+    retval = __main__.watch_file(
+        in_file='in-file',
+        out_file='out-file',
+        compile_fn=master_mock.compile_fn,
+        changes_fn=changes_fn)
+
+    assert retval == 0
+    assert tuple(master_mock.mock_calls) == (
+        mock.call.compile_fn(in_file='in-file', out_file='out-file'),) * 3
+
+
+def test_watch_file_watches_inserted_files():
+    with temporary.temp_dir() as temp_dir:
+        in_file = str(temp_dir / 'in.bashup')
+        with open(in_file, 'w') as f:
+            f.write('@insert lib.sh\n')
+        with open(str(temp_dir / 'lib.sh'), 'w') as f:
+            f.write('echo lib\n')
+
+        watched = []
+
+        def changes_fn(paths):
+            watched.append(paths)
+            yield set([str(temp_dir / 'lib.sh')])
+
+        __main__.watch_file(
+            in_file=in_file,
+            out_file=str(temp_dir / 'out.sh'),
+            changes_fn=changes_fn)
+
+    assert watched == [[in_file, str(temp_dir / 'lib.sh')]]
+
+
+def test_watch_dir():
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            def changes_fn(paths, predicate):
+                assert paths == [str(src_dir)]
+                assert predicate('x.bashup') and not predicate('x.sh')
+                with (src_dir / 'b.bashup').open('w') as f:
+                    f.write(u'@fn b { :; }')
+                yield set([str(src_dir / 'b.bashup')])
+
+            with (src_dir / 'a.bashup').open('w') as f:
+                f.write(u'@fn a { :; }')
+
+            with test.captured_stdout() as stdout:
+                retval = __main__.watch_dir(
+                    src_dir=src_dir,
+                    out_dir=out_dir,
+                    jobs=1,
+                    changes_fn=changes_fn)
+
+            assert (out_dir / 'b.sh').exists()
+
+    assert retval == 0
+    assert [line.split(' in ')[0] for line in stdout.getvalue().splitlines()] == [
+        'Compiled 1, skipped 0 unchanged, 0 failed',
+        'Compiled 1, skipped 0 unchanged, 0 failed']
+
+
+def test_watch_dir_follows_inserted_files():
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            with temporary.temp_dir() as lib_dir:
+                lib = str(lib_dir / 'shared.sh')
+                watched = []
+
+                def changes_fn(paths, predicate):
+                    watched.append((paths, predicate(lib)))
+                    if len(watched) == 1:
+                        # Now a.bashup inserts a file outside the tree.
+                        with (src_dir / 'a.bashup').open('w') as f:
+                            f.write(u'@insert {0}\n'.format(os.path.relpath(lib, str(src_dir))))
+                        yield set([str(src_dir / 'a.bashup')])
+                    else:
+                        with open(lib, 'w') as f:
+                            f.write('echo changed\n')
+                        yield set([lib])
+
+                with open(lib, 'w') as f:
+                    f.write('echo shared\n')
+                with (src_dir / 'a.bashup').open('w') as f:
+                    f.write(u'echo a\n')
+
+                with test.captured_stdout():
+                    __main__.watch_dir(
+                        src_dir=src_dir,
+                        out_dir=out_dir,
+                        jobs=1,
+                        changes_fn=changes_fn)
+
+                with (out_dir / 'a.sh').open() as f:
+                    compiled = f.read()
+
+    assert watched == [([str(src_dir)], False), ([str(src_dir), lib], True)]
+    assert compiled == 'echo changed\n'
+
+
+def test_build_dir():
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            with (src_dir / 'a.bashup').open('w') as f:
+                f.write(u'@fn a { :; }')
+
+            with test.captured_stdout() as stdout:
+                retval = __main__.build_dir(src_dir=src_dir, out_dir=out_dir, jobs=1)
+
+    assert retval == 0
+    __assert_regex_match(
+        r'Compiled 1, skipped 0 unchanged, 0 failed in \d+\.\d\ds',
+        stdout.getvalue())
+
+
 #
 # Test Helpers
 #
@@ -0,0 +1,155 @@
+import json
+import os
+
+import mock
+import pytest
+import temporary
+
+from .. import build
+from ..compile import options
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_build_compiles_then_skips_unchanged(jobs):
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            __write(src_dir / 'a.bashup', '@fn a { :; }')
+            __write(src_dir / 'lib' / 'b.bashup', '@fn b { :; }')
+            __write(src_dir / 'ignored.sh', '@fn c { :; }')
+
+            first = build.build(src_dir, out_dir, jobs=jobs)
+
+            assert first.compiled == ('a.bashup', os.path.join('lib', 'b.bashup'))
+            assert first.skipped == ()
+            assert first.failed == ()
+            assert 'b() { :; }' in __read(out_dir / 'lib' / 'b.sh')
+            assert not (out_dir / 'ignored.sh').exists()
+
+            second = build.build(src_dir, out_dir, jobs=jobs)
+
+            assert second.compiled == ()
+            assert second.skipped == first.compiled
+
+            __write(src_dir / 'a.bashup', '@fn a2 { :; }')
+            (out_dir / 'lib' / 'b.sh').unlink()
+
+            third = build.build(src_dir, out_dir, jobs=jobs)
+
+            assert third.compiled == first.compiled
+            assert 'a2() { :; }' in __read(out_dir / 'a.sh')
+
+
+def test_build_only_given_sources():
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            __write(src_dir / 'a.bashup', '@fn a { :; }')
+            __write(src_dir / 'b.bashup', '@fn b { :; }')
+            build.build(src_dir, out_dir)
+
+            __write(src_dir / 'a.bashup', '@fn a2 { :; }')
+            __write(src_dir / 'b.bashup', '@fn b2 { :; }')
+
+            result = build.build(src_dir, out_dir, only=['b.bashup', 'c.bashup'])
+
+            with (out_dir / build.MANIFEST_NAME).open() as f:
+                manifest = json.load(f)
+
+            assert result.compiled == ('b.bashup',)
+            assert 'a() { :; }' in __read(out_dir / 'a.sh')
+            assert 'b2() { :; }' in __read(out_dir / 'b.sh')
+
+    assert sorted(manifest['files']) == ['a.bashup', 'b.bashup']
+
+
+def test_build_recompiles_when_options_change():
+    case = options.DEFAULT_OPTIONS._replace(arg_parser='case')
+
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            __write(src_dir / 'a.bashup', '@fn a b { :; }')
+
+            first = build.build(src_dir, out_dir, options=case)
+            second = build.build(src_dir, out_dir, options=case)
+            assert 'case ${__arg} in' in __read(out_dir / 'a.sh')
+
+            third = build.build(src_dir, out_dir)
+            assert 'case ${__arg} in' not in __read(out_dir / 'a.sh')
+
+    assert first.compiled == second.skipped == third.compiled == ('a.bashup',)
+
+
+@pytest.mark.parametrize('jobs', (1, 2))
+def test_build_recompiles_when_inserted_files_change(jobs):
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            __write(src_dir / 'a.bashup', '@insert lib/shared.sh\na\n')
+            __write(src_dir / 'b.bashup', '@insert lib/shared.sh\nb\n')
+            __write(src_dir / 'lib' / 'shared.sh', '@fn a { :; }\n')
+
+            first = build.build(src_dir, out_dir, jobs=jobs)
+            second = build.build(src_dir, out_dir, jobs=jobs)
+            __write(src_dir / 'lib' / 'shared.sh', '@fn b { :; }\n')
+            third = build.build(src_dir, out_dir, jobs=jobs)
+
+            assert __read(out_dir / 'b.sh').endswith('b() { :; }\nb\n')
+
+    assert first.compiled == second.skipped == third.compiled == ('a.bashup', 'b.bashup')
+
+
+def test_build_only_changed_inserts_rebuilds_their_sources():
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            __write(src_dir / 'a.bashup', '@insert lib/shared.sh\na\n')
+            __write(src_dir / 'b.bashup', '@fn b { :; }\n')
+            __write(src_dir / 'lib' / 'shared.sh', '@fn a { :; }\n')
+            build.build(src_dir, out_dir)
+
+            inserted = build.inserted_files(src_dir, out_dir)
+            __write(src_dir / 'lib' / 'shared.sh', '@fn a2 { :; }\n')
+            result = build.build(src_dir, out_dir, only=[os.path.join('lib', 'shared.sh')])
+
+            assert 'a2() { :; }' in __read(out_dir / 'a.sh')
+
+    assert inserted == [str(src_dir / 'lib' / 'shared.sh')]
+    assert result.compiled == ('a.bashup',)
+
+
+def test_build_reports_failures_and_retries_them():
+    def fail(_):
+        raise ValueError('nope')
+
+    with temporary.temp_dir() as src_dir:
+        with temporary.temp_dir() as out_dir:
+            __write(src_dir / 'a.bashup', ':')
+
+            with mock.patch.object(build, '__compile_fn', return_value=fail):
+                first = build.build(src_dir, out_dir)
+            second = build.build(src_dir, out_dir)
+
+            with (out_dir / build.MANIFEST_NAME).open() as f:
+                manifest = json.load(f)
+
+    assert first.failed == (('a.bashup', 'ValueError: nope'),)
+    assert second.compiled == ('a.bashup',)
+    assert list(manifest['files']) == ['a.bashup']
+
+
+def test_build_result_summary():
+    result = build.BuildResult(compiled=('a',), skipped=('b', 'c'), failed=(), elapsed=1.234)
+    assert result.summary() == 'Compiled 1, skipped 2 unchanged, 0 failed in 1.23s'
+
+
+#
+# Test Helpers
+#
+
+def __write(path, content):
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True)
+    with open(str(path), 'w') as f:
+        f.write(content)
+
+
+def __read(path):
+    with open(str(path)) as f:
+        return f.read()
@@ -0,0 +1,99 @@
+import os
+
+import mock
+import temporary
+
+from .. import cache
+
+
+def test_compiled_path_compiles_once():
+    compiled = []
+
+    def compile_fn(source_str):
+        compiled.append(source_str)
+        return source_str.upper()
+
+    with temporary.temp_dir() as cache_dir:
+        paths = [
+            cache.compiled_path(s, compile_fn, directory=str(cache_dir))
+            for s in ('one', 'two', 'one')]
+
+        assert paths[0] == paths[2] != paths[1]
+        with open(paths[0]) as f:
+            assert f.read() == 'ONE'
+
+    assert compiled == ['one', 'two']
+
+
+def test_compiled_path_creates_missing_directory():
+    with temporary.temp_dir() as cache_dir:
+        path = cache.compiled_path(
+            'one', lambda s: s, directory=str(cache_dir / 'a' / 'b'))
+        assert os.path.isfile(path)
+
+
+def test_compiled_path_evicts_least_recently_used():
+    with temporary.temp_dir() as cache_dir:
+        def compiled_path(source_str):
+            return cache.compiled_path(
+                source_str,
+                lambda s: s * 10,
+                directory=str(cache_dir),
+                max_bytes=25)
+
+        one = compiled_path('1')
+        two = compiled_path('2')
+        os.utime(one, (0, 0))
+        os.utime(two, (1, 1))
+        compiled_path('1')  # a hit makes '1' the most recently used
+        three = compiled_path('3')
+
+        assert sorted(os.listdir(str(cache_dir))) == sorted(
+            os.path.basename(p) for p in (one, three))
+
+
+def test_compiled_path_unusable_directory():
+    with temporary.temp_file() as not_a_dir:
+        assert cache.compiled_path(
+            'one', lambda s: s, directory=str(not_a_dir / 'cache')) is None
+
+
+def test_key_depends_on_source():
+    assert cache.key_for('one') == cache.key_for('one') != cache.key_for('two')
+
+
+def test_key_depends_on_variant():
+    assert cache.key_for('one', variant='') == cache.key_for('one')
+    assert cache.key_for('one', variant='a') != cache.key_for('one')
+    assert cache.key_for('one', variant='a') != cache.key_for('one', variant='b')
+
+
+def test_key_depends_on_compiler_sources():
+    key = cache.key_for('one')
+
+    with mock.patch.object(cache, '__FINGERPRINT', ['another compiler']):
+        assert cache.key_for('one') != key
+
+    assert cache.key_for('one') == key
+
+
+def test_compiler_fingerprint_follows_modification():
+    with temporary.temp_file('one') as path:
+        before = cache.__stat_digest([str(path)])
+        again = cache.__stat_digest([str(path)])
+        os.utime(str(path), (0, 0))
+        touched = cache.__stat_digest([str(path)])
+
+    assert before == again != touched
+
+
+def test_default_dir_honors_xdg_cache_home():
+    old = os.environ.get('XDG_CACHE_HOME')
+    os.environ['XDG_CACHE_HOME'] = '/xdg'
+    try:
+        assert cache.default_dir() == os.path.join('/xdg', 'bashup')
+    finally:
+        if old is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = old
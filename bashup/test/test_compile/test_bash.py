@@ -1,12 +1,143 @@
+import textwrap
+
 from ...compile import bash
+from ...compile import options
+from ... import lex
+from ... import test
 
 
 def test_compile_to_bash():
     fake_compilers = (
-        lambda x: 'A(' + x + ')',
-        lambda x: 'B(' + x + ')',
-        lambda x: 'C(' + x + ')',)
+        lambda x, tokens: 'A(' + x + ')',
+        lambda x, tokens: 'B(' + x + ')',
+        lambda x, tokens: 'C(' + x + ')',)
 
     actual = bash.compile_to_bash('bashup_str', compilers=fake_compilers)
 
     assert actual == 'C(B(A(bashup_str)))'
+
+
+def test_compile_to_bash_shares_tokens():
+    received = []
+
+    def unchanged(x, tokens):
+        received.append(tokens)
+        return x
+
+    def changed(x, tokens):
+        received.append(tokens)
+        return x + '!'
+
+    actual = bash.compile_to_bash(
+        'bashup_str',
+        compilers=(unchanged, unchanged, changed, unchanged))
+
+    assert actual == 'bashup_str!'
+    assert received == [lex.tokenize('bashup_str')] * 3 + [None]
+
+
+def test_compilers_for():
+    case = options.DEFAULT_OPTIONS._replace(arg_parser='case')
+
+    assert bash.compilers_for(options.DEFAULT_OPTIONS) is bash.ALL_COMPILERS
+    assert 'case ${__arg} in' in bash.compile_to_bash(
+        '@fn a b { :; }',
+        compilers=bash.compilers_for(case))
+
+
+def test_compilers_for_optimizations():
+    bashup_str = textwrap.dedent("""
+        @fn unused {
+            :
+        }
+
+        @fn used {
+
+            echo used
+        }
+
+        used
+    """)
+
+    actual = bash.compile_to_bash(
+        bashup_str,
+        compilers=bash.compilers_for(options.DEFAULT_OPTIONS._replace(drop_unused_fns=True, minify=True)))
+
+    test.assert_eq(actual, textwrap.dedent("""\
+        used() {
+            echo used
+        }
+        used
+    """))
+
+
+def test_compile_stream_matches_compile_to_bash():
+    bashup_str = textwrap.dedent("""
+        @fn first a {
+            echo "${a}"
+        }
+        cat <<EOF
+        @fn in_heredoc {
+        EOF
+        echo '
+        @fn in_string {
+        '
+        @fn second a,
+        b='
+        {' {
+        \techo "${b}"
+        }
+        @fn third
+        {
+        :
+        }
+    """).lstrip()
+
+    chunks = list(bash.compile_stream(
+        bashup_str.splitlines(True),
+        chunk_size=1))
+
+    test.assert_eq(''.join(chunks), bash.compile_to_bash(bashup_str))
+    assert len(chunks) > 1
+
+
+def test_compile_stream_empty():
+    actual = list(bash.compile_stream([], compile_fn=lambda x: 'Compiled(' + x + ')'))
+
+    assert actual == ['Compiled()']
+
+
+def test_compile_stream_carries_macro_definitions():
+    bashup_str = textwrap.dedent("""
+        @greet(who) = hello @who
+        @fn hello who {
+            echo "hi ${who}"
+        }
+        @greet(--who=you)
+        @greet(--who=me)
+    """).lstrip()
+
+    chunks = list(bash.compile_stream(
+        bashup_str.splitlines(True),
+        chunk_size=1))
+
+    test.assert_eq(''.join(chunks), bash.compile_to_bash(bashup_str))
+    assert 'hello --who=me' in chunks[-1]
+
+
+def test_compile_many():
+    sources = [
+        ('fn', '@fn hi {\n\n    echo hi\n}\n'),
+        ('bad', '@a = @a\n@a\n'),
+        ('plain', 'echo plain\n')]
+    minify = options.DEFAULT_OPTIONS._replace(minify=True)
+
+    for workers in (None, 2):
+        results = list(bash.compile_many(iter(sources), options=minify, workers=workers))
+
+        assert [r.name for r in results] == ['fn', 'bad', 'plain']
+        assert results[0].output == bash.compile_to_bash(sources[0][1], compilers=bash.compilers_for(minify))
+        assert results[0].error is None
+        assert results[1].output is None
+        assert 'recursive' in str(results[1].error)
+        assert results[2] == bash.CompileResult(name='plain', output='echo plain\n', error=None)
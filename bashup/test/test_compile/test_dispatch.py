@@ -0,0 +1,80 @@
+import textwrap
+
+import pytest
+
+from ...compile import bash
+from ...compile import dispatch
+from ...compile import options
+from ... import test
+
+
+def test_dispatch_routes_each_sigil_to_its_handler():
+    calls = []
+
+    def upper(bashup_str, offset, context):
+        calls.append(('upper', offset, context.last))
+        end = bashup_str.find('\n', offset)
+        return dispatch.Replacement(start=offset, end=end, replacement=bashup_str[offset + 7:end].upper())
+
+    def skip(_bashup_str, offset, context):
+        calls.append(('upperfirst', offset, context.last))
+
+    bashup_str = textwrap.dedent("""
+        @upper hello
+        echo '@upper quoted'  # @upper comment
+        @upperfirst left alone
+        @upper world
+    """).lstrip()
+
+    actual = dispatch.dispatch(
+        bashup_str,
+        constructs=(
+            dispatch.Construct(name='upper', sigil='@upper', handler=upper),
+            dispatch.Construct(name='upperfirst', sigil='@upperfirst', handler=skip)))
+
+    test.assert_eq(actual.output, textwrap.dedent("""
+        HELLO
+        echo '@upper quoted'  # @upper comment
+        @upperfirst left alone
+        WORLD
+    """).lstrip())
+    second = bashup_str.index('@upper world')
+    assert calls == [('upper', 0, 0), ('upperfirst', bashup_str.index('@upperfirst'), 12), ('upper', second, 12)]
+    assert [r.start for r in actual.replacements] == [0, second]
+
+
+def test_sigil_needs_no_word_break_after_it():
+    # As before the dispatcher: the name may follow @fn without a space.
+    test.assert_eq(bash.compile_to_bash('@fnord { :; }\n'), '#\n# usage: ord [ARGS]\n#\nord() { :; }\n')
+
+
+def test_dispatch_rejects_out_of_order_replacements():
+    def backwards(_bashup_str, offset, _context):
+        return dispatch.Replacement(start=0, end=offset + 2, replacement='')
+
+    with pytest.raises(ValueError):
+        dispatch.dispatch(
+            '@b @b',
+            constructs=(dispatch.Construct(name='b', sigil='@b', handler=backwards),))
+
+
+def test_registered_constructs_are_compiled():
+    def shout(_bashup_str, offset, _context):
+        return dispatch.Replacement(start=offset, end=offset + 6, replacement='echo HEY')
+
+    dispatch.register('shout', '@shout', shout)
+    try:
+        assert [c.name for c in dispatch.registered()] == ['fn', 'shout']
+
+        actual = bash.compile_to_bash(
+            '@fn hi { @shout; }\n',
+            compilers=bash.compilers_for(options.DEFAULT_OPTIONS._replace(minify=True)))
+
+        test.assert_eq(actual, 'hi() { echo HEY; }\n')
+
+        with pytest.raises(ValueError):
+            dispatch.register('other', '@shout', shout)
+    finally:
+        dispatch.unregister('shout')
+
+    assert [c.name for c in dispatch.registered()] == ['fn']
@@ -1,7 +1,11 @@
 import textwrap
 
+import pytest
+
 from ...compile import elements
+from ...compile import options
 from ... import parse
+from ... import profile
 from ... import test
 
 
@@ -396,3 +400,313 @@ def test_compile_fns_to_bash_nested_fns():
     """).strip())
 
     test.assert_eq(actual, expected)
+
+
+def test_compile_fns_to_bash_ignores_non_code():
+    bashup_str = textwrap.dedent("""
+        # @fn in_comment {
+        echo '@fn in_single_quotes {'
+        echo "@fn in_double_quotes {"
+        cat <<EOF
+        @fn in_heredoc {
+        EOF
+    """).strip()
+
+    actual = elements.compile_fns_to_bash(bashup_str=bashup_str)
+
+    assert actual is bashup_str
+
+
+__INCREMENTAL_SOURCE = textwrap.dedent("""
+    @fn first a, b='x' {
+        echo "${a}${b}"
+    }
+
+    @fn second {
+        @fn nested c {
+            echo "${c}"
+        }
+    }
+
+    @fn third { @fn fourth {
+    \t:
+    } }
+""").lstrip()
+
+
+def test_compile_fns_incremental_matches_full_compile():
+    edits = (
+        ('@fn first a', '@fn first_renamed a'),
+        ("b='x'", "b='y', d"),
+        ('@fn second {', '@fn second e {'),
+        ('        echo "${c}"', '      echo "${c}"'),
+        ('    echo "${a}${b}"', '\techo "${a}${b}"'),
+        ('@fn third { ', ''),
+        ('@fn fourth {', "echo ' @fn fourth {"),
+        ('\n\n@fn second', '\n\n: "\n@fn second'),
+        ('@fn nested', '# @fn nested'),
+    )
+
+    previous = elements.compile_fns(__INCREMENTAL_SOURCE)
+
+    for old, new in edits:
+        assert old in previous.source
+        edited = previous.source.replace(old, new, 1)
+        incremental = elements.compile_fns(edited, previous=previous)
+        full = elements.compile_fns(edited)
+        test.assert_eq(incremental.output, full.output)
+        test.assert_eq(incremental.regions, full.regions)
+        previous = incremental
+
+
+def test_compile_fns_incremental_reuses_unchanged_regions():
+    previous = elements.compile_fns(__INCREMENTAL_SOURCE)
+    edited = __INCREMENTAL_SOURCE.replace('echo "${c}"', 'echo "${c}!"')
+    current = elements.compile_fns(edited, previous=previous)
+
+    reused = [
+        name for name, (old, new) in zip(
+            ('first', 'second', 'nested', 'third', 'fourth'),
+            zip(previous.regions, current.regions))
+        if old.fn_spec is new.fn_spec]
+
+    # The fourth fn follows another on the same line, so its indentation
+    # depends on where that one ends and it's only reused if nothing changed.
+    test.assert_eq(reused, ['first', 'second', 'nested', 'third'])
+
+
+def test_compile_fns_to_bash_after_code_on_same_line():
+    actual = elements.compile_fns_to_bash(bashup_str='set -e; @fn hello { :; }')
+
+    test.assert_eq(actual, 'set -e; #\n# usage: hello [ARGS]\n#\nhello() { :; }')
+
+
+def test_compile_fns_to_bash_one_line_fn_with_long_whitespace():
+    # This used to backtrack catastrophically while guessing the indentation.
+    bashup_str = '@fn hello {' + ' ' * 100 + ':; }'
+
+    actual = elements.compile_fns_to_bash(bashup_str=bashup_str)
+
+    assert actual.endswith('hello() {' + ' ' * 100 + ':; }')
+
+
+def test_compile_fn_spec_to_bash_with_case_arg_parser():
+    expected = textwrap.dedent("""
+        #
+        # usage: enable_ramdisk --size=<SIZE> [--path=<PATH>] [ARGS]
+        #
+        enable_ramdisk() {
+            local size
+            local size__set=0
+            local path='/ramdisk'
+            local args=()
+            local __arg
+
+            for __arg in "$@"; do
+                case ${__arg} in
+                    --size=*)
+                        size=${__arg#--size=}
+                        size__set=1
+                        ;;
+                    --path=*)
+                        path=${__arg#--path=}
+                        ;;
+                    *)
+                        args+=("${__arg}")
+                        ;;
+                esac
+            done
+
+            if ! (( size__set )); then
+                echo "[ERROR] The --size parameter must be given."
+                return 1
+            fi
+
+            __enable_ramdisk "${size}" "${path}" "${args[@]}"
+        }
+
+        __enable_ramdisk() {
+            local size=${1}
+            local path=${2}
+            shift 2
+    """).lstrip()
+
+    actual = elements.compile_fn_spec_to_bash(
+        fn_spec=parse.FnSpec(
+            name='enable_ramdisk',
+            args=(parse.FnArgSpec(name='size', value=None),
+                  parse.FnArgSpec(name='path', value="'/ramdisk'"))),
+        options=options.DEFAULT_OPTIONS._replace(arg_parser='case'))
+
+    test.assert_eq(actual, expected)
+
+
+def test_compile_fns_incremental_recompiles_when_options_change():
+    case = options.DEFAULT_OPTIONS._replace(arg_parser='case')
+    previous = elements.compile_fns(__INCREMENTAL_SOURCE)
+
+    current = elements.compile_fns(__INCREMENTAL_SOURCE, previous=previous, options=case)
+
+    test.assert_eq(current.output, elements.compile_fns(__INCREMENTAL_SOURCE, options=case).output)
+    assert current.output != previous.output
+
+
+def test_compile_fns_to_bash_with_inline_fn_layout():
+    expected = textwrap.dedent("""
+        #
+        # usage: hi --target=<TARGET> [ARGS]
+        #
+        hi() {
+            local target
+            local target__set=0
+            local args=()
+
+            while (( $# )); do
+                if [[ "${1}" == --target=* ]]; then
+                    target=${1#--target=}
+                    target__set=1
+                else
+                    args+=("${1}")
+                fi
+                shift
+            done
+
+            if ! (( target__set )); then
+                echo "[ERROR] The --target parameter must be given."
+                return 1
+            fi
+
+            set -- "${args[@]}"
+
+            echo "hi, ${target}" "$@"
+        }
+        #
+        # usage: bye [ARGS]
+        #
+        bye() {
+            echo bye
+        }
+    """).lstrip()
+
+    actual = elements.compile_fns_to_bash(
+        textwrap.dedent("""
+            @fn hi target {
+                echo "hi, ${target}" "$@"
+            }
+            @fn bye {
+                echo bye
+            }
+        """).lstrip(),
+        options=options.DEFAULT_OPTIONS._replace(fn_layout='inline'))
+
+    test.assert_eq(actual, expected)
+
+
+def test_compile_fns_to_bash_with_instrument():
+    expected = textwrap.dedent("""
+        #
+        # usage: bye [ARGS]
+        #
+        bye() {
+            if [[ -n ${BASHUP_TRACE_FD-} ]]; then
+                printf 'call bye %s %s\\n' \\
+                    "${EPOCHREALTIME:-$(date +%s)}" "${BASHPID:-$$}" >&"${BASHUP_TRACE_FD}"
+            fi
+            __bye "$@"
+            local __status=$?
+            if [[ -n ${BASHUP_TRACE_FD-} ]]; then
+                printf 'return bye %s %s\\n' \\
+                    "${EPOCHREALTIME:-$(date +%s)}" "${BASHPID:-$$}" >&"${BASHUP_TRACE_FD}"
+            fi
+            return ${__status}
+        }
+
+        __bye() {
+            echo bye
+        }
+    """).lstrip()
+
+    actual = elements.compile_fns_to_bash(
+        textwrap.dedent("""
+            @fn bye {
+                echo bye
+            }
+        """).lstrip(),
+        options=options.DEFAULT_OPTIONS._replace(instrument=True, fn_layout='inline'))
+
+    test.assert_eq(actual, expected)
+
+
+def test_expand_macros():
+    bashup_str = textwrap.dedent("""
+        @mytmp = @with(mktemp tmp.XXXXXXXXXX)
+        @mytmp2(extra, suffix) = @with(mktemp @extra tmp.XXXXXXXXXX@suffix)
+        @mytmp as tmp {
+            @mytmp2(-d, .dir) as tmp_dir {
+                echo '@mytmp' # @mytmp
+            }
+        }
+    """).lstrip()
+
+    actual = elements.expand_macros(bashup_str)
+
+    test.assert_eq(actual, textwrap.dedent("""
+        @with(mktemp tmp.XXXXXXXXXX) as tmp {
+            @with(mktemp -d tmp.XXXXXXXXXX.dir) as tmp_dir {
+                echo '@mytmp' # @mytmp
+            }
+        }
+    """).lstrip())
+
+
+def test_expand_macros_nested():
+    bashup_str = textwrap.dedent("""
+        @q(x) = "@x"
+        @say(x) = echo @q(@x) >&2
+        @hi = @say(hi)
+        @hi; @say((a, b))
+        email@hi @undefined
+    """).lstrip()
+
+    actual = elements.expand_macros(bashup_str)
+
+    test.assert_eq(actual, textwrap.dedent("""
+        echo "hi" >&2; echo "(a, b)" >&2
+        email@hi @undefined
+    """).lstrip())
+
+
+def test_expand_macros_reuses_expansions():
+    bashup_str = '@q(x) = "@x"\n' + '@q(a) @q(b)\n' * 10
+
+    with profile.profiling() as collected:
+        actual = elements.expand_macros(bashup_str)
+
+    assert actual == '"a" "b"\n' * 10
+    assert dict(collected.counts) == {'macros_expanded': 1, 'macros_reused': 19}
+
+
+def test_expand_macros_redefined():
+    actual = elements.expand_macros('@a = 1\n@b = @a\n@b\n@a = 2\n@b\n')
+
+    assert actual == '1\n2\n'
+
+
+def test_expand_macros_without_definitions():
+    bashup_str = '@fn hi { echo @hi; }\n'
+
+    assert elements.expand_macros(bashup_str) is bashup_str
+
+
+@pytest.mark.parametrize('bashup_str, message', (
+    ('@a = @b\n@b = @a\n@a', 'recursive definition: @a -> @b -> @a'),
+    ('@m(x) = @x\n@m', 'line 2: @m needs arguments'),
+    ('@m(x) = @x\n\n@m(1, 2)', 'line 3: @m takes 1 argument(s), not 2'),
+    ('@fn = echo', 'line 1: @fn is built in and cannot be defined'),
+    ('@m(x y) = @x', 'line 1: bad parameters for @m: (x y)'),
+))
+def test_expand_macros_errors(bashup_str, message):
+    with pytest.raises(elements.MacroError) as e:
+        elements.expand_macros(bashup_str)
+
+    assert str(e.value) == message
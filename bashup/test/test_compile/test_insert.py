@@ -0,0 +1,197 @@
+import os
+import textwrap
+
+import pytest
+import temporary
+
+from ...compile import bash
+from ...compile import insert
+from ... import test
+
+
+def test_expand_inserts():
+    with __tree({
+        'main.bashup': """
+            @insert lib/one.bashup
+            @fn main {
+                @insert 'lib/two.bashup'
+            }
+            # @insert not_a_statement
+            echo "@insert not_a_statement"
+            echo @insert not_a_statement
+            @insert "lib/two.bashup" --comment  # trailing comment
+        """,
+        'lib/one.bashup': """
+            one=1
+            @insert two.bashup
+        """,
+        'lib/two.bashup': """
+            two=2
+
+            echo "${two}"
+        """,
+    }) as root:
+        actual = insert.expand_inserts(__read(root / 'main.bashup'), str(root / 'main.bashup'))
+
+    test.assert_eq(actual.text, textwrap.dedent("""
+        one=1
+        two=2
+
+        echo "${two}"
+        @fn main {
+            two=2
+
+            echo "${two}"
+        }
+        # @insert not_a_statement
+        echo "@insert not_a_statement"
+        echo @insert not_a_statement
+        # two=2
+        #
+        # echo "${two}"
+    """).lstrip())
+
+    assert actual.dependencies == (
+        str(root / 'lib' / 'one.bashup'),
+        str(root / 'lib' / 'two.bashup'))
+
+
+def test_expand_document():
+    with __tree({
+        'main.bashup': """
+            first
+            @insert lib.bashup
+            last
+        """,
+        'lib.bashup': """
+            one
+            two
+        """,
+    }) as root:
+        bashup_str = __read(root / 'main.bashup')
+        document, dependencies = insert.expand_document(bashup_str, str(root / 'main.bashup'))
+        expected = insert.expand_inserts(bashup_str, str(root / 'main.bashup'))
+
+    text = document.text()
+    assert (text, dependencies) == tuple(expected)
+    assert document.source_offset(text.index('two')) == bashup_str.index('@insert')
+    assert document.source_offset(text.index('last')) == bashup_str.index('last')
+
+
+def test_compile_inserts_shares_compiled_inserts():
+    compiled = []
+
+    def compile_fn(bashup_str):
+        compiled.append(bashup_str)
+        return bash.compile_to_bash(bashup_str)
+
+    with __tree({
+        'main.bashup': """
+            #!/bin/bash
+            @insert shared.bashup
+            @fn main {
+                @insert shared.bashup
+                shared
+            }
+            @insert shared.bashup
+            main
+        """,
+        'shared.bashup': """
+            @fn shared {
+                echo shared
+            }
+        """,
+    }) as root:
+        main_str = __read(root / 'main.bashup')
+        path = str(root / 'main.bashup')
+        insert_cache = insert.InsertCache()
+
+        actual = insert.compile_inserts(main_str, path, compile_fn, insert_cache)
+        expanded = insert.expand_inserts(main_str, path)
+        again = insert.compile_inserts(main_str, path, compile_fn, insert_cache)
+        whole = insert.compile_inserts(main_str, path, bash.compile_to_bash, whole_document=True)
+
+    test.assert_eq(actual.text, bash.compile_to_bash(expanded.text))
+    assert actual == again == whole
+    assert actual.dependencies == expanded.dependencies == (str(root / 'shared.bashup'),)
+
+    # The indented @insert is compiled along with the text around it.
+    test.assert_eq(compiled, [
+        '#!/bin/bash\n',
+        '@fn shared {\n    echo shared\n}\n',
+        '@fn main {\n    @fn shared {\n        echo shared\n    }\n    shared\n}\n',
+        'main\n',
+        '#!/bin/bash\n',
+        '@fn main {\n    @fn shared {\n        echo shared\n    }\n    shared\n}\n',
+        'main\n',
+    ])
+
+
+def test_compile_inserts_carries_macro_definitions():
+    with __tree({
+        'main.bashup': """
+            @out(x) = echo @x
+            @insert defs.bashup
+            @out(@greeting)
+        """,
+        'defs.bashup': """
+            @greeting = hello
+            @out(defined)
+        """,
+    }) as root:
+        main_str = __read(root / 'main.bashup')
+        path = str(root / 'main.bashup')
+
+        actual = insert.compile_inserts(main_str, path, bash.compile_to_bash)
+
+    test.assert_eq(actual.text, 'echo defined\necho hello\n')
+
+
+@pytest.mark.parametrize('files,message', (
+    ({'main.bashup': '@insert a.bashup', 'a.bashup': '@insert main.bashup'},
+     '@insert cycle: {root}/main.bashup -> {root}/a.bashup -> {root}/main.bashup'),
+    ({'main.bashup': '@insert missing.bashup'},
+     '{root}/main.bashup: cannot insert {root}/missing.bashup: No such file or directory'),
+    ({'main.bashup': '@insert https://example.com/snippet.sh'},
+     '{root}/main.bashup: only local files can be inserted: https://example.com/snippet.sh'),
+    ({'main.bashup': '@insert a.bashup; echo'},
+     '{root}/main.bashup: malformed @insert: @insert a.bashup; echo'),
+))
+def test_insert_errors(files, message):
+    with __tree(files) as root:
+        root = os.path.realpath(str(root))
+        main_path = os.path.join(root, 'main.bashup')
+        with pytest.raises(insert.InsertError) as e:
+            insert.expand_inserts(__read(main_path), main_path)
+
+    assert str(e.value) == message.format(root=root)
+
+
+#
+# Test Helpers
+#
+
+def __tree(files):
+    class Tree(object):
+        def __init__(self):
+            self.ctx = temporary.temp_dir()
+
+        def __enter__(self):
+            root = self.ctx.__enter__()
+            for name, content in files.items():
+                path = root / name
+                if not path.parent.exists():
+                    path.parent.mkdir(parents=True)
+                with open(str(path), 'w') as f:
+                    f.write(textwrap.dedent(content).lstrip('\n'))
+            return root
+
+        def __exit__(self, *exc_info):
+            return self.ctx.__exit__(*exc_info)
+
+    return Tree()
+
+
+def __read(path):
+    with open(str(path)) as f:
+        return f.read()
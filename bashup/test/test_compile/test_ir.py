@@ -0,0 +1,91 @@
+import functools
+import textwrap
+
+import pytest
+
+from ...compile import bash
+from ...compile import ir
+from ...compile import optimize
+from ...compile import options
+from ... import lex
+from ... import test
+
+
+def test_document_edits_spans():
+    d = ir.Document('one two three')
+    d.edit([
+        ir.Replacement(start=0, end=3, replacement='1'),
+        ir.Replacement(start=8, end=13, replacement='')])
+
+    assert d.is_edited()
+    assert d.has_insertions()
+    assert d.text() == '1 two '
+    assert d.spans == (
+        ir.Span(start=0, end=3, text='1'),
+        ir.Span(start=3, end=8, text=None),
+        ir.Span(start=8, end=13, text=''))
+
+    # An edit touching text already replaced is skipped; the rest apply.
+    d.edit([
+        ir.Replacement(start=2, end=4, replacement='X'),
+        ir.Replacement(start=4, end=7, replacement='2')])
+
+    assert d.text() == '1 2 '
+    assert d.source_offset(2) == 4
+    assert d.source_offset(3) == 7
+
+
+def test_document_without_edits():
+    d = ir.Document('as-is')
+    d.edit([])
+
+    assert not d.is_edited()
+    assert d.text() is d.source
+
+
+def test_document_rejects_overlapping_edits():
+    d = ir.Document('abcdef')
+    with pytest.raises(ValueError):
+        d.edit([
+            ir.Replacement(start=0, end=3, replacement=''),
+            ir.Replacement(start=2, end=4, replacement='')])
+
+
+def test_untouched_tokens():
+    d = ir.Document("echo 'a' b")
+    tokens = lex.tokenize(d.source)
+    assert d.untouched(tokens) is tokens
+
+    d.edit([ir.Replacement(start=6, end=9, replacement='')])
+
+    assert d.untouched(tokens) == [
+        lex.Token(kind=lex.CODE, start=0, end=5),
+        lex.Token(kind=lex.SINGLE_QUOTED, start=5, end=6),
+        lex.Token(kind=lex.CODE, start=9, end=10)]
+
+
+def test_stage_for_partial():
+    stage = ir.stage_for(functools.partial(optimize.drop_unused_fns, keep=('a',)))
+
+    assert stage.edits('@fn a { :; }\n') == []
+    assert ir.stage_for(len) is None
+
+
+def test_compile_document_traces_offsets_to_source():
+    bashup_str = textwrap.dedent("""
+        @fn unused { :; }
+
+        @fn hi { echo hi; }
+
+
+        hi
+    """).lstrip()
+
+    document = bash.compile_document(
+        bashup_str,
+        compilers=bash.compilers_for(options.DEFAULT_OPTIONS._replace(drop_unused_fns=True, minify=True)))
+    output = document.text()
+
+    test.assert_eq(output, 'hi() { echo hi; }\nhi\n')
+    assert document.source_offset(output.index('hi\n', 1)) == bashup_str.rindex('hi\n')
+    assert document.source_offset(0) == bashup_str.index('@fn hi')
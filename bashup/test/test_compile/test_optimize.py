@@ -0,0 +1,144 @@
+import textwrap
+
+from ...compile import optimize
+from ... import test
+
+
+def test_drop_unused_fns():
+    actual = optimize.drop_unused_fns(textwrap.dedent("""
+        #!/bin/bash
+
+        @fn main target {
+            @fn nested {
+                helper
+            }
+            nested
+        }
+
+        @fn helper {
+            echo "helper"
+        }
+
+        @fn recursive n {
+            recursive --n=$(( n - 1 ))
+        }
+
+        @fn only_in_comments {
+            :
+        }
+
+        @fn on_exit {
+            :
+        }
+
+        @fn default_value {
+            :
+        }
+
+        @fn uses_default_value value="$(default_value)" {
+            :
+        }
+
+        # only_in_comments
+        trap 'on_exit' EXIT
+        main --target=x
+    """))
+
+    test.assert_eq(actual, textwrap.dedent("""
+        #!/bin/bash
+
+        @fn main target {
+            @fn nested {
+                helper
+            }
+            nested
+        }
+
+        @fn helper {
+            echo "helper"
+        }
+
+        @fn on_exit {
+            :
+        }
+
+        # only_in_comments
+        trap 'on_exit' EXIT
+        main --target=x
+    """))
+
+
+def test_drop_unused_fns_keeps_named_fns():
+    actual = optimize.drop_unused_fns(textwrap.dedent("""
+        @fn plugin_a {
+            :
+        }
+        @fn plugin_b {
+            :
+        }
+        "plugin_${1}"
+    """), keep=('plugin_b', 'not_an_fn'))
+
+    test.assert_eq(actual, textwrap.dedent("""
+        @fn plugin_b {
+            :
+        }
+        "plugin_${1}"
+    """))
+
+
+def test_drop_unused_fns_shares_line():
+    actual = optimize.drop_unused_fns('set -e; @fn a { :; }; @fn b { :; }; b\n')
+
+    test.assert_eq(actual, 'set -e; ; @fn b { :; }; b\n')
+
+
+def test_drop_unused_fns_skips_escaped_braces():
+    actual = optimize.drop_unused_fns(textwrap.dedent("""
+        @fn unused { echo \\}; }
+        @fn used y=${x:-\\}} { echo "${y}"; }
+        used
+    """).lstrip())
+
+    test.assert_eq(actual, textwrap.dedent("""
+        @fn used y=${x:-\\}} { echo "${y}"; }
+        used
+    """).lstrip())
+
+
+def test_drop_unused_fns_unchanged():
+    for bashup_str in (
+            '@fn a { :; }\na\n',
+            '@fn a { :; \n',
+            'echo "no fns"\n'):
+        assert optimize.drop_unused_fns(bashup_str) is bashup_str
+
+
+def test_strip_blank_lines():
+    actual = optimize.strip_blank_lines(textwrap.dedent("""
+
+        echo "a
+
+        b"  # comment
+
+        cat <<EOF
+
+        EOF
+
+        echo one \\
+
+        echo two
+            \t
+    """))
+
+    test.assert_eq(actual, textwrap.dedent("""\
+        echo "a
+
+        b"  # comment
+        cat <<EOF
+
+        EOF
+        echo one \\
+
+        echo two
+    """))
@@ -0,0 +1,90 @@
+import textwrap
+
+import pytest
+
+from .. import lex
+from .. import test
+
+
+@pytest.mark.parametrize('to_lex,expected_result', (
+    ('',
+     []),
+    ('echo hello',
+     [('code', 'echo hello')]),
+    ("echo 'a \"b\" c' d",
+     [('code', 'echo '),
+      ('single_quoted', "'a \"b\" c'"),
+      ('code', ' d')]),
+    ("echo $'it\\'s' e",
+     [('code', 'echo '),
+      ('single_quoted', "$'it\\'s'"),
+      ('code', ' e')]),
+    ("echo it\\'s",
+     [('code', "echo it\\'s")]),
+    ('echo "a $(echo "b)" ) c" d',
+     [('code', 'echo '),
+      ('double_quoted', '"a $(echo "b)" ) c"'),
+      ('code', ' d')]),
+    ('echo "${x:-"}"} `echo "\\`"`" y',
+     [('code', 'echo '),
+      ('double_quoted', '"${x:-"}"} `echo "\\`"`"'),
+      ('code', ' y')]),
+    ('echo "unterminated',
+     [('code', 'echo '),
+      ('double_quoted', '"unterminated')]),
+    ('echo ${#x} $# a#b # c\nd',
+     [('code', 'echo ${#x} $# a#b '),
+      ('comment', '# c'),
+      ('code', '\nd')]),
+    ('# a\n#b',
+     [('comment', '# a'),
+      ('code', '\n'),
+      ('comment', '#b')]),
+    ('cat <<EOF\n@fn x {\nEOF\n@fn y {',
+     [('code', 'cat <<EOF\n'),
+      ('heredoc', '@fn x {\nEOF\n'),
+      ('code', '@fn y {')]),
+    ("cat <<-'E F' | grep x\n\t@fn\n\tE F\nx",
+     [('code', "cat <<-'E F' | grep x\n"),
+      ('heredoc', '\t@fn\n\tE F\n'),
+      ('code', 'x')]),
+    ('cat <<A <<"B"\na\nA\nb\nB\nz',
+     [('code', 'cat <<A <<"B"\n'),
+      ('heredoc', 'a\nA\n'),
+      ('heredoc', 'b\nB\n'),
+      ('code', 'z')]),
+    ('cat <<EOF\nnever terminated',
+     [('code', 'cat <<EOF\n'),
+      ('heredoc', 'never terminated')]),
+    ('cat <<<x\n@fn',
+     [('code', 'cat <<<x\n@fn')]),
+    ('x=$(( 1 << 2 ))\n@fn',
+     [('code', 'x=$(( 1 << 2 ))\n@fn')]),
+))
+def test_tokenize(to_lex, expected_result):
+    actual_result = [(t.kind, to_lex[t.start:t.end]) for t in lex.tokenize(to_lex)]
+    test.assert_eq(actual_result, expected_result)
+
+
+def test_tokens_are_contiguous():
+    to_lex = textwrap.dedent("""
+        #!/bin/bash
+        @fn hello greeting='Hello, "World"' {
+            cat <<-EOF
+        \t\t${greeting} # not a comment
+        \tEOF
+            echo "$(printf '%s' "${greeting}")" # a comment
+        }
+    """)
+
+    tokens = lex.tokenize(to_lex)
+
+    assert tokens[0].start == 0
+    assert tokens[-1].end == len(to_lex)
+    assert all(a.end == b.start for a, b in zip(tokens, tokens[1:]))
+    assert [t.kind for t in tokens if t.kind != lex.CODE] == [
+        lex.COMMENT,
+        lex.SINGLE_QUOTED,
+        lex.HEREDOC,
+        lex.DOUBLE_QUOTED,
+        lex.COMMENT]
@@ -479,3 +479,98 @@ def __parse_variable(to_parse):
         .leaveWhitespace()
         .parseWithTabs()
         .parseString(to_parse))['result']
+
+
+#
+# scan tests
+#
+
+@pytest.mark.parametrize('to_scan', (
+    '',
+    'echo "no functions here"',
+    '@fn hello {',
+    '@fn hello { @fn world {',
+    '@fn {\n@fn hello {',
+    '@fnord {',
+    'x@fn hello a=1 {',
+    '@fn @fn hello {',
+    "@fn h a='@fn b {' {",
+    '\t@fn hello a,\n\tb=2 {\n\t:\n}\n\n@fn world {\n:\n}',
+))
+def test_scan_at_matches_scan_string(to_scan):
+    def scan(scanner):
+        return [(r.asList(), s, e) for r, s, e in scanner]
+
+    expected = scan(parse.FN.parseWithTabs().scanString(to_scan))
+    actual = scan(parse.scan_at(
+        parser=parse.FN.parseWithTabs(),
+        to_scan=to_scan,
+        offsets=parse.find_all('@fn', to_scan)))
+
+    test.assert_eq(actual, expected)
+
+
+#
+# packrat tests
+#
+
+@pytest.fixture
+def packrat():
+    parse.reset_packrat_stats()
+    yield parse
+    parse.configure_packrat()
+    parse.reset_packrat_stats()
+
+
+def __scan_fns(to_scan):
+    return list(parse.scan_at(
+        parser=parse.FN.parseWithTabs(),
+        to_scan=to_scan,
+        offsets=parse.find_all('@fn', to_scan)))
+
+
+def test_packrat_stats_accumulate_across_documents(packrat):
+    __scan_fns('@fn hello a, b=1 {')
+    first = packrat.packrat_stats()
+    __scan_fns('@fn hello a, b=1 {')
+    second = packrat.packrat_stats()
+
+    assert first.misses > 0
+    assert second.misses == 2 * first.misses
+    assert second.evictions == 0
+
+
+def test_packrat_cache_kept_between_documents(packrat):
+    packrat.configure_packrat(clear_between_documents=False)
+
+    __scan_fns('@fn hello a, b=1 {')
+    first = packrat.packrat_stats()
+    __scan_fns('@fn hello a, b=1 {')
+    second = packrat.packrat_stats()
+
+    assert second.misses == first.misses
+    assert second.hits > first.hits
+
+
+def test_packrat_cache_evictions(packrat):
+    packrat.configure_packrat(cache_size=4)
+
+    __scan_fns('@fn hello a, b=1 {')
+    stats = packrat.packrat_stats()
+
+    assert stats.cache_size == 4
+    assert stats.evictions == stats.misses - 4
+
+
+def test_packrat_cache_disabled(packrat):
+    packrat.configure_packrat(enabled=False)
+
+    actual = __scan_fns('@fn hello a, b=1 {')
+
+    assert len(actual) == 1
+    assert packrat.packrat_stats() == parse.PackratStats(
+        enabled=False,
+        cache_size=parse.DEFAULT_PACKRAT_CACHE_SIZE,
+        hits=0,
+        misses=0,
+        evictions=0)
@@ -0,0 +1,49 @@
+from .. import profile
+from .. import test
+
+
+def test_phases_and_counts_ignored_when_not_profiling():
+    with profile.phase('phase'):
+        profile.count('count')
+
+    items = [1, 2, 3]
+
+    assert not profile.is_active()
+    assert profile.timed(items, 'timed') is items
+
+
+def test_profiling():
+    with profile.profiling() as collected:
+        assert profile.is_active()
+        for _ in range(3):
+            with profile.phase('outer'):
+                with profile.phase('inner'):
+                    profile.count('things', 2)
+        assert list(profile.timed('ab', 'timed')) == ['a', 'b']
+
+    assert not profile.is_active()
+    test.assert_eq(
+        [(name, timing.calls) for name, timing in collected.phases.items()],
+        [('inner', 3), ('outer', 3), ('timed', 3)])
+    test.assert_eq(dict(collected.counts), {'things': 6})
+
+
+def test_profiling_nested():
+    with profile.profiling() as outer:
+        with profile.profiling() as inner:
+            profile.count('inner')
+        profile.count('outer')
+
+    assert dict(inner.counts) == {'inner': 1}
+    assert dict(outer.counts) == {'outer': 1}
+
+
+def test_report_json():
+    collected = profile.Profile()
+    collected.add_time('phase', 0.5)
+    collected.add_time('phase', 0.25)
+    collected.add_count('things', 3)
+
+    test.assert_eq(
+        collected.report('json'),
+        '{"phases": {"phase": {"calls": 2, "seconds": 0.75}}, "counts": {"things": 3}}')
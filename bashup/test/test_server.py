@@ -0,0 +1,212 @@
+import contextlib
+import json
+import os
+import socket
+import stat
+import subprocess
+import sys
+import threading
+
+import mock
+import pathlib2 as pathlib
+import pytest
+import temporary
+
+from .. import __version__
+from .. import cache
+from ..compile import bash
+from ..compile import options
+from .. import server
+
+
+def test_compile_remotely():
+    with __running_server() as socket_path:
+        compiled = server.compile_remotely('@fn hi { echo hi; }\n', socket_path=socket_path)
+        minified = server.compile_remotely(
+            '@fn hi {\n\n    echo hi\n}\n',
+            options=options.DEFAULT_OPTIONS._replace(minify=True, keep=('hi',)),
+            socket_path=socket_path)
+        # A failed compile is left for the client to repeat, to get the error.
+        failed = server.compile_remotely('@a = @a\n@a\n', socket_path=socket_path)
+        stats = server.request(dict(op='stats'), socket_path)['stats']
+
+    assert compiled == bash.compile_to_bash('@fn hi { echo hi; }\n')
+    assert minified == 'hi() {\n    echo hi\n}\n'
+    assert failed is None
+    assert stats['requests'] == 3
+    assert stats['by_op'] == {'compile': 3}
+    assert stats['errors'] == 1
+    assert all(ms is not None for ms in stats['latency_ms'].values())
+
+
+def test_command_line_compiles_through_server():
+    with temporary.temp_file('@fn hi { echo hi; }\nhi\n') as in_file:
+        with __running_server() as socket_path:
+            output = subprocess.check_output(
+                (sys.executable, '-m', 'bashup', '-i', str(in_file)),
+                cwd=str(pathlib.Path(__file__).parent.parent.parent),
+                env=dict(os.environ, BASHUP_SOCKET=socket_path))
+            stats = server.request(dict(op='stats'), socket_path)['stats']
+
+    assert output.decode('utf-8').strip() == bash.compile_to_bash('@fn hi { echo hi; }\nhi\n').strip()
+    assert stats['by_op'] == {'compile': 1}
+
+
+def test_serve_loads_compiler_before_ready():
+    # In a fresh process, since this one has long since loaded the compiler.
+    script = '\n'.join((
+        'import sys',
+        'from bashup import server',
+        'def ready():',
+        '    print(sorted(m for m in ("bashup.parse", "jinja2") if m in sys.modules))',
+        '    raise KeyboardInterrupt',
+        'server.serve(sys.argv[1], ready_fn=ready)'))
+
+    with temporary.temp_dir() as temp_dir:
+        output = subprocess.check_output(
+            (sys.executable, '-c', script, str(temp_dir / 's.sock')),
+            cwd=str(pathlib.Path(__file__).parent.parent.parent))
+
+    assert output.decode('utf-8').strip() == "['bashup.parse', 'jinja2']"
+
+
+def test_command_line_with_packrat_stats_compiles_locally():
+    with temporary.temp_file('@fn hi { echo hi; }\nhi\n') as in_file:
+        with __running_server() as socket_path:
+            p = subprocess.Popen(
+                (sys.executable, '-m', 'bashup', '-i', str(in_file), '--packrat-stats'),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=str(pathlib.Path(__file__).parent.parent.parent),
+                env=dict(os.environ, BASHUP_SOCKET=socket_path))
+            _, stderr = p.communicate()
+            stats = server.request(dict(op='stats'), socket_path)['stats']
+
+    assert p.returncode == 0
+    assert stats['by_op'] == {}
+    assert ' 0 misses' not in stderr.decode('utf-8')
+
+
+def test_compile_remotely_without_server():
+    with temporary.temp_dir() as temp_dir:
+        assert server.compile_remotely('echo', socket_path=str(temp_dir / 'none.sock')) is None
+
+
+def test_serve_replaces_stale_socket():
+    with temporary.temp_dir() as temp_dir:
+        socket_path = str(temp_dir / 'server.sock')
+        with open(socket_path, 'w'):
+            pass
+
+        with __running_server(socket_path):
+            assert server.request(dict(op='stats'), socket_path)['ok']
+
+
+def test_serve_leaves_live_socket_alone():
+    # Another version of the server would still answer on the socket.
+    with __listening_socket() as socket_path:
+        with pytest.raises(server.AlreadyRunning):
+            server.serve(socket_path)
+
+        assert os.path.exists(socket_path)
+
+
+def test_serve_makes_private_directory():
+    with temporary.temp_dir() as temp_dir:
+        with mock.patch.dict(os.environ, XDG_RUNTIME_DIR=str(temp_dir)):
+            os.environ.pop('BASHUP_SOCKET', None)
+            socket_path = server.default_socket_path()
+
+            with __running_server(socket_path):
+                assert server.compile_remotely('echo', socket_path=socket_path) == 'echo'
+
+        assert stat.S_IMODE(os.stat(os.path.dirname(socket_path)).st_mode) == 0o700
+
+
+def test_serve_refuses_directory_writable_by_others():
+    with temporary.temp_dir() as temp_dir:
+        shared = temp_dir / 'shared'
+        shared.mkdir()
+        shared.chmod(0o777)
+
+        with pytest.raises(server.UnsafeSocket):
+            server.serve(str(shared / 'server.sock'))
+
+
+def test_request_refuses_server_of_another_user():
+    with __running_server() as socket_path:
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            with pytest.raises(server.ServerUnavailable):
+                server.request(dict(op='stats'), socket_path)
+
+
+def test_serve_refuses_client_of_another_user():
+    with __running_server() as socket_path:
+        with mock.patch.object(server, '__is_own_peer', return_value=False):
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            with contextlib.closing(client):
+                client.connect(socket_path)
+                # Even an empty request gets an error response, unless it's refused.
+                client.shutdown(socket.SHUT_WR)
+                response = client.recv(1024)
+
+        stats = server.request(dict(op='stats'), socket_path)['stats']
+
+    assert response == b''
+    assert stats['requests'] == 0
+
+
+def test_compile_remotely_gives_up_on_stuck_server():
+    with __listening_socket() as socket_path:
+        with mock.patch.object(server, 'REQUEST_TIMEOUT', 0.1):
+            assert server.compile_remotely('echo', socket_path=socket_path) is None
+
+
+def test_serve_refuses_client_of_another_compiler():
+    with __running_server() as socket_path:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with contextlib.closing(client):
+            client.connect(socket_path)
+            client.sendall(json.dumps(dict(op='stats', version=__version__, compiler='other')).encode('utf-8'))
+            client.shutdown(socket.SHUT_WR)
+            response = json.loads(client.makefile('rb').read().decode('utf-8'))
+
+    assert response['ok'] is False
+    assert response['compiler'] == cache.compiler_fingerprint()
+
+
+def test_stats_percentiles():
+    stats = server.Stats(window=3)
+    for seconds in (10.0, 0.001, 0.002, 0.003):
+        stats.record('compile', seconds)
+
+    assert stats.percentile(50) == 0.002
+    assert stats.percentile(99) == 0.003
+    assert server.Stats().percentile(50) is None
+
+
+@contextlib.contextmanager
+def __listening_socket():
+    # Accepts connections, but never answers.
+    with temporary.temp_dir() as temp_dir:
+        socket_path = str(temp_dir / 'server.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with contextlib.closing(listener):
+            listener.bind(socket_path)
+            listener.listen(1)
+            yield socket_path
+
+
+@contextlib.contextmanager
+def __running_server(socket_path=None):
+    with temporary.temp_dir() as temp_dir:
+        socket_path = socket_path or str(temp_dir / 'server.sock')
+        ready = threading.Event()
+        thread = threading.Thread(target=server.serve, args=(socket_path,), kwargs=dict(ready_fn=ready.set))
+        thread.start()
+        try:
+            assert ready.wait(10)
+            yield socket_path
+        finally:
+            server.request(dict(op='stop'), socket_path)
+            thread.join()
@@ -0,0 +1,46 @@
+import textwrap
+
+import pytest
+
+from ..compile import bash
+from .. import sourcemap
+from .. import test
+
+
+def test_from_document():
+    bashup_str = textwrap.dedent("""
+        #!/bin/bash
+        @fn hi name {
+            echo "${name}"
+        }
+        hi --name=x
+    """).lstrip()
+
+    document = bash.compile_document(bashup_str)
+    source_map = sourcemap.from_document(document, file_path='out.sh', source_path='in.bashup')
+    output_lines = document.text().splitlines()
+
+    assert len(source_map.lines) == len(output_lines)
+    assert source_map.source_line(1) == 1
+    assert source_map.source_line(output_lines.index('hi() {') + 1) == 2
+    assert source_map.source_line(output_lines.index('    echo "${name}"') + 1) == 3
+    assert source_map.source_line(len(output_lines)) == 5
+    assert source_map.source_line(len(output_lines) + 1) is None
+
+
+def test_dumps_and_loads():
+    source_map = sourcemap.SourceMap(file=None, source='in.bashup', lines=(1, 2, 2))
+
+    assert sourcemap.loads(sourcemap.dumps(source_map)) == source_map
+
+    with pytest.raises(ValueError):
+        sourcemap.loads('{"version": 0, "lines": []}')
+
+
+def test_translate_without_known_file():
+    source_map = sourcemap.SourceMap(file=None, source='in.bashup', lines=(1, 4))
+
+    test.assert_eq(list(sourcemap.translate(['+/dev/fd/3:2 x\n', 'at line 9: y\n', 'a.sh:3\n'], source_map)), [
+        '+in.bashup:4 x\n',
+        'at line 9: y\n',
+        'a.sh:3\n'])
@@ -0,0 +1,49 @@
+from .. import trace
+from .. import test
+
+
+def test_summarize_recursion():
+    actual = trace.summarize([
+        'call walk 1.0 7',
+        'call walk 2.0 7',
+        'call leaf 3.0 7',
+        'return leaf 4.0 7',
+        'return walk 5.0 7',
+        'return walk 9.0 7',
+    ])
+
+    test.assert_eq(actual, [
+        trace.FnTiming(name='walk', calls=2, inclusive=8.0, exclusive=7.0),
+        trace.FnTiming(name='leaf', calls=1, inclusive=1.0, exclusive=1.0),
+    ])
+
+
+def test_summarize_keeps_processes_apart():
+    actual = trace.summarize([
+        'call outer 1.0 7',
+        'call inner 2.0 8',
+        'return inner 4.0 8',
+        'return outer 5.0 7',
+    ])
+
+    test.assert_eq(actual, [
+        trace.FnTiming(name='outer', calls=1, inclusive=4.0, exclusive=4.0),
+        trace.FnTiming(name='inner', calls=1, inclusive=2.0, exclusive=2.0),
+    ])
+
+
+def test_summarize_ignores_unreturned_calls_and_bad_lines():
+    actual = trace.summarize([
+        'call outer 1,0 7',
+        'call exits 2.0 7',
+        'return outer 4,5 7',
+        'return never_called 5.0 7',
+        'not an event',
+        'call truncated 6.',
+        'call bad_time x 7',
+    ])
+
+    test.assert_eq(actual, [
+        trace.FnTiming(name='outer', calls=1, inclusive=3.5, exclusive=3.5),
+        trace.FnTiming(name='exits', calls=1, inclusive=0.0, exclusive=0.0),
+    ])
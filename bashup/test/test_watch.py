@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import mock
+import pytest
+import temporary
+
+from .. import watch
+
+
+@pytest.mark.parametrize('use_inotify', (False, True))
+def test_changes_in_tree(use_inotify):
+    with temporary.temp_dir() as root:
+        (root / 'sub').mkdir()
+        __write(root / 'sub' / 'a.bashup', 'one')
+        __write(root / 'b.txt', 'one')
+
+        changes = watch.changes(
+            [root],
+            predicate=lambda p: p.endswith('.bashup'),
+            use_inotify=use_inotify,
+            poll_interval=0.01,
+            timeout=2)
+
+        actual = __first_change_after(changes, lambda: (
+            __write(root / 'b.txt', 'two'),
+            __write(root / 'sub' / 'a.bashup', 'two, which is longer')))
+
+    assert actual == set([os.path.abspath(str(root / 'sub' / 'a.bashup'))])
+
+
+@pytest.mark.parametrize('use_inotify', (False, True))
+def test_changes_to_file(use_inotify):
+    with temporary.temp_dir() as root:
+        __write(root / 'a.bashup', 'one')
+        __write(root / 'b.bashup', 'one')
+
+        changes = watch.changes(
+            [root / 'a.bashup'],
+            use_inotify=use_inotify,
+            poll_interval=0.01,
+            timeout=2)
+
+        actual = __first_change_after(changes, lambda: (
+            __write(root / 'b.bashup', 'two'),
+            __write(root / 'a.bashup', 'two, which is longer')))
+
+    assert actual == set([os.path.abspath(str(root / 'a.bashup'))])
+
+
+def test_inotify_skips_directory_removed_before_it_is_watched():
+    inotify = watch._Inotify.create()  # pylint: disable=protected-access
+    if inotify is None:
+        pytest.skip('requires inotify')
+
+    with temporary.temp_dir() as root:
+        try:
+            inotify.add_tree(str(root))
+            (root / 'new').mkdir()
+            __write(root / 'a.bashup', 'one')
+            # As if the new directory were removed after being listed.
+            with mock.patch('os.walk', return_value=[(str(root / 'gone'), [], [])]):
+                changed = inotify.read(2)
+        finally:
+            inotify.close()
+
+    assert set(changed) == set([str(root / 'a.bashup')])
+
+
+def test_changes_times_out():
+    with temporary.temp_dir() as root:
+        assert list(watch.changes([root], use_inotify=False, poll_interval=0.01, timeout=0.05)) == []
+
+
+def test_snapshot():
+    with temporary.temp_dir() as root:
+        (root / 'sub').mkdir()
+        __write(root / 'sub' / 'a', '')
+        __write(root / 'b', '')
+
+        actual = watch.snapshot([str(root), str(root / 'b'), str(root / 'missing')])
+
+    assert sorted(actual) == sorted([str(root / 'sub' / 'a'), str(root / 'b')])
+
+
+#
+# Test Helpers
+#
+
+def __write(path, content):
+    with open(str(path), 'w') as f:
+        f.write(content)
+
+
+def __first_change_after(changes, change_fn):
+    def change_later():
+        time.sleep(0.1)
+        change_fn()
+
+    thread = threading.Thread(target=change_later)
+    thread.start()
+    try:
+        return next(changes)
+    finally:
+        thread.join()
+        changes.close()
@@ -0,0 +1,129 @@
+"""
+Summarizes the call traces written by functions compiled with --instrument.
+
+An instrumented function writes a line to the file descriptor named by
+$BASHUP_TRACE_FD when it's called, and another when it returns:
+
+    call NAME SECONDS PID
+    return NAME SECONDS PID
+
+where SECONDS is the time since the epoch and PID is $BASHPID, so calls made
+in subshells are kept apart. Before bash 5, SECONDS is only to the second,
+and before bash 4 PID is $$ (so subshells aren't kept apart). From these,
+each function's inclusive time (including the functions it calls) and
+exclusive time (excluding them) are worked out.
+"""
+import collections
+
+
+CALL = 'call'
+RETURN = 'return'
+
+
+# noinspection PyClassHasNoInit
+class FnTiming(collections.namedtuple('FnTiming', ('name', 'calls', 'inclusive', 'exclusive'))):
+    """
+    The number of calls to the named function, and the total inclusive and
+    exclusive seconds spent in those which returned.
+    """
+    __slots__ = ()
+
+
+def summarize(lines):
+    """
+    Returns a list of FnTiming, one per function called in the given trace
+    lines, sorted by exclusive time (longest first). Lines which aren't
+    events, such as one cut short when a script was killed, are ignored, as
+    are calls which never returned (because the script exited, say).
+
+    >>> trace = [
+    ...     'call outer 10.0 7',
+    ...     'call inner 10.5 7',
+    ...     'return inner 11.0 7',
+    ...     'return outer 13.0 7',
+    ... ]
+    >>> for timing in summarize(trace):
+    ...     print(timing)
+    FnTiming(name='outer', calls=1, inclusive=3.0, exclusive=2.5)
+    FnTiming(name='inner', calls=1, inclusive=0.5, exclusive=0.5)
+    """
+    calls = collections.OrderedDict()
+    inclusive = collections.defaultdict(float)
+    exclusive = collections.defaultdict(float)
+    stacks = collections.defaultdict(list)
+
+    for event in __parse_events(lines):
+        kind, name, seconds, pid = event
+        stack = stacks[pid]
+
+        if kind == CALL:
+            calls[name] = calls.get(name, 0) + 1
+            stack.append(_Frame(name=name, start=seconds, children=[0.0]))
+            continue
+
+        # Frames above the one returning belong to calls which never returned.
+        depth = __find_frame(stack, name)
+        if depth is None:
+            continue
+        frame = stack[depth]
+        del stack[depth:]
+
+        elapsed = seconds - frame.start
+        exclusive[name] += elapsed - frame.children[0]
+        if stack:
+            stack[-1].children[0] += elapsed
+        # Recursive calls are already counted by the outermost one.
+        if not any(f.name == name for f in stack):
+            inclusive[name] += elapsed
+
+    timings = [
+        FnTiming(name=name, calls=count, inclusive=inclusive[name], exclusive=exclusive[name])
+        for name, count in calls.items()]
+    timings.sort(key=lambda t: t.exclusive, reverse=True)
+    return timings
+
+
+def report(timings):
+    """
+    Returns the given FnTimings as a table.
+
+    >>> print(report([FnTiming(name='outer', calls=2, inclusive=0.003, exclusive=0.0015)]))
+    function                  calls  inclusive (ms)  exclusive (ms)
+    outer                         2           3.000           1.500
+    """
+    lines = ['{0:<20} {1:>10} {2:>15} {3:>15}'.format(
+        'function', 'calls', 'inclusive (ms)', 'exclusive (ms)')]
+    lines.extend(
+        '{0:<20} {1:>10} {2:>15.3f} {3:>15.3f}'.format(
+            t.name, t.calls, t.inclusive * 1000, t.exclusive * 1000)
+        for t in timings)
+    return '\n'.join(lines)
+
+
+#
+# Private Helpers
+#
+
+# The children list holds a single float: the inclusive time of the calls
+# made from this frame, which is updated in place.
+_Frame = collections.namedtuple('_Frame', ('name', 'start', 'children'))
+
+
+def __parse_events(lines):
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 4 or fields[0] not in (CALL, RETURN):
+            continue
+        try:
+            # $EPOCHREALTIME uses the locale's decimal separator.
+            seconds = float(fields[2].replace(',', '.'))
+        except ValueError:
+            continue
+        yield fields[0], fields[1], seconds, fields[3]
+
+
+def __find_frame(stack, name):
+    for depth in range(len(stack) - 1, -1, -1):
+        if stack[depth].name == name:
+            return depth
+    return None
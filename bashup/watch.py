@@ -0,0 +1,216 @@
+"""
+Watches files and directory trees for changes, using inotify where it's
+available (Linux) and polling with os.stat() everywhere else.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+
+DEFAULT_POLL_INTERVAL = 0.25
+
+# After the first change, wait this long for related changes (an editor
+# writing a temporary file and renaming it, say) so they're reported together.
+DEFAULT_SETTLE_TIME = 0.01
+
+
+def changes(paths, predicate=None, use_inotify=True, poll_interval=DEFAULT_POLL_INTERVAL, timeout=None):
+    """
+    Yields a set of changed (created, modified or deleted) file paths each
+    time files change. Each path may be a file or a directory, which is
+    watched recursively. If given, predicate(path) selects which files are of
+    interest. If no change is seen within timeout seconds, the generator ends.
+    """
+    paths = tuple(os.path.abspath(str(p)) for p in paths)
+    predicate = predicate or (lambda _: True)
+    watched_dirs = tuple(p for p in paths if os.path.isdir(p))
+    watched_files = frozenset(p for p in paths if p not in watched_dirs)
+
+    def is_relevant(path):
+        return path in watched_files or (
+            predicate(path) and __is_under_dir(path, watched_dirs))
+
+    inotify = _Inotify.create() if use_inotify else None
+
+    if inotify is None:
+        return __poll(paths, is_relevant, poll_interval, timeout)
+
+    return __watch_with_inotify(inotify, paths, is_relevant, timeout)
+
+
+def snapshot(paths):
+    """
+    Returns a dict of every file path under the given paths to a value which
+    changes whenever the file does.
+    """
+    result = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, _, file_names in os.walk(path):
+                for name in file_names:
+                    __stat_into(result, os.path.join(dir_path, name))
+        else:
+            __stat_into(result, path)
+    return result
+
+
+def diff_snapshots(old, new):
+    """
+    Returns the set of paths which were created, modified or deleted.
+
+    >>> sorted(diff_snapshots({'a': 1, 'b': 2, 'c': 3}, {'a': 1, 'b': 4, 'd': 5}))
+    ['b', 'c', 'd']
+    """
+    return set(
+        p for p in set(old) | set(new)
+        if old.get(p) != new.get(p))
+
+
+#
+# Private Helpers
+#
+
+def __is_under_dir(path, dirs):
+    return any(path.startswith(d.rstrip(os.sep) + os.sep) for d in dirs)
+
+
+def __stat_into(result, path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    result[path] = (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def __poll(paths, is_relevant, poll_interval, timeout):
+    previous = snapshot(paths)
+    waited = 0.0
+
+    while timeout is None or waited < timeout:
+        time.sleep(poll_interval)
+        waited += poll_interval
+        current = snapshot(paths)
+        changed = set(p for p in diff_snapshots(previous, current) if is_relevant(p))
+        previous = current
+        if changed:
+            waited = 0.0
+            yield changed
+
+
+def __watch_with_inotify(inotify, paths, is_relevant, timeout):
+    try:
+        for path in paths:
+            if os.path.isdir(path):
+                inotify.add_tree(path)
+            else:
+                inotify.add_dir(os.path.dirname(path))
+
+        while True:
+            changed = inotify.read(timeout)
+            if changed is None:
+                return
+            # Gather whatever else arrives while the writer finishes up.
+            changed.extend(inotify.read(DEFAULT_SETTLE_TIME) or ())
+            changed = set(p for p in changed if is_relevant(p))
+            if changed:
+                yield changed
+    finally:
+        inotify.close()
+
+
+# See inotify(7). These are single-underscored because they're used in a
+# class body, where double-underscored names would be mangled.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0o2000000
+
+_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE)
+
+_EVENT = struct.Struct('iIII')
+
+
+class _Inotify(object):
+    def __init__(self, libc, fd):
+        self.__libc = libc
+        self.__fd = fd
+        self.__dirs = {}
+
+    @classmethod
+    def create(cls):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            return None
+        fd = init(_IN_CLOEXEC)
+        return None if fd < 0 else cls(libc, fd)
+
+    def close(self):
+        os.close(self.__fd)
+
+    def add_dir(self, path):
+        wd = self.__libc.inotify_add_watch(self.__fd, path.encode('utf-8'), _MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self.__dirs[wd] = path
+
+    def add_tree(self, path, missing_ok=False):
+        """
+        Watches the directory and every directory under it. With missing_ok,
+        directories which are gone again before they're watched (as may
+        happen to those just created) are skipped.
+        """
+        for dir_path, _, _ in os.walk(path):
+            try:
+                self.add_dir(dir_path)
+            except OSError as e:
+                if not missing_ok or e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+
+    def read(self, timeout):
+        """
+        Returns a list of the paths changed since the last read, waiting up
+        to timeout seconds (forever if None) for the first event. Returns
+        None on timeout.
+        """
+        ready, _, _ = select.select([self.__fd], [], [], timeout)
+        if not ready:
+            return None
+
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8')
+            offset += length
+
+            if wd not in self.__dirs or not name:
+                continue
+
+            path = os.path.join(self.__dirs[wd], name)
+
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self.add_tree(path, missing_ok=True)
+            else:
+                paths.append(path)
+
+        return paths
@@ -0,0 +1,77 @@
+"""
+Compares the per-call cost, in bash, of the argument parsers generated by
+each --arg-parser style, for calls with 1, 100 and 10,000 pass-through
+arguments. Needs bash 5 or later, for $EPOCHREALTIME.
+
+Usage: python -m benchmarks.arg_parsing
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+from bashup.compile import bash
+from bashup.compile import options
+
+
+FN = """
+@fn forward name, mode='fast' {
+    :
+}
+"""
+
+HARNESS = """
+args=()
+for ((i = 0; i < {arg_count}; i++)); do
+    args+=("file-${{i}}")
+done
+
+start=${{EPOCHREALTIME}}
+for ((call = 0; call < {calls}; call++)); do
+    forward --name=x "${{args[@]}}" --mode=slow
+done
+end=${{EPOCHREALTIME}}
+
+echo "${{start/,/.}} ${{end/,/.}}"
+"""
+
+SCENARIOS = (
+    # (pass-through arguments, calls)
+    (1, 2000),
+    (100, 500),
+    (10000, 3),
+)
+
+
+def per_call_seconds(compiled_fn, arg_count, calls):
+    script = compiled_fn + HARNESS.format(arg_count=arg_count, calls=calls)
+    output = subprocess.check_output(('bash', '-c', script))
+    start, end = (float(t) for t in output.decode('utf-8').split())
+    return (end - start) / calls
+
+
+def main():
+    if subprocess.call(('bash', '-c', '[[ -n ${EPOCHREALTIME} ]]')) != 0:
+        print('This benchmark needs bash 5 or later.')
+        return 1
+
+    compiled = dict(
+        (style, bash.compile_to_bash(FN, compilers=bash.compilers_for(
+            options.DEFAULT_OPTIONS._replace(arg_parser=style))))
+        for style in options.ARG_PARSERS)
+
+    print('{0:>8} {1:>14} {2:>14} {3:>8}'.format(
+        'args', 'loop (ms)', 'case (ms)', 'speedup'))
+
+    for arg_count, calls in SCENARIOS:
+        loop, case = (
+            per_call_seconds(compiled[style], arg_count, calls)
+            for style in ('loop', 'case'))
+        print('{0:>8} {1:>14.3f} {2:>14.3f} {3:>7.1f}x'.format(
+            arg_count, loop * 1000, case * 1000, loop / case))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+Times a full build and a no-op rebuild of a generated tree of bashup files.
+
+Usage: python -m benchmarks.build [FILES] [JOBS]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+from bashup import build
+
+from . import corpus
+
+
+def main(argv):
+    file_count = int(argv[0]) if argv else 300
+    jobs = int(argv[1]) if len(argv) > 1 else os.cpu_count() or 1
+
+    root = tempfile.mkdtemp()
+    try:
+        src_dir = os.path.join(root, 'src')
+        out_dir = os.path.join(root, 'out')
+
+        for i in range(file_count):
+            sub_dir = os.path.join(src_dir, 'dir{0}'.format(i % 10))
+            if not os.path.isdir(sub_dir):
+                os.makedirs(sub_dir)
+            with open(os.path.join(sub_dir, 'script{0}.bashup'.format(i)), 'w') as f:
+                f.write(corpus.generate(fn_count=5, filler_per_fn=5))
+
+        print('files: {0}, jobs: {1}'.format(file_count, jobs))
+        print('full build:    ' + build.build(src_dir, out_dir, jobs=jobs).summary())
+        print('no-op rebuild: ' + build.build(src_dir, out_dir, jobs=jobs).summary())
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
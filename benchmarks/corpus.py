@@ -0,0 +1,76 @@
+"""
+Generators for synthetic bashup documents used by the benchmarks.
+"""
+import textwrap
+
+
+FILLER_BLOCK = textwrap.dedent("""
+    # Plain bash: nothing here for bashup to compile.
+    for path in "${paths[@]}"; do
+        if [[ -f ${path} ]]; then
+            printf '%s\\n' "$(wc -l < "${path}")"
+        fi
+    done
+""").lstrip()
+
+FN_BLOCK = textwrap.dedent("""
+    @fn fn_{index} first, second='two', third="${{HOME}}" {{
+        echo "${{first}} ${{second}} ${{third}}" "$@"
+    }}
+""").lstrip()
+
+
+def generate(fn_count, filler_per_fn=0):
+    """
+    Returns a bashup document with fn_count functions, each preceded by
+    filler_per_fn blocks of plain bash.
+    """
+    filler = FILLER_BLOCK * filler_per_fn
+    return '#!/bin/bash\n\n' + ''.join(
+        filler + FN_BLOCK.format(index=i) for i in range(fn_count))
+
+
+# Default values by complexity: none, a plain word, a quoted string with an
+# expansion, and a command substitution with nested quoting.
+DEFAULT_VALUES = (
+    None,
+    'plain',
+    '"${HOME}/.config"',
+    '"$(printf \'%s-%s\' "${USER}" "$(date +%s)")"',
+)
+
+
+def generate_fn(index, params=3, default_complexity=1, nesting_depth=0, indent=''):
+    """
+    Returns a single @fn with the given number of parameters, every other one
+    of which has a default value of the given complexity (an index into
+    DEFAULT_VALUES), and with nesting_depth levels of @fns nested inside it.
+    """
+    default = DEFAULT_VALUES[default_complexity]
+    param_list = ', '.join(
+        'p{i}'.format(i=i) + ('=' + default if default and i % 2 else '')
+        for i in range(params))
+
+    body_indent = indent + '    '
+    nested = generate_fn(
+        index, params, default_complexity, nesting_depth - 1, body_indent
+    ) if nesting_depth > 0 else ''
+
+    return '{indent}@fn fn_{index}_{depth} {params}{{\n{nested}{body}{indent}}}\n'.format(
+        indent=indent,
+        index=index,
+        depth=nesting_depth,
+        params=param_list + ' ' if param_list else '',
+        nested=nested,
+        body=body_indent + 'echo "$@"\n')
+
+
+def generate_varied(fn_count, params=3, default_complexity=1, nesting_depth=0, filler_per_fn=0):
+    """
+    Returns a bashup document with fn_count top-level functions built by
+    generate_fn(), each preceded by filler_per_fn blocks of plain bash.
+    """
+    filler = FILLER_BLOCK * filler_per_fn
+    return '#!/bin/bash\n\n' + ''.join(
+        filler + generate_fn(i, params, default_complexity, nesting_depth)
+        for i in range(fn_count))
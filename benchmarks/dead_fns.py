@@ -0,0 +1,88 @@
+"""
+Measures how long bash takes to parse (bash -n) and to source a large library
+of @fns of which the entry point uses only a few, compiled as-is, with unused
+functions dropped, minified, and both.
+
+Usage: python -m benchmarks.dead_fns [FN_COUNT]
+"""
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from bashup.compile import bash
+from bashup.compile import options
+
+from . import corpus
+
+
+DEFAULT_FN_COUNT = 1000
+
+# The entry point calls this many functions, each of which calls the next.
+USED_FNS = 5
+
+VARIANTS = (
+    ('as-is', options.DEFAULT_OPTIONS),
+    ('drop unused', options.DEFAULT_OPTIONS._replace(drop_unused_fns=True)),
+    ('minify', options.DEFAULT_OPTIONS._replace(minify=True)),
+    ('both', options.DEFAULT_OPTIONS._replace(drop_unused_fns=True, minify=True)),
+)
+
+
+def library(fn_count):
+    """
+    Returns a bashup document with fn_count functions, the first USED_FNS of
+    which form a call chain started by the entry point.
+    """
+    fns = ''.join(
+        '@fn fn_{i} first, second=\'two\' {{\n'
+        '    # Each function documents itself.\n'
+        '\n'
+        '    echo "${{first}} ${{second}}"{call}\n'
+        '}}\n'
+        '\n'.format(
+            i=i,
+            call=' && fn_{0} --first=x'.format(i + 1) if i + 1 < USED_FNS else '')
+        for i in range(fn_count))
+    return '#!/bin/bash\n\n' + corpus.FILLER_BLOCK + '\n' + fns + 'fn_0 --first=entry\n'
+
+
+def best_time(args, repeat=5):
+    return min(timeit.repeat(lambda: subprocess.check_call(args), number=1, repeat=repeat))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    fn_count = int(argv[0]) if argv else DEFAULT_FN_COUNT
+    source = library(fn_count)
+
+    handle, empty_path = tempfile.mkstemp(suffix='.sh')
+    os.close(handle)
+    # Process startup is measured separately and subtracted.
+    baseline = best_time(('bash', '-n', empty_path))
+
+    print('{0:<12} {1:>10} {2:>14} {3:>14}'.format('variant', 'bytes', 'bash -n (ms)', 'source (ms)'))
+
+    try:
+        for name, variant in VARIANTS:
+            compiled = bash.compile_to_bash(source, compilers=bash.compilers_for(variant))
+            with tempfile.NamedTemporaryFile('w', suffix='.sh', delete=False) as f:
+                f.write(compiled)
+            try:
+                parse_time = best_time(('bash', '-n', f.name)) - baseline
+                source_time = best_time(('bash', '-c', 'source "$1" > /dev/null', 'bash', f.name)) - baseline
+            finally:
+                os.remove(f.name)
+            print('{0:<12} {1:>10} {2:>14.2f} {3:>14.2f}'.format(
+                name, len(compiled), parse_time * 1000, source_time * 1000))
+    finally:
+        os.remove(empty_path)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Compares compiling a document with several constructs as a chain of
+compilers, each of which scans the code and joins the result on its own,
+against a single dispatch which routes every construct from one scan.
+
+The extra constructs are simple one-word replacements (@echo_0 becomes
+echo, say), each used a few times per @fn.
+
+Usage: python -m benchmarks.dispatch [FN_COUNT]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from bashup import lex
+from bashup.compile import dispatch
+
+from . import corpus
+
+
+DEFAULT_FN_COUNT = 300
+
+CONSTRUCT_COUNTS = (0, 1, 4, 16)
+
+
+def document(fn_count, construct_count):
+    """
+    Returns a corpus document with a use of each extra construct after each
+    @fn.
+    """
+    uses = ''.join('@echo_{0} {0}\n'.format(i) for i in range(construct_count))
+    return corpus.generate(fn_count).replace('}\n', '}\n' + uses)
+
+
+def constructs(construct_count):
+    def replace_sigil(bashup_str, offset, context):
+        end = bashup_str.find(' ', offset)
+        return dispatch.Replacement(start=offset, end=end, replacement='echo')
+
+    return tuple(
+        dispatch.Construct(name='echo_{0}'.format(i), sigil='@echo_{0}'.format(i), handler=replace_sigil)
+        for i in range(construct_count))
+
+
+def chained(bashup_str, all_constructs):
+    # Each construct as a compiler of its own, lexing whatever the previous
+    # one returned.
+    for construct in all_constructs:
+        bashup_str = dispatch.dispatch(bashup_str, tokens=lex.tokenize(bashup_str), constructs=(construct,)).output
+    return bashup_str
+
+
+def single(bashup_str, all_constructs):
+    return dispatch.dispatch(bashup_str, constructs=all_constructs).output
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    fn_count = int(argv[0]) if argv else DEFAULT_FN_COUNT
+
+    print('{0:>10} {1:>12} {2:>12} {3:>8}'.format('constructs', 'chained (s)', 'single (s)', 'speedup'))
+
+    for construct_count in CONSTRUCT_COUNTS:
+        bashup_str = document(fn_count, construct_count)
+        all_constructs = dispatch.registered() + constructs(construct_count)
+        assert chained(bashup_str, all_constructs) == single(bashup_str, all_constructs)
+
+        chain = min(timeit.repeat(lambda: chained(bashup_str, all_constructs), number=1, repeat=3))
+        one = min(timeit.repeat(lambda: single(bashup_str, all_constructs), number=1, repeat=3))
+
+        print('{0:>10} {1:>12.4f} {2:>12.4f} {3:>7.1f}x'.format(
+            construct_count + 1, chain, one, chain / one))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Compares the per-call cost, in bash, of the function layouts generated by
+each --fn-layout style (with each --arg-parser style), for tight loops of
+calls with 1, 10 and 100 pass-through arguments. Needs bash 5 or later, for
+$EPOCHREALTIME.
+
+Usage: python -m benchmarks.fn_layout
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+from bashup.compile import bash
+from bashup.compile import options
+
+from . import arg_parsing
+
+
+SCENARIOS = (
+    # (pass-through arguments, calls)
+    (1, 5000),
+    (10, 2000),
+    (100, 500),
+)
+
+
+def main():
+    if subprocess.call(('bash', '-c', '[[ -n ${EPOCHREALTIME} ]]')) != 0:
+        print('This benchmark needs bash 5 or later.')
+        return 1
+
+    print('{0:>8} {1:>8} {2:>14} {3:>14} {4:>8}'.format(
+        'parser', 'args', 'wrapper (ms)', 'inline (ms)', 'speedup'))
+
+    for arg_parser in options.ARG_PARSERS:
+        compiled = dict(
+            (layout, bash.compile_to_bash(arg_parsing.FN, compilers=bash.compilers_for(
+                options.DEFAULT_OPTIONS._replace(arg_parser=arg_parser, fn_layout=layout))))
+            for layout in options.FN_LAYOUTS)
+
+        for arg_count, calls in SCENARIOS:
+            wrapper, inline = (
+                arg_parsing.per_call_seconds(compiled[layout], arg_count, calls)
+                for layout in ('wrapper', 'inline'))
+            print('{0:>8} {1:>8} {2:>14.4f} {3:>14.4f} {4:>7.2f}x'.format(
+                arg_parser, arg_count, wrapper * 1000, inline * 1000, wrapper / inline))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Measures how @fn compilation time grows with the number of functions in a
+document. Compilation is linear when the time per function stays flat as the
+document grows.
+
+Usage: python -m benchmarks.fn_scaling [--quick]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from bashup.compile.elements import fn
+
+from . import corpus
+
+
+FN_COUNTS = (1000, 10000, 100000)
+
+# Per-function time may grow by this factor across the scenarios, to allow for
+# noise and cache effects, before growth is reported as non-linear.
+TOLERANCE = 2.0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    fn_counts = FN_COUNTS[:2] if '--quick' in argv else FN_COUNTS
+
+    # Warm up: build the grammar and the template.
+    fn.compile_fns_to_bash(corpus.generate(1))
+
+    print('{0:>8} {1:>10} {2:>10} {3:>12}'.format(
+        'fns', 'lines', 'time (s)', 'per fn (us)'))
+
+    per_fn = []
+    for fn_count in fn_counts:
+        bashup_str = corpus.generate(fn_count, filler_per_fn=1)
+        seconds = min(timeit.repeat(
+            lambda: fn.compile_fns_to_bash(bashup_str), number=1, repeat=1))
+        per_fn.append(seconds / fn_count)
+
+        print('{0:>8} {1:>10} {2:>10.3f} {3:>12.1f}'.format(
+            fn_count, bashup_str.count('\n'), seconds, per_fn[-1] * 1e6))
+
+    growth = max(per_fn) / min(per_fn)
+    print('Per-function time varies by {0:.2f}x: {1}'.format(
+        growth, 'linear' if growth <= TOLERANCE else 'NOT linear'))
+
+    return 0 if growth <= TOLERANCE else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
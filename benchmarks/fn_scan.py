@@ -0,0 +1,53 @@
+"""
+Compares the original full scan of a document for @fn headers (a match
+attempt at every character) against the sigil prescan, which only attempts a
+match where '@fn' actually appears.
+
+Usage: python -m benchmarks.fn_scan
+"""
+from __future__ import print_function
+
+import timeit
+
+from bashup import parse
+
+from . import corpus
+
+
+SCENARIOS = (
+    # (functions, filler blocks per function)
+    (10, 0),
+    (10, 100),
+    (100, 100),
+    (300, 10),
+)
+
+
+def full_scan(bashup_str):
+    return sum(1 for _ in parse.FN.parseWithTabs().scanString(bashup_str))
+
+
+def prescan(bashup_str):
+    return sum(1 for _ in parse.scan_at(
+        parser=parse.FN.parseWithTabs(),
+        to_scan=bashup_str,
+        offsets=parse.find_all('@fn', bashup_str)))
+
+
+def main():
+    print('{0:>6} {1:>10} {2:>12} {3:>12} {4:>8}'.format(
+        'fns', 'lines', 'full (s)', 'prescan (s)', 'speedup'))
+
+    for fn_count, filler_per_fn in SCENARIOS:
+        bashup_str = corpus.generate(fn_count, filler_per_fn)
+        assert full_scan(bashup_str) == prescan(bashup_str) == fn_count
+
+        full = min(timeit.repeat(lambda: full_scan(bashup_str), number=1, repeat=3))
+        pre = min(timeit.repeat(lambda: prescan(bashup_str), number=1, repeat=3))
+
+        print('{0:>6} {1:>10} {2:>12.4f} {3:>12.4f} {4:>7.1f}x'.format(
+            fn_count, bashup_str.count('\n'), full, pre, full / pre))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Compares handing a compiled script to bash through a temporary file (the
+fallback) against an in-memory file created with memfd_create.
+
+Each iteration prepares the script and runs it with bash, exactly as
+'bashup --no-cache -r' does. If strace is on the PATH, the file-related
+system calls of each hand-off are counted as well.
+
+Usage: python -m benchmarks.handoff [ITERATIONS]
+"""
+from __future__ import print_function
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from . import corpus
+
+
+SCRIPT = corpus.generate(fn_count=0, filler_per_fn=0) + ': ' * 20000 + '\n'
+
+HANDOFF_ONLY = r'''
+import io, os, sys, tempfile
+script = {script!r}.encode('utf-8')
+if sys.argv[1] == 'temp':
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(script)
+    with open(path, 'rb') as f:
+        f.read()
+    os.unlink(path)
+else:
+    with io.open(os.memfd_create('bashup', 0), 'wb') as f:
+        f.write(script)
+        f.flush()
+        with open('/dev/fd/{{0}}'.format(f.fileno()), 'rb') as g:
+            g.read()
+'''.format(script=SCRIPT)
+
+
+def run_from_temp_file():
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(SCRIPT.encode('utf-8'))
+        subprocess.check_call(('bash', path))
+    finally:
+        os.unlink(path)
+
+
+def run_from_memory():
+    with io.open(os.memfd_create('bashup', 0), 'wb') as f:
+        f.write(SCRIPT.encode('utf-8'))
+        f.flush()
+        subprocess.check_call(
+            ('bash', '/dev/fd/{0}'.format(f.fileno())),
+            pass_fds=(f.fileno(),))
+
+
+def count_syscalls(mode):
+    output = subprocess.check_output(
+        ('strace', '-f', '-c', '-e', 'trace=%file,%desc',
+         sys.executable, '-c', HANDOFF_ONLY, mode),
+        stderr=subprocess.STDOUT)
+    return output.decode('utf-8').strip().splitlines()[-1]
+
+
+def main(argv):
+    iterations = int(argv[0]) if argv else 200
+
+    print('temp file (s):', min(timeit.repeat(run_from_temp_file, number=iterations, repeat=3)))
+    print('memfd     (s):', min(timeit.repeat(run_from_memory, number=iterations, repeat=3)))
+
+    if shutil.which('strace'):
+        print('temp file syscalls:', count_syscalls('temp'))
+        print('memfd     syscalls:', count_syscalls('memfd'))
+    else:
+        print('strace not found; skipping the system call counts')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,51 @@
+"""
+Compares compiling an edited document from scratch against compiling it
+incrementally from the previous version's compilation.
+
+Usage: python -m benchmarks.incremental
+"""
+from __future__ import print_function
+
+import timeit
+
+from bashup.compile.elements import fn
+
+from . import corpus
+
+
+SCENARIOS = (
+    # (functions, filler blocks per function)
+    (100, 10),
+    (500, 2),
+    (1000, 1),
+)
+
+
+def edit_middle_line(bashup_str):
+    middle = bashup_str.index('\n', len(bashup_str) // 2) + 1
+    return bashup_str[:middle] + '# edited\n' + bashup_str[middle:]
+
+
+def main():
+    print('{0:>6} {1:>10} {2:>12} {3:>16} {4:>8}'.format(
+        'fns', 'lines', 'full (s)', 'incremental (s)', 'speedup'))
+
+    for fn_count, filler_per_fn in SCENARIOS:
+        bashup_str = corpus.generate(fn_count, filler_per_fn)
+        edited = edit_middle_line(bashup_str)
+        previous = fn.compile_fns(bashup_str)
+
+        assert (
+            fn.compile_fns(edited, previous=previous).output ==
+            fn.compile_fns(edited).output)
+
+        full = min(timeit.repeat(lambda: fn.compile_fns(edited), number=1, repeat=3))
+        incremental = min(timeit.repeat(
+            lambda: fn.compile_fns(edited, previous=previous), number=1, repeat=3))
+
+        print('{0:>6} {1:>10} {2:>12.4f} {3:>16.4f} {4:>7.1f}x'.format(
+            fn_count, edited.count('\n'), full, incremental, full / incremental))
+
+
+if __name__ == '__main__':
+    main()
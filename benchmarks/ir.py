@@ -0,0 +1,55 @@
+"""
+Compares compiling a document with every optimization pass as a chain of
+string-in, string-out compilers, each of which copies the whole script,
+against compile_document(), which applies the registered stages as edits to
+one set of spans and joins the output once.
+
+Usage: python -m benchmarks.ir [FN_COUNT]
+"""
+from __future__ import print_function
+
+import sys
+import timeit
+
+from bashup import lex
+from bashup.compile import bash
+from bashup.compile import options
+
+from . import dead_fns
+
+
+DEFAULT_FN_COUNT = 1000
+
+COMPILERS = bash.compilers_for(options.DEFAULT_OPTIONS._replace(drop_unused_fns=True, minify=True))
+
+
+def chained(bashup_str):
+    # What compile_to_bash() did before the document IR: each compiler
+    # returns a new string.
+    for c in COMPILERS:
+        bashup_str = c(bashup_str, tokens=lex.tokenize(bashup_str))
+    return bashup_str
+
+
+def spans(bashup_str):
+    return bash.compile_document(bashup_str, compilers=COMPILERS).text()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    fn_count = int(argv[0]) if argv else DEFAULT_FN_COUNT
+    source = dead_fns.library(fn_count)
+
+    assert chained(source) == spans(source)
+
+    chain = min(timeit.repeat(lambda: chained(source), number=1, repeat=5))
+    one = min(timeit.repeat(lambda: spans(source), number=1, repeat=5))
+
+    print('{0:>12} {1:>12} {2:>8}'.format('chained (s)', 'spans (s)', 'speedup'))
+    print('{0:>12.4f} {1:>12.4f} {2:>7.1f}x'.format(chain, one, chain / one))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Measures expanding a macro-heavy document, in which macros use other macros,
+in a single pass with memoized expansions (given the tokens, as
+compile_to_bash() does) compared with substituting the definitions over the
+whole document until nothing changes, using regular expressions which ignore
+quoting. The time to compile the document with and without its macros already
+expanded is shown for comparison.
+
+Usage: python -m benchmarks.macros [USE_COUNT]
+"""
+from __future__ import print_function
+
+import re
+import sys
+import timeit
+
+from bashup import lex
+from bashup.compile import bash
+from bashup.compile.elements import macro
+
+
+DEFAULT_USE_COUNT = 2000
+
+DEFINITIONS = (
+    '@q(x) = "@x"\n'
+    '@log(level, msg) = echo @q([@level]) @q(@msg) >&2\n'
+    '@info(msg) = @log(INFO, @msg)\n'
+    '@warn(msg) = @log(WARN, @msg)\n'
+    '@here = ${BASH_SOURCE[0]}:${LINENO}\n'
+)
+
+
+def document(use_count):
+    """
+    Returns a bashup document with the DEFINITIONS and use_count lines using
+    them, spread over @fns.
+    """
+    uses = ''.join(
+        '@fn step_{i} {{\n'
+        '    @info(step {i} at @here)\n'
+        '    @warn(step {i} is slow)\n'
+        '}}\n'.format(i=i)
+        for i in range(use_count // 2))
+    return DEFINITIONS + uses
+
+
+def substitute_until_unchanged(bashup_str):
+    """
+    Expands the document the simple way: each round substitutes every use of
+    every definition over the whole document, until a round changes nothing.
+    """
+    definitions = {}
+    lines = []
+    for line in bashup_str.splitlines(True):
+        match = re.match(r'@(\w+)(?:\(([^()]*)\))? = (.*)\n', line)
+        if match:
+            params = [p.strip() for p in match.group(2).split(',')] if match.group(2) else []
+            definitions[match.group(1)] = (params, match.group(3))
+        else:
+            lines.append(line)
+    text = ''.join(lines)
+
+    def replace(match):
+        params, body = definitions[match.group(1)]
+        if not params:
+            return body
+        args = [a.strip() for a in match.group(2).split(',')]
+        for param, arg in zip(params, args):
+            body = body.replace('@' + param, arg)
+        return body
+
+    use = re.compile(r'@({0})(?:\(((?:[^()]|\([^()]*\))*)\))?'.format('|'.join(definitions)))
+    while True:
+        expanded = use.sub(replace, text)
+        if expanded == text:
+            return text
+        text = expanded
+
+
+def best_time(fn, repeat=5):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    use_count = int(argv[0]) if argv else DEFAULT_USE_COUNT
+    source = document(use_count)
+    tokens = lex.tokenize(source)
+    expanded = macro.expand_macros(source)
+
+    assert substitute_until_unchanged(source) == expanded
+
+    print('{0:<28} {1:>10}'.format('variant', 'time (ms)'))
+    for name, fn in (
+            ('single pass', lambda: macro.expand_macros(source, tokens)),
+            ('substitute until unchanged', lambda: substitute_until_unchanged(source)),
+            ('compile (already expanded)', lambda: bash.compile_to_bash(expanded)),
+            ('compile (with macros)', lambda: bash.compile_to_bash(source))):
+        print('{0:<28} {1:>10.2f}'.format(name, best_time(fn) * 1000))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Compares compiling many small snippets by calling compile_to_bash() on each
+with compile_many(), in this process and with a pool of worker processes.
+
+Usage: python -m benchmarks.many [SNIPPET_COUNT [WORKERS]]
+"""
+from __future__ import print_function
+
+import multiprocessing
+import sys
+import timeit
+
+from bashup.compile import bash
+
+from . import corpus
+
+
+DEFAULT_SNIPPET_COUNT = 4000
+
+
+def snippets(count):
+    return [('snippet_{0}'.format(i), corpus.FN_BLOCK.format(index=i)) for i in range(count)]
+
+
+def looped(sources):
+    return [bash.compile_to_bash(s) for _, s in sources]
+
+
+def many(sources, workers=None):
+    return [r.output for r in bash.compile_many(sources, workers=workers)]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else DEFAULT_SNIPPET_COUNT
+    workers = int(argv[1]) if len(argv) > 1 else multiprocessing.cpu_count()
+    sources = snippets(count)
+
+    assert looped(sources) == many(sources) == many(sources, workers)
+
+    print('{0:<24} {1:>10}'.format('method', 'time (s)'))
+    for name, fn in (
+            ('compile_to_bash loop', lambda: looped(sources)),
+            ('compile_many', lambda: many(sources)),
+            ('compile_many, {0} workers'.format(workers), lambda: many(sources, workers))):
+        print('{0:<24} {1:>10.4f}'.format(name, min(timeit.repeat(fn, number=1, repeat=3))))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Measures how long it takes to import the bashup CLI, using the interpreter's
+-X importtime option (Python 3.7+), and fails if it regresses past a threshold
+or if modules which should be loaded lazily are imported eagerly.
+
+Usage: python -m benchmarks.startup [THRESHOLD_MS]
+"""
+from __future__ import print_function
+
+import re
+import subprocess
+import sys
+
+
+DEFAULT_THRESHOLD_MS = 50
+
+LAZY_MODULES = (
+    'bashup.compile.bash',
+    'bashup.parse',
+    'jinja2',
+    'pyparsing',
+    'temporary',
+)
+
+__IMPORT_TIME = re.compile(
+    r'^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|(?P<indent>\s+)(?P<module>\S+)$')
+
+
+def import_times(module):
+    """
+    Returns a dict of module name to cumulative import time in microseconds,
+    as reported when importing the given module in a fresh interpreter.
+    """
+    output = subprocess.check_output(
+        (sys.executable, '-X', 'importtime', '-c', 'import ' + module),
+        stderr=subprocess.STDOUT)
+
+    times = {}
+    for line in output.decode('utf-8').splitlines():
+        match = __IMPORT_TIME.match(line)
+        if match:
+            times[match.group('module')] = int(match.group('cumulative'))
+    return times
+
+
+def main(argv):
+    threshold_ms = float(argv[0]) if argv else DEFAULT_THRESHOLD_MS
+
+    # The best of several runs, to smooth over a cold disk cache.
+    runs = [import_times('bashup.__main__') for _ in range(5)]
+    best_ms = min(r['bashup.__main__'] for r in runs) / 1000.0
+    eager = sorted(m for m in LAZY_MODULES if any(m in r for r in runs))
+
+    print('bashup.__main__ import time: {0:.1f} ms (threshold {1:.1f} ms)'.format(
+        best_ms, threshold_ms))
+
+    failed = False
+    if eager:
+        print('FAIL: imported eagerly: ' + ', '.join(eager))
+        failed = True
+    if best_ms > threshold_ms:
+        print('FAIL: import time is over the threshold')
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,242 @@
+"""
+Measures compile throughput and peak memory over synthetic corpora which vary
+the number of @fns, parameters per fn, default value complexity, nesting depth
+and plain-bash filler, and fails if any measurement regresses past its
+committed baseline.
+
+Each time is divided by the time taken, straight after it, to parse a fixed
+bashup sample with a fixed grammar (not bashup's own, which the suite is there
+to measure), so timing baselines recorded on one machine are meaningful on
+another, and a machine whose speed varies over the run still gives steady
+results. Peak memory depends on the Python version, so baselines are kept for
+each interpreter, and the suite only gates on those recorded for the one it
+runs under. Record them again with --update-baselines in any commit which
+changes performance.
+
+Usage: python -m benchmarks.suite [--update-baselines] [--tolerance=FRACTION] [NAME...]
+"""
+from __future__ import print_function
+
+import gc
+import json
+import os
+import platform
+import sys
+import textwrap
+import timeit
+
+import pyparsing as pp
+
+from bashup import parse
+from bashup.compile import bash
+from bashup.compile.elements import fn
+
+from . import corpus
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# A measurement may exceed its baseline by this fraction before it counts as
+# a regression. Timings are noisy; peak memory hardly varies at all.
+DEFAULT_TOLERANCE = 0.25
+
+# Each time is the median of this many runs.
+REPEAT = 11
+
+SCENARIOS = (
+    # (name, corpus.generate_varied() keyword arguments)
+    ('fns', dict(fn_count=200)),
+    ('params', dict(fn_count=40, params=12)),
+    ('defaults', dict(fn_count=40, params=4, default_complexity=3)),
+    ('nesting', dict(fn_count=20, nesting_depth=5)),
+    ('filler', dict(fn_count=20, filler_per_fn=50)),
+)
+
+
+CALIBRATION_SAMPLE = textwrap.dedent("""
+    @fn greet name, greeting='hello', punctuation="${BANG:-!}" {
+        printf '%s, %s%s\\n' "${greeting}" "${name}" "${punctuation}"
+    }
+
+    for name in "${names[@]}"; do
+        greet --name="${name}"
+    done
+""").lstrip() * 25
+
+
+def calibration_parser():
+    """
+    Returns a parser for the @fn headers in CALIBRATION_SAMPLE, built from the
+    same kinds of pyparsing elements as bashup's grammar. Never change it, or
+    every baseline has to be recorded again.
+    """
+    name = pp.Word(pp.alphas + '_', pp.alphanums + '_')
+    quoted = pp.QuotedString("'") | pp.QuotedString('"')
+    value = pp.Combine(pp.OneOrMore(quoted | pp.Word(pp.alphanums + '_-./$')))
+    param = pp.Group(name + pp.Optional(pp.Suppress('=') + value))
+    return pp.Literal('@fn') + name + pp.Group(pp.Optional(pp.delimitedList(param))) + pp.Literal('{')
+
+
+def calibration_scan():
+    """
+    Returns a function which scans CALIBRATION_SAMPLE for @fn headers with
+    the calibration_parser().
+    """
+    parser = calibration_parser()
+
+    def scan():
+        # Like a compile, start each scan with an empty packrat cache.
+        pp.ParserElement.resetCache()
+        return sum(1 for _ in parser.scanString(CALIBRATION_SAMPLE))
+
+    assert scan() == CALIBRATION_SAMPLE.count('@fn')
+    return scan
+
+
+def relative_time(fn, calibration_fn):
+    """
+    Returns the median, over REPEAT runs, of the time fn takes divided by the
+    time calibration_fn takes straight after it.
+    """
+    ratios = sorted(
+        timeit.timeit(fn, number=1) / timeit.timeit(calibration_fn, number=1)
+        for _ in range(REPEAT))
+    return ratios[len(ratios) // 2]
+
+
+def interpreter():
+    """
+    Returns the key under which baselines for this interpreter are kept,
+    such as "cpython-3.11".
+    """
+    return '{0}-{1}.{2}'.format(platform.python_implementation().lower(), *sys.version_info[:2])
+
+
+def measure(bashup_str, calibration_fn):
+    """
+    Returns a dict of measurement name to value for the given document: the
+    times for scanning its @fn headers, rendering them and compiling it end
+    to end (as multiples of the calibration_fn's time), and the peak memory
+    (KiB) used by compiling it.
+    """
+    offsets = list(parse.find_all('@fn', bashup_str))
+
+    def scan():
+        return list(parse.scan_at(parse.FN.parseWithTabs(), bashup_str, offsets))
+
+    fn_specs = [parse.FnSpec.from_parse_result(r) for r, _, _ in scan()]
+
+    def render():
+        return [fn.compile_fn_spec_to_bash(s) for s in fn_specs]
+
+    def compile_():
+        return bash.compile_to_bash(bashup_str)
+
+    results = dict(
+        (name, relative_time(f, calibration_fn))
+        for name, f in (('scan', scan), ('render', render), ('compile', compile_)))
+
+    if tracemalloc is not None:
+        # Collect the garbage left by the timings first, or when the
+        # collector next runs (and so the peak) depends on them.
+        gc.collect()
+        tracemalloc.start()
+        try:
+            compile_()
+            results['peak_kib'] = tracemalloc.get_traced_memory()[1] / 1024.0
+        finally:
+            tracemalloc.stop()
+
+    return results
+
+
+def run(names=None):
+    """
+    Runs the named scenarios (all of them by default) and returns a dict of
+    "scenario.measurement" to value, with times given as multiples of the
+    calibration time.
+    """
+    # Warm up: build the grammar and compile the template.
+    bash.compile_to_bash(corpus.generate(1))
+    calibration_fn = calibration_scan()
+
+    results = {}
+    for name, kwargs in SCENARIOS:
+        if names and name not in names:
+            continue
+        for measurement, value in measure(corpus.generate_varied(**kwargs), calibration_fn).items():
+            results[name + '.' + measurement] = value
+    return results
+
+
+def compare(results, baselines, tolerance):
+    """
+    Yields (key, value, baseline, is_regression) for every result. The
+    baseline is None for results which have none.
+    """
+    for key in sorted(results):
+        baseline = baselines.get(key)
+        yield key, results[key], baseline, (
+            baseline is not None and results[key] > baseline * (1 + tolerance))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    update = '--update-baselines' in argv
+    tolerance = DEFAULT_TOLERANCE
+    names = []
+
+    for arg in argv:
+        if arg.startswith('--tolerance='):
+            tolerance = float(arg.split('=', 1)[1])
+        elif not arg.startswith('--'):
+            names.append(arg)
+
+    results = run(names)
+
+    if os.path.exists(BASELINES_PATH):
+        with open(BASELINES_PATH) as f:
+            # Flat baselines predate per-interpreter ones, and the calibration scan.
+            all_baselines = dict(
+                (key, value) for key, value in json.load(f)['baselines'].items() if isinstance(value, dict))
+    else:
+        all_baselines = {}
+    baselines = all_baselines.setdefault(interpreter(), {})
+
+    if not baselines and not update:
+        print('No baselines for {0}; run with --update-baselines to record them.'.format(interpreter()))
+
+    print('{0:<20} {1:>12} {2:>12} {3:>8}'.format('benchmark', 'result', 'baseline', 'change'))
+
+    regressions = 0
+    for key, value, baseline, is_regression in compare(results, baselines, tolerance):
+        regressions += is_regression
+        print('{0:<20} {1:>12.2f} {2:>12} {3:>8}{4}'.format(
+            key,
+            value,
+            '-' if baseline is None else '{0:.2f}'.format(baseline),
+            '-' if baseline is None else '{0:+.0%}'.format(value / baseline - 1),
+            '  REGRESSION' if is_regression else ''))
+
+    if update:
+        baselines.update((k, float('{0:.4g}'.format(v))) for k, v in results.items())
+        with open(BASELINES_PATH, 'w') as f:
+            json.dump(dict(baselines=all_baselines), f, indent=4, sort_keys=True)
+            f.write('\n')
+        print('Updated the {0} baselines in {1}'.format(interpreter(), BASELINES_PATH))
+        return 0
+
+    if regressions:
+        print('{0} benchmark(s) regressed by more than {1:.0%}.'.format(regressions, tolerance))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,7 +14,7 @@ setup(
     install_requires=(
         'docopt',
         'Jinja2',
-        'pyparsing',
+        'pyparsing>=2.1.6,<3',
         'temporary>=3,<4',),
     tests_require=(
         'contextlib2',